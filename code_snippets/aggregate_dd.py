@@ -1,32 +1,86 @@
+"""Export the DeepDanbooru results of the whole archive as a single CSV (one row per tag, one column per CYOA).
 
+Results are read from the results store that run_dd.py appends to (<database_folder>/dd_results). Folders written by
+older versions of run_dd.py (one folder per uuid with dd.txt and info.txt) can be imported into the store first; only
+CYOAs that are not in the store yet are imported, so this can be run again safely.
+
+Typical usage:
+    python3 aggregate_dd.py -d ../db -o merged_data.csv
+    python3 aggregate_dd.py -d ../db --import_legacy
+
+"""
+import argparse
+import logging
 import os
 import pathlib
 
-import pandas as pd
-
-
-# Taglist
-tag_path='deepdanbooru-v3-20211112-sgd-e28/tags.txt'
-tags_list = []
-with open(tag_path, 'r') as f:
-    for line in f.readlines():
-        tags_list.append(line.strip())
-
-# Scan directory
-data = {}
-folder_path = '../db'
-for item in os.scandir(folder_path):
-    item_path = pathlib.Path(item)
-    if item_path.is_dir():
-        cyoa_title = item_path.stem
-        data_file = pathlib.Path.joinpath(item_path, 'dd.txt')
-        vector = []
-        with open(data_file, 'r') as f:
-            for line in f.readlines():
-                vector.append(float(line.strip()))
-        data[cyoa_title] = vector
-
-# Print to pandas
-df = pd.DataFrame(data)
-df.insert(0, 'tags', tags_list)
-df.to_csv('merged_data.csv')
\ No newline at end of file
+from cyoa_archives.predictor.results import ResultsStore
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Numeric fields of legacy info.txt files; other fields are skipped
+LEGACY_INFO_FIELDS = {'pages': int, 'pixels': int, 'coverage': float, 'timestamp': float}
+
+
+def read_legacy_folder(folder_path):
+    """Read the dd.txt (tag<TAB>average) and info.txt (Key: value) files of a legacy uuid folder."""
+    scores = {}
+    with open(pathlib.Path(folder_path, 'dd.txt')) as f:
+        for line in f:
+            if line.strip():
+                tag, score = line.rstrip('\n').split('\t')
+                scores[tag] = float(score)
+    info = {}
+    info_file = pathlib.Path(folder_path, 'info.txt')
+    if info_file.exists():
+        with open(info_file) as f:
+            for line in f:
+                if ':' not in line:
+                    continue
+                key, value = line.split(':', 1)
+                key = key.strip().lower()
+                if key not in LEGACY_INFO_FIELDS:
+                    # Older versions also wrote the coverage as the threshold
+                    continue
+                try:
+                    info[key] = LEGACY_INFO_FIELDS[key](float(value.strip()))
+                except ValueError:
+                    logger.warning(f'Skipping {key} of {folder_path} (not a number: {value.strip()}).')
+    return scores, info
+
+
+def import_legacy(database_folder, store):
+    """Append the legacy folders of CYOAs that are not in the store yet, so that newer results are never overridden."""
+    known = set(store.load()[0]['uuid'])
+    count = skipped = 0
+    for item in sorted(os.scandir(database_folder), key=lambda item: item.name):
+        if item.is_dir() and pathlib.Path(item.path, 'dd.txt').exists():
+            if item.name in known:
+                skipped += 1
+                continue
+            scores, info = read_legacy_folder(item.path)
+            store.append(item.name, scores, info)
+            count += 1
+    logger.info(f'Imported {count} legacy results ({skipped} already in the store).')
+
+
+def main(database_folder, output_file, legacy):
+    store = ResultsStore(pathlib.Path(database_folder, 'dd_results'))
+    if legacy:
+        import_legacy(database_folder, store)
+    if output_file:
+        df = store.to_frame().T
+        df.index.name = 'tags'
+        df.to_csv(output_file)
+        logger.info(f'Wrote {df.shape[1]} CYOAs x {df.shape[0]} tags to {output_file}.')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export DeepDanbooru results of the archive.")
+    parser.add_argument("-d", "--database_folder", help="Folder with deepdanbooru results", default='../db')
+    parser.add_argument("-o", "--output_file", help="CSV file to write", default='merged_data.csv')
+    parser.add_argument("--import_legacy", help="Import dd.txt/info.txt folders into the results store first",
+                        action='store_true')
+    args = parser.parse_args()
+    main(args.database_folder, args.output_file, args.import_legacy)
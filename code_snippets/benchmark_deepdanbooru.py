@@ -0,0 +1,55 @@
+"""Compare DeepDanbooru inference latency of Keras predict against the compiled inference function.
+
+Typical usage:
+    python3 benchmark_deepdanbooru.py -p deepdanbooru-v3-20211112-sgd-e28 -n 20 -b 1
+
+"""
+import argparse
+import logging
+import time
+
+import numpy as np
+
+from cyoa_archives.predictor.deepdanbooru import DeepDanbooru
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def time_calls(fn, batch, n_iterations):
+    timings = []
+    for i in range(n_iterations):
+        start = time.perf_counter()
+        fn(batch)
+        timings.append(time.perf_counter() - start)
+    return np.array(timings) * 1000
+
+
+def main(project_path, n_iterations, batch_size, threads):
+    dd = DeepDanbooru(project_path, special_tags={}, batch_size=batch_size, intra_op_threads=threads)
+    dd.load()
+    batch = np.random.default_rng(0).random(dd.batch.shape, dtype=np.float32)
+
+    # Warm up both paths before timing
+    dd.model.predict(batch, verbose=0)
+    dd.infer(batch)
+
+    predict_ms = time_calls(lambda x: dd.model.predict(x, verbose=0), batch, n_iterations)
+    infer_ms = time_calls(lambda x: dd.infer(x).numpy(), batch, n_iterations)
+    diff = np.abs(dd.model.predict(batch, verbose=0) - dd.infer(batch).numpy()).max()
+
+    logger.info(f'Batch size: {batch_size} - Iterations: {n_iterations}')
+    logger.info(f'model.predict: median {np.median(predict_ms):.1f}ms - p90 {np.percentile(predict_ms, 90):.1f}ms')
+    logger.info(f'infer:         median {np.median(infer_ms):.1f}ms - p90 {np.percentile(infer_ms, 90):.1f}ms')
+    logger.info(f'Max score difference: {diff}')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark DeepDanbooru inference on CPU.")
+    parser.add_argument("-p", "--project_path", help="DeepDanbooru project folder",
+                        default='deepdanbooru-v3-20211112-sgd-e28')
+    parser.add_argument("-n", "--n_iterations", help="Number of timed calls", type=int, default=20)
+    parser.add_argument("-b", "--batch_size", help="Batch size", type=int, default=1)
+    parser.add_argument("-j", "--threads", help="Intra-op threads (0 lets tensorflow decide)", type=int, default=0)
+    args = parser.parse_args()
+    main(args.project_path, args.n_iterations, args.batch_size, args.threads)
@@ -0,0 +1,48 @@
+"""Time SubstringMatcher with in checks against its trie regex, by number of patterns and length of text.
+
+Patterns never occur in the texts, so every call scans the whole text (the worst case, and the common one: most
+submissions match none of the filters).
+
+Typical usage:
+    python3 benchmark_matcher.py -n 2 5 10 20 50 100 200 500 -l 40 300 3000
+
+"""
+import argparse
+import logging
+import random
+import string
+import timeit
+
+from cyoa_archives.scrapers.matcher import SubstringMatcher
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def random_word(rng, alphabet):
+    return ''.join(rng.choice(alphabet) for _ in range(rng.randint(4, 12)))
+
+
+def main(sizes, lengths, seed):
+    rng = random.Random(seed)
+    for length in lengths:
+        text = ' '.join(random_word(rng, string.ascii_lowercase + '/.') for _ in range(length // 4))[:length]
+        for n_patterns in sizes:
+            # Uppercase patterns never occur in the lowercase text
+            patterns = [random_word(rng, string.ascii_lowercase) + 'Q' for _ in range(n_patterns)]
+            loop = SubstringMatcher(patterns, min_regex_patterns=n_patterns + 1)
+            regex = SubstringMatcher(patterns, min_regex_patterns=0)
+            loop_us = min(timeit.repeat(lambda: loop.search(text), number=1000, repeat=5)) * 1000
+            regex_us = min(timeit.repeat(lambda: regex.search(text), number=1000, repeat=5)) * 1000
+            logger.info(f'{length} characters, {n_patterns} patterns: in checks {loop_us:.1f}us - '
+                        f'trie regex {regex_us:.1f}us')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark SubstringMatcher.")
+    parser.add_argument("-n", "--sizes", help="Numbers of patterns", type=int, nargs='+',
+                        default=[2, 5, 10, 20, 50, 100, 200, 500])
+    parser.add_argument("-l", "--lengths", help="Lengths of texts", type=int, nargs='+', default=[40, 300, 3000])
+    parser.add_argument("-s", "--seed", help="Random seed", type=int, default=0)
+    args = parser.parse_args()
+    main(args.sizes, args.lengths, args.seed)
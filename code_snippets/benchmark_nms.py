@@ -0,0 +1,83 @@
+"""Time KerasOCR non-maximum suppression (suppress_overlaps) against the previous queue-based implementation.
+
+Pages are simulated as dense lines of word boxes where every word is detected twice or three times with jittered
+coordinates (as overlapping ROIs produce), so most boxes are suppressed.
+
+Typical usage:
+    python3 benchmark_nms.py -n 200 500 2000 -t 0.7
+
+"""
+import argparse
+import logging
+import time
+
+import numpy as np
+
+from cyoa_archives.predictor.ocr import KerasOCR
+from cyoa_archives.predictor.roi import BoundingBox, ImageContext
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def queue_nms(rois, threshold):
+    """The previous implementation of KerasOCR.nonmaxima_suppression."""
+    keep_list = []
+    queue = rois
+    while len(queue) > 0:
+        this_item = queue[0]
+        queue_end = queue[1:]
+        intersect_set = BoundingBox.intersect_set(this_item, queue_end, threshold)
+        overlap_list = [queue_end[i] for i in np.where(intersect_set)[0]]
+        if overlap_list:
+            keep = BoundingBox.get_max_area_bbox(this_item, overlap_list)
+            queue = [queue_end[i] for i in np.where(~intersect_set)[0]] + [keep]
+        else:
+            keep_list.append(this_item)
+            queue = queue_end
+    return keep_list
+
+
+def make_page(n_words, rng, width=1200):
+    context = ImageContext(width, n_words * 10)
+    boxes = []
+    x, y = 0, 0
+    for i in range(n_words):
+        length = int(rng.integers(2, 10))
+        if x + length * 12 > width:
+            x, y = 0, y + 30
+        for copy in range(int(rng.integers(2, 4))):
+            dx, dy = rng.integers(-3, 4, size=2)
+            boxes.append(BoundingBox('x' * length, 0, 0, x + dx, x + dx + length * 12, y + dy, y + dy,
+                                     context=context))
+        x += length * 12 + 10
+    rng.shuffle(boxes)
+    return boxes
+
+
+def main(sizes, threshold, seed):
+    rng = np.random.default_rng(seed)
+    for n_words in sizes:
+        boxes = make_page(n_words, rng)
+
+        start = time.perf_counter()
+        old = queue_nms(boxes, threshold)
+        old_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        new = KerasOCR.nonmaxima_suppression(boxes, threshold)
+        new_ms = (time.perf_counter() - start) * 1000
+
+        same = {id(b) for b in old} == {id(b) for b in new}
+        logger.info(f'{len(boxes)} boxes: queue {old_ms:.1f}ms ({len(old)} kept) - '
+                    f'suppress_overlaps {new_ms:.1f}ms ({len(new)} kept) - identical: {same}')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark KerasOCR non-maximum suppression.")
+    parser.add_argument("-n", "--sizes", help="Number of words per page", type=int, nargs='+',
+                        default=[200, 500, 2000])
+    parser.add_argument("-t", "--threshold", help="Suppression threshold", type=float, default=0.7)
+    parser.add_argument("-s", "--seed", help="Random seed", type=int, default=0)
+    args = parser.parse_args()
+    main(args.sizes, args.threshold, args.seed)
@@ -0,0 +1,171 @@
+"""Differential check of KerasOCR.chunk_rois against the previous queue-based merge.
+
+The previous implementation took the first chunk of a queue, merged it with every chunk its box overlapped, and put
+the union hull back at the end of the queue. Chunks are compared as sets of the words they contain. The previous
+implementation dropped the first chunk of every union (losing its word); this check keeps it, since that bug was
+fixed on purpose.
+
+The queue merge emits a chunk once nothing in the queue overlaps it, but a hull merged later can still grow over it,
+so its output depends on the order of the queue and may contain overlapping chunks. Pages where the two differ are
+also compared against the queue merge repeated until no two chunks overlap.
+
+With -i, word boxes are detected by keras_ocr on every page in a folder (each page read as a single ROI). Otherwise,
+synthetic pages of option boxes (titles, descriptions and cost labels in a grid) are generated.
+
+Typical usage:
+    python3 check_chunk_merge.py -i pages/
+    python3 check_chunk_merge.py -n 200
+
+"""
+import argparse
+import logging
+import pathlib
+import time
+
+import cv2
+import numpy as np
+
+from cyoa_archives.predictor.ocr import KerasOCR
+from cyoa_archives.predictor.roi import BoundingBox, Chunk, CyoaROI, ImageContext
+from cyoa_archives.util.functions import overlapping_pairs
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def queue_merge(queue):
+    """The previous merge loop of KerasOCR.chunk_rois (keeping the head of each union) on padded chunks."""
+    chunks = []
+    while len(queue) > 0:
+        this_item = queue[0]
+        queue_end = queue[1:]
+        intersect_set = Chunk.intersect_set(this_item, queue_end)
+        overlap_list = [queue_end[i] for i in np.where(intersect_set)[0]]
+        if overlap_list:
+            queue = [queue_end[i] for i in np.where(~intersect_set)[0]] + [Chunk.union([this_item] + overlap_list)]
+        else:
+            chunks.append(this_item)
+            queue = queue_end
+    return chunks
+
+
+def queue_chunk_rois(rois, padding_factor, repeat=False):
+    """Pad the boxes like KerasOCR.chunk_rois and merge them with queue_merge (repeated until stable if set)."""
+    queue = [chunk for chunk in (Chunk.from_bbox(roi) for roi in rois) if chunk.is_valid()]
+    median_char_width = np.median([roi.len_char for roi in rois])
+    pad_x = int(median_char_width * padding_factor)
+    pad_y = int(median_char_width * padding_factor / 0.7)
+    for item in queue:
+        item.pad_xy(pad_x, pad_y)
+    chunks = queue_merge(queue)
+    while repeat:
+        merged = queue_merge(chunks)
+        repeat = len(merged) < len(chunks)
+        chunks = merged
+    return chunks
+
+
+def as_sets(chunks):
+    return sorted(sorted(id(box) for box in chunk.boxes) for chunk in chunks)
+
+
+def make_page(rng, width=1200):
+    """A page of option boxes in a grid: a large title, a cost label and a few lines of description each."""
+    n_columns = int(rng.integers(1, 5))
+    n_rows = int(rng.integers(2, 8))
+    box_width = width // n_columns
+    box_height = int(rng.integers(150, 400))
+    context = ImageContext(width, n_rows * box_height + 100)
+    boxes = []
+
+    def add_line(x, y, x_end, char_width, n_words):
+        for word in range(n_words):
+            length = int(rng.integers(1, 10))
+            if x + length * char_width > x_end:
+                return
+            jitter = rng.integers(-2, 3, size=2)
+            boxes.append(BoundingBox('x' * length, 0, 0, x + jitter[0], x + jitter[0] + length * char_width,
+                                     y + jitter[1], y + jitter[1], context=context))
+            x += length * char_width + int(char_width * rng.uniform(0.8, 3))
+
+    for row in range(n_rows):
+        for column in range(n_columns):
+            x0 = column * box_width + int(rng.integers(10, 40))
+            y0 = row * box_height + int(rng.integers(10, 40))
+            x1 = (column + 1) * box_width - int(rng.integers(10, 40))
+            add_line(x0, y0, x1, int(rng.integers(14, 30)), int(rng.integers(1, 5)))
+            add_line(x1 - 120, y0 + int(rng.integers(-10, 40)), x1, int(rng.integers(8, 14)), 2)
+            char_width = int(rng.integers(6, 12))
+            y = y0 + 60
+            for line in range(int(rng.integers(0, 8))):
+                add_line(x0 + int(rng.integers(0, 20)), y, x1, char_width, 20)
+                y += int(char_width / 0.7 * rng.uniform(1.2, 2.5))
+        # Occasional diagonal captions, whose hulls cover words they do not touch
+        if rng.random() < 0.3:
+            char_width = int(rng.integers(8, 16))
+            x, y = int(rng.integers(0, width // 2)), row * box_height + int(rng.integers(0, box_height))
+            for step in range(int(rng.integers(2, 6))):
+                add_line(x, y, width, char_width, 1)
+                x += int(rng.integers(20, 80))
+                y += int(char_width / 0.7 * rng.uniform(0.8, 2))
+    return boxes
+
+
+def detect_page(engine, image_path):
+    """Detect the word boxes of a page with keras_ocr, reading the whole page as a single ROI."""
+    cv = cv2.imread(str(image_path))
+    context = ImageContext.from_cv(cv, name=image_path.stem)
+    roi = CyoaROI(cv, 0, 0, cv.shape[0] * cv.shape[1], image_path)
+    return engine.read_roi(roi, context)
+
+
+def main(input_folder, n_pages, padding_factor, seed):
+    if input_folder:
+        engine = KerasOCR()
+        pages = [(path.name, detect_page(engine, path)) for path in sorted(pathlib.Path(input_folder).iterdir())]
+    else:
+        rng = np.random.default_rng(seed)
+        pages = [(f'synthetic_{i}', make_page(rng)) for i in range(n_pages)]
+
+    equal = equal_repeated = n_boxes = 0
+    old_s = new_s = 0
+    logging.getLogger('cyoa_archives').setLevel(logging.WARNING)
+    for name, rois in pages:
+        rois = sorted(rois, key=lambda b: b.ymin)
+        if not rois:
+            equal += 1
+            equal_repeated += 1
+            continue
+        n_boxes += len(rois)
+
+        start = time.perf_counter()
+        new = as_sets(KerasOCR.chunk_rois(rois, padding_factor))
+        new_s += time.perf_counter() - start
+        start = time.perf_counter()
+        old_chunks = queue_chunk_rois(rois, padding_factor)
+        old_s += time.perf_counter() - start
+        old = as_sets(old_chunks)
+
+        if new == old:
+            equal += 1
+            equal_repeated += 1
+        elif new == as_sets(queue_chunk_rois(rois, padding_factor, repeat=True)):
+            equal_repeated += 1
+            n_overlaps = len(overlapping_pairs([[c.xmin, c.ymin, c.xmax, c.ymax] for c in old_chunks]))
+            logger.info(f'{name}: {len(old)} queue chunks ({n_overlaps} overlapping pairs) - {len(new)} chunks - '
+                        f'equal once the queue merge is repeated')
+        else:
+            logger.warning(f'{name}: {len(old)} queue chunks - {len(new)} chunks - different')
+    logger.info(f'{len(pages)} pages ({n_boxes} boxes): equal to the queue merge on {equal}, '
+                f'and to the repeated queue merge on {equal_repeated}')
+    logger.info(f'Queue merge: {old_s:.2f}s - chunk_rois: {new_s:.2f}s')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare KerasOCR.chunk_rois against the previous queue merge.")
+    parser.add_argument("-i", "--input_folder", help="Folder of CYOA pages to detect words in with keras_ocr")
+    parser.add_argument("-n", "--n_pages", help="Number of synthetic pages", type=int, default=200)
+    parser.add_argument("-p", "--padding_factor", help="Padding in character widths", type=float, default=1)
+    parser.add_argument("--seed", help="Random seed for synthetic pages", type=int, default=0)
+    args = parser.parse_args()
+    main(args.input_folder, args.n_pages, args.padding_factor, args.seed)
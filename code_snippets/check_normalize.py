@@ -0,0 +1,62 @@
+"""Differential check of the batch submission normalizer against RedditSubmission.
+
+Processes a dump of raw submissions (e.g. from PulseshiftAPIWrapper.scrape_json, one JSON object per line) both with
+normalize_submissions and one RedditSubmission at a time, and reports any cell where the two DataFrames differ, and
+the time taken by each.
+
+Typical usage:
+    python3 check_normalize.py -c ../config.yaml -i submissions.jsonl -l
+
+"""
+import argparse
+import copy
+import json
+import logging
+import time
+
+import pandas as pd
+import yaml
+
+from cyoa_archives.scrapers.normalize import normalize_submissions
+from cyoa_archives.scrapers.submission import RedditSubmission
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main(config_file, input_file, remove_low_score):
+    with open(config_file) as f:
+        config = yaml.safe_load(f)
+    RedditSubmission.load_config(config.get('reddit_scraper'))
+    with open(input_file) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+
+    start = time.perf_counter()
+    old = pd.DataFrame.from_dict([dict(RedditSubmission(copy.deepcopy(record), remove_low_score))
+                                  for record in records])
+    old_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    new = normalize_submissions(records, remove_low_score)
+    new_s = time.perf_counter() - start
+
+    old = old.drop(columns='parser_timestamp')
+    new = new.drop(columns='parser_timestamp')
+    if list(old.columns) != list(new.columns):
+        logger.warning(f'Columns differ: {list(old.columns)} != {list(new.columns)}')
+    else:
+        differences = old.compare(new)
+        for row, values in differences.head(10).iterrows():
+            logger.warning(f'Mismatch in row {row}: {values.dropna().to_dict()}')
+        logger.info(f'{len(records)} submissions - {len(differences)} mismatching rows')
+    logger.info(f'RedditSubmission: {old_s:.2f}s - normalize_submissions: {new_s:.2f}s')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare normalize_submissions against RedditSubmission.")
+    parser.add_argument("-c", "--config_file", help="Configuration file to use", required=True)
+    parser.add_argument("-i", "--input_file", help="JSON lines file of raw submissions", required=True)
+    parser.add_argument("-l", "--remove_low_score", help="Classify low score submissions as not CYOAs",
+                        action='store_true')
+    args = parser.parse_args()
+    main(args.config_file, args.input_file, args.remove_low_score)
@@ -0,0 +1,95 @@
+"""Differential check of the URL extractor in cyoa_archives.scrapers.urls against the previous regex.
+
+Runs both extractors on a corpus of selftexts and reports any text where the extracted URLs differ, and the time
+taken by each. The corpus is read from a JSON lines file of submissions (e.g. a Pulseshift dump; the selftext and url
+fields are used) or a text file with one selftext per line. Synthetic texts with markdown links, parentheses,
+punctuation, e-mail addresses and long URLs are always included.
+
+Typical usage:
+    python3 check_url_extractor.py -i submissions.jsonl
+
+"""
+import argparse
+import json
+import logging
+import random
+import re
+import time
+
+from cyoa_archives.scrapers.urls import extract_urls
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+OLD_PATTERN = re.compile(
+    r"""(?i)\b((?:https?:(?:/{1,3}|[a-z0-9%])|[a-z0-9.\-]+[.](?:com|net|org|edu|gov|mil|aero|asia|biz|cat|coop|info|int|jobs|mobi|museum|name|post|pro|tel|travel|xxx|ac|ad|ae|af|ag|ai|al|am|an|ao|aq|ar|as|at|au|aw|ax|az|ba|bb|bd|be|bf|bg|bh|bi|bj|bm|bn|bo|br|bs|bt|bv|bw|by|bz|ca|cc|cd|cf|cg|ch|ci|ck|cl|cm|cn|co|cr|cs|cu|cv|cx|cy|cz|dd|de|dj|dk|dm|do|dz|ec|ee|eg|eh|er|es|et|eu|fi|fj|fk|fm|fo|fr|ga|gb|gd|ge|gf|gg|gh|gi|gl|gm|gn|gp|gq|gr|gs|gt|gu|gw|gy|hk|hm|hn|hr|ht|hu|id|ie|il|im|in|io|iq|ir|is|it|je|jm|jo|jp|ke|kg|kh|ki|km|kn|kp|kr|kw|ky|kz|la|lb|lc|li|lk|lr|ls|lt|lu|lv|ly|ma|mc|md|me|mg|mh|mk|ml|mm|mn|mo|mp|mq|mr|ms|mt|mu|mv|mw|mx|my|mz|na|nc|ne|nf|ng|ni|nl|no|np|nr|nu|nz|om|pa|pe|pf|pg|ph|pk|pl|pm|pn|pr|ps|pt|pw|py|qa|re|ro|rs|ru|rw|sa|sb|sc|sd|se|sg|sh|si|sj|Ja|sk|sl|sm|sn|so|sr|ss|st|su|sv|sx|sy|sz|tc|td|tf|tg|th|tj|tk|tl|tm|tn|to|tp|tr|tt|tv|tw|tz|ua|ug|uk|us|uy|uz|va|vc|ve|vg|vi|vn|vu|wf|ws|ye|yt|yu|za|zm|zw)/)(?:[^\s()<>{}\[\]]+|\([^\s()]*?\([^\s()]+\)[^\s()]*?\)|\([^\s]+?\))+(?:\([^\s()]*?\([^\s()]+\)[^\s()]*?\)|\([^\s]+?\)|[^\s`!()\[\]{};:'".,<>?«»“”‘’])|(?:(?<!@)[a-z0-9]+(?:[.\-][a-z0-9]+)*[.](?:com|net|org|edu|gov|mil|aero|asia|biz|cat|coop|info|int|jobs|mobi|museum|name|post|pro|tel|travel|xxx|ac|ad|ae|af|ag|ai|al|am|an|ao|aq|ar|as|at|au|aw|ax|az|ba|bb|bd|be|bf|bg|bh|bi|bj|bm|bn|bo|br|bs|bt|bv|bw|by|bz|ca|cc|cd|cf|cg|ch|ci|ck|cl|cm|cn|co|cr|cs|cu|cv|cx|cy|cz|dd|de|dj|dk|dm|do|dz|ec|ee|eg|eh|er|es|et|eu|fi|fj|fk|fm|fo|fr|ga|gb|gd|ge|gf|gg|gh|gi|gl|gm|gn|gp|gq|gr|gs|gt|gu|gw|gy|hk|hm|hn|hr|ht|hu|id|ie|il|im|in|io|iq|ir|is|it|je|jm|jo|jp|ke|kg|kh|ki|km|kn|kp|kr|kw|ky|kz|la|lb|lc|li|lk|lr|ls|lt|lu|lv|ly|ma|mc|md|me|mg|mh|mk|ml|mm|mn|mo|mp|mq|mr|ms|mt|mu|mv|mw|mx|my|mz|na|nc|ne|nf|ng|ni|nl|no|np|nr|nu|nz|om|pa|pe|pf|pg|ph|pk|pl|pm|pn|pr|ps|pt|pw|py|qa|re|ro|rs|ru|rw|sa|sb|sc|sd|se|sg|sh|si|sj|Ja|sk|sl|sm|sn|so|sr|ss|st|su|sv|sx|sy|sz|tc|td|tf|tg|th|tj|tk|tl|tm|tn|to|tp|tr|tt|tv|tw|tz|ua|ug|uk|us|uy|uz|va|vc|ve|vg|vi|vn|vu|wf|ws|ye|yt|yu|za|zm|zw)\b/?(?!@)))""")
+
+WORDS = ['CYOA', 'choose', 'your', 'own', 'adventure', 'v1.2', 'e.g.', 'i.e.', 'Mr.', '3.5', '(WIP)', 'link:', ':)',
+         'U.S.', 'end.', '"quoted"', '»x«', '...', 'a@b.com', '@user', 'x-y', '1.0.3']
+URLS = ['https://imgur.com/a/AbC12', 'http://i.imgur.com/xyz.png', 'imgur.com/gallery/QLfAhNT', 'www.reddit.com',
+        'https://en.wikipedia.org/wiki/Foo_(bar)', 'https://example.com/a(b(c)d)e', 'example.co.uk/path?q=1&r=2',
+        'https://cyoa.neocities.org/', 'mega.nz/#!abc!def', 'https://docs.google.com/document/d/1a2b/edit',
+        'http:foo', 'https://x.com/(unclosed', 'foo.community/bar', 'sub.domain.io', 'test.JA/x', 'abc.museum',
+        'https://itch.io/game' + 'a' * 60 + '.', 'user@mail.com', 'https://a.b/c[d]e', 'HTTPS://IMGUR.COM/A/B',
+        'http://' + '!' * 12]
+WRAPPERS = ['{}', '[link]({})', '({})', '<{}>', '"{}"', '{}.', '{},', '{}!', '{})', '**{}**', '«{}»', '({}).']
+
+
+def synthetic_corpus(n_texts, seed=0):
+    rng = random.Random(seed)
+    texts = []
+    for i in range(n_texts):
+        tokens = []
+        for j in range(rng.randint(5, 80)):
+            if rng.random() < 0.2:
+                tokens.append(rng.choice(WRAPPERS).format(rng.choice(URLS)))
+            else:
+                tokens.append(rng.choice(WORDS))
+        texts.append(rng.choice([' ', '\n', '  \t']).join(tokens))
+    return texts
+
+
+def read_corpus(input_file):
+    texts = []
+    with open(input_file) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                texts.append(line)
+                continue
+            if isinstance(record, dict):
+                texts.append(f"{record.get('selftext') or ''} {record.get('url') or ''}")
+    return texts
+
+
+def main(input_file, n_texts):
+    texts = synthetic_corpus(n_texts)
+    if input_file:
+        texts = read_corpus(input_file) + texts
+    texts = [text.replace('\\', '') for text in texts]
+
+    start = time.perf_counter()
+    old = [OLD_PATTERN.findall(text) for text in texts]
+    old_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    new = [extract_urls(text) for text in texts]
+    new_s = time.perf_counter() - start
+
+    mismatches = 0
+    for text, old_urls, new_urls in zip(texts, old, new):
+        if old_urls != new_urls:
+            mismatches += 1
+            if mismatches <= 10:
+                logger.warning(f'Mismatch: {old_urls} != {new_urls} in {text[:200]!r}')
+    logger.info(f'{len(texts)} texts - {sum(len(u) for u in old)} urls - {mismatches} mismatches')
+    logger.info(f'Previous regex: {old_s:.2f}s - extract_urls: {new_s:.2f}s')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the URL extractor against the previous regex.")
+    parser.add_argument("-i", "--input_file", help="JSON lines file of submissions, or one selftext per line")
+    parser.add_argument("-n", "--n_texts", help="Number of synthetic texts", type=int, default=5000)
+    args = parser.parse_args()
+    main(args.input_file, args.n_texts)
@@ -0,0 +1,78 @@
+"""Report how much the quantized TFLite DeepDanbooru backend moves the special tag scores.
+
+Both backends sample the same random windows from every image in a folder, and the per-tag averages (scaled by 100,
+as reported to Grist) are compared.
+
+Typical usage:
+    python3 dd_quantization_report.py -c config.yaml -i temp -q dynamic
+
+"""
+import argparse
+import logging
+import pathlib
+import random
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from cyoa_archives.predictor.deepdanbooru import DeepDanbooru
+from cyoa_archives.predictor.image import CyoaImage
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def sample_folder(dd, image_paths, coverage, seed):
+    all_data = {}
+    start = time.perf_counter()
+    for i, image_path in enumerate(image_paths):
+        random.seed(seed + i)
+        this_dd_data = CyoaImage(image_path).run_deepdanbooru_random(dd, coverage=coverage)
+        for tag in dd.special_tags:
+            all_data.setdefault(tag, []).extend(this_dd_data.get(tag, []))
+    elapsed = time.perf_counter() - start
+    averages = {tag: np.average(values) * 100 if values else 0 for tag, values in all_data.items()}
+    return averages, elapsed
+
+
+def main(config, image_folder, quantization, seed):
+    predictor_config = config.get('predictor')
+    image_paths = []
+    for extension in ['*.png', '*.jpg', '*.jpeg', '*.webp']:
+        image_paths.extend(image_folder.rglob(extension))
+    logger.info(f'Found {len(image_paths)} images.')
+
+    results = {}
+    timings = {}
+    for backend in ['keras', 'tflite']:
+        dd = DeepDanbooru(predictor_config.get('model_path'), special_tags=predictor_config.get('dd_tags'),
+                          threshold=predictor_config.get('dd_threshold'), backend=backend, quantization=quantization)
+        results[backend], timings[backend] = sample_folder(dd, image_paths, predictor_config.get('coverage'), seed)
+
+    report = pd.DataFrame(results)
+    report['diff'] = report['tflite'] - report['keras']
+    print(report.to_string(float_format=lambda x: f'{x:.2f}'))
+    print(f'Max absolute difference: {report["diff"].abs().max():.2f}')
+    print(f'Time (s): keras {timings["keras"]:.1f} - tflite ({quantization}) {timings["tflite"]:.1f}')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare keras and quantized TFLite DeepDanbooru scores.")
+    parser.add_argument("-c", "--config_file", help="Configuration file to use")
+    parser.add_argument("-i", "--image_folder", help="Folder of CYOA images to sample")
+    parser.add_argument("-q", "--quantization", help="TFLite quantization (none, dynamic, float16)", default='dynamic')
+    parser.add_argument("-s", "--seed", help="Random seed for window sampling", type=int, default=0)
+    args = parser.parse_args()
+
+    filepath = pathlib.Path(args.config_file)
+    try:
+        with open(filepath) as f:
+            config = yaml.safe_load(f)
+    except OSError:
+        logger.error(f"Could not read file: {filepath.resolve()}")
+        sys.exit(1)
+
+    main(config, pathlib.Path(args.image_folder), args.quantization, args.seed)
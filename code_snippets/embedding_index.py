@@ -0,0 +1,42 @@
+"""Build and query the nearest-CYOA index over DeepDanbooru embeddings.
+
+run_dd.py appends one embedding per CYOA to <database_folder>/embeddings when dd_embeddings is enabled in the
+predictor configuration. This script builds the index offline and prints the closest CYOAs to a given uuid.
+
+Typical usage:
+    python3 embedding_index.py -d database -b
+    python3 embedding_index.py -d database -q 0a1b2c3d-... -k 10
+
+"""
+import argparse
+import logging
+import pathlib
+
+from cyoa_archives.predictor.embedding import EmbeddingStore, EmbeddingIndex
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main(database_folder, build, query, k, n_lists, n_probe):
+    index_path = pathlib.Path(database_folder, 'embedding_index')
+    if build:
+        ids, vectors = EmbeddingStore(pathlib.Path(database_folder, 'embeddings')).load()
+        EmbeddingIndex.build(index_path, ids, vectors, n_lists=n_lists)
+        logger.info(f'Wrote index to {index_path.resolve()}.')
+    if query:
+        index = EmbeddingIndex(index_path)
+        for uuid, score in index.search_id(query, k=k, n_probe=n_probe):
+            print(f'{uuid}\t{score:.4f}')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or query the CYOA embedding index.")
+    parser.add_argument("-d", "--database_folder", help="Folder with deepdanbooru results", default='database')
+    parser.add_argument("-b", "--build", help="Rebuild the index from the embedding store", action='store_true')
+    parser.add_argument("-q", "--query", help="uuid of a CYOA to find neighbours of")
+    parser.add_argument("-k", "--k", help="Number of neighbours", type=int, default=10)
+    parser.add_argument("-l", "--n_lists", help="Number of inverted lists (default: sqrt of CYOAs)", type=int)
+    parser.add_argument("-p", "--n_probe", help="Number of inverted lists to scan", type=int, default=8)
+    args = parser.parse_args()
+    main(args.database_folder, args.build, args.query, args.k, args.n_lists, args.n_probe)
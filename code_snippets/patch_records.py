@@ -27,8 +27,7 @@ def main(config, password):
     pulse = PulseshiftAPIWrapper(pc_config)
 
     # Fetch data from pulseshift
-    pulse_data = pulse.scrape('makeyourchoice', size=300, after=1586842926)
-    pulse_pd = pd.DataFrame.from_dict(pulse_data)
+    pulse_pd = pulse.scrape_pd('makeyourchoice', size=300, after=1586842926)
 
     # Fetch data from grist
     grist_pd = api.fetch_table_pd('Records', col_names=['id', 'r_id', 'is_cyoa'])
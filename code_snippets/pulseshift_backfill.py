@@ -0,0 +1,50 @@
+"""Backfill a subreddit from the Pulseshift API into JSON lines shard files, resuming any previous run.
+
+Typical usage:
+    python3 pulseshift_backfill.py -c ../config.yaml -s makeyourchoice -a 1586842926 -b 1672531200 -d ../db/pulseshift
+    python3 pulseshift_backfill.py -c ../config.yaml -s makeyourchoice -d ../db/pulseshift -o makeyourchoice.csv
+
+"""
+import argparse
+import logging
+import sys
+
+import yaml
+
+from cyoa_archives.scrapers.backfill import PulseshiftBackfill
+from cyoa_archives.scrapers.pulseshift import PulseshiftAPIWrapper
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main(config, subreddit_name, after, before, output_dir, workers, output_file):
+    api = PulseshiftAPIWrapper(config.get('reddit_scraper'))
+    backfill = PulseshiftBackfill(api, output_dir, workers=workers)
+    complete = backfill.run(subreddit_name, after=after, before=before)
+    if not complete:
+        logger.warning('Some shards are incomplete; run the same command again to resume them.')
+    if output_file:
+        df = backfill.to_pd(subreddit_name)
+        df.to_csv(output_file, index=False)
+        logger.info(f'Wrote {len(df)} submissions to {output_file}.')
+    return complete
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill a subreddit from the Pulseshift API.")
+    parser.add_argument("-c", "--config_file", help="Configuration file to use", required=True)
+    parser.add_argument("-s", "--subreddit", help="Subreddit name (without r/)", required=True)
+    parser.add_argument("-a", "--after", help="Unix timestamp to start from (defaults to the previous run or 0)",
+                        type=int)
+    parser.add_argument("-b", "--before", help="Unix timestamp to stop at (defaults to the previous run or now)",
+                        type=int)
+    parser.add_argument("-d", "--output_dir", help="Folder for shard files and checkpoints", default='../db/pulseshift')
+    parser.add_argument("-w", "--workers", help="Number of shards fetched concurrently", type=int)
+    parser.add_argument("-o", "--output_file", help="Also write the processed submissions to a CSV file")
+    args = parser.parse_args()
+
+    with open(args.config_file) as f:
+        config = yaml.safe_load(f)
+    if not main(config, args.subreddit, args.after, args.before, args.output_dir, args.workers, args.output_file):
+        sys.exit(1)
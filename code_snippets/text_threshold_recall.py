@@ -0,0 +1,141 @@
+"""Measure the recall of the tesseract text prefilter (CvChunk.get_text_score) at several thresholds.
+
+With -i, every page in a folder is chunked without the prefilter; a row chunk is labeled as text if tesseract finds
+words in it (confidence >= 70), which is what CyoaImage.get_text keeps. With -s, chunks are synthesized instead:
+text is rendered with the given fonts at random sizes, contrasts and backgrounds, and chunks without text are flat,
+gradient, noisy or bordered backgrounds.
+
+For each threshold we report the recall (text chunks kept) and the fraction of chunks without text that are skipped.
+
+Typical usage:
+    python3 text_threshold_recall.py -i pages/
+    python3 text_threshold_recall.py -s 2000 -f /usr/share/fonts/truetype/dejavu
+
+"""
+import argparse
+import logging
+import pathlib
+import random
+
+import cv2
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from cyoa_archives.predictor.cv import CvChunk
+from cyoa_archives.predictor.image import CyoaImage
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+THRESHOLDS = [0.005, 0.01, 0.02, 0.03, 0.05, 0.08]
+BACKGROUNDS = ['flat', 'gradient', 'noise', 'blobs']
+WORDS = ('choose your power perk drawback companion gain the ability to summon cost points world magic sword '
+         'you will start in a city of the kingdom with your items 100 cp +200 free').split()
+
+
+def random_background(rng: random.Random, kind: str, height: int, width: int) -> np.ndarray:
+    color = np.array([rng.randint(0, 255) for _ in range(3)], dtype=np.float32)
+    if kind == 'flat':
+        image = np.tile(color, (height, width, 1))
+    elif kind == 'gradient':
+        other = np.array([rng.randint(0, 255) for _ in range(3)], dtype=np.float32)
+        t = np.linspace(0, 1, width, dtype=np.float32)[None, :, None]
+        image = np.broadcast_to(color * (1 - t) + other * t, (height, width, 3))
+    elif kind == 'noise':
+        # Paper or fabric textures
+        image = color + np.random.default_rng(rng.randrange(2 ** 32)).normal(0, 15, (height, width, 3))
+    else:
+        # Soft, photo-like shapes
+        image = np.tile(color, (height, width, 1))
+        for _ in range(rng.randint(3, 12)):
+            center = (rng.randrange(width), rng.randrange(height))
+            axes = (rng.randint(10, max(11, width // 3)), rng.randint(10, max(11, height // 2)))
+            cv2.ellipse(image, center, axes, rng.randrange(180), 0, 360,
+                        [rng.randint(0, 255) for _ in range(3)], -1)
+        image = cv2.GaussianBlur(image, (0, 0), 4)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def synthesize(rng: random.Random, fonts, kind: str, with_text: bool) -> np.ndarray:
+    width = rng.randint(200, 1200)
+    if not with_text:
+        image = random_background(rng, kind, rng.randint(30, 400), width)
+        if rng.random() < 0.3:
+            # Borders and separators of option boxes
+            cv2.rectangle(image, (2, 2), (width - 3, image.shape[0] - 3),
+                          [rng.randint(0, 255) for _ in range(3)], rng.randint(1, 4))
+        return image
+
+    size = rng.randint(9, 40)
+    font = ImageFont.truetype(str(rng.choice(fonts)), size)
+    lines = [' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 12))) for _ in range(rng.randint(1, 4))]
+    height = int(len(lines) * size * 1.4) + rng.randint(10, 60)
+    background = random_background(rng, kind, height, width)
+    image = Image.fromarray(cv2.cvtColor(background, cv2.COLOR_BGR2RGB))
+    draw = ImageDraw.Draw(image)
+    y = rng.randint(3, 20)
+    contrast = rng.randint(80, 200)
+    for line in lines:
+        # Pick a text color that stands out from the background under the line, as designers do
+        x = rng.randint(3, 40)
+        local = background[y:y + size, x:x + size * len(line) // 2].mean()
+        value = int(np.clip(local + contrast if local < 128 else local - contrast, 0, 255))
+        draw.text((x, y), line, font=font, fill=(value, value, value))
+        y += int(size * 1.4)
+    return cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR)
+
+
+def synthetic_scores(n_chunks, font_folder, seed):
+    rng = random.Random(seed)
+    fonts = sorted(pathlib.Path(font_folder).glob('*.ttf'))
+    scores, labels, kinds = [], [], []
+    for i in range(n_chunks):
+        with_text = i % 2 == 0
+        kind = BACKGROUNDS[i // 2 % len(BACKGROUNDS)]
+        scores.append(CvChunk(synthesize(rng, fonts, kind, with_text), 0, 0).get_text_score())
+        labels.append(with_text)
+        kinds.append(kind)
+    return np.array(scores), np.array(labels), np.array(kinds)
+
+
+def page_scores(input_folder):
+    scores, labels = [], []
+    for image_path in sorted(pathlib.Path(input_folder).iterdir()):
+        cyoa_image = CyoaImage(image_path)
+        cyoa_image.make_chunks(text_threshold=0)
+        for chunk in cyoa_image.chunks:
+            scores.append(chunk.get_text_score())
+            labels.append(bool(chunk.get_text(minimum_conf=70).strip()))
+        logger.info(f'{image_path.name}: {len(cyoa_image.chunks)} chunks')
+    return np.array(scores), np.array(labels), np.full(len(labels), 'page')
+
+
+def report(scores, labels, name):
+    logger.info(f'{name}: {labels.sum()} chunks with text, {(~labels).sum()} without')
+    for threshold in THRESHOLDS:
+        keep = scores >= threshold
+        recall = keep[labels].mean() if labels.any() else float('nan')
+        skipped = (~keep[~labels]).mean() if (~labels).any() else float('nan')
+        logger.info(f'  threshold {threshold}: recall {recall:.3f}, skipped without text {skipped:.3f}')
+
+
+def main(input_folder, n_chunks, font_folder, seed):
+    if input_folder:
+        scores, labels, kinds = page_scores(input_folder)
+    else:
+        scores, labels, kinds = synthetic_scores(n_chunks, font_folder, seed)
+    report(scores, labels, 'all')
+    if not input_folder:
+        for kind in BACKGROUNDS:
+            report(scores[kinds == kind], labels[kinds == kind], kind)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the recall of the tesseract text prefilter.")
+    parser.add_argument("-i", "--input_folder", help="Folder of CYOA pages (labels chunks with tesseract)")
+    parser.add_argument("-s", "--synthetic", help="Number of synthetic chunks", type=int, default=2000)
+    parser.add_argument("-f", "--font_folder", help="Folder of .ttf fonts for synthetic chunks",
+                        default='/usr/share/fonts/truetype/dejavu')
+    parser.add_argument("--seed", help="Random seed for synthetic chunks", type=int, default=0)
+    args = parser.parse_args()
+    main(args.input_folder, args.synthetic, args.font_folder, args.seed)
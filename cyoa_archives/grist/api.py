@@ -136,7 +136,8 @@ class GristAPIWrapper:
                        record_dicts: List[Dict[str, Any]],
                        chunk_size: int = None,
                        mock: bool = True,
-                       prompt: bool = True
+                       prompt: bool = True,
+                       group_if_needed: bool = False
                        ) -> None:
         """Update records in Grist based on their id.
 
@@ -145,6 +146,7 @@ class GristAPIWrapper:
         :param chunk_size: Passing chunk_size argument to Grist API.
         :param mock: Does not actually perform the update if set to True.
         :param prompt: Prompts the user for confirmation if set to True.
+        :param group_if_needed: Allow records with different sets of columns (patched in one request per set).
         """
         if mock:
             logger.info(record_dicts)
@@ -155,6 +157,7 @@ class GristAPIWrapper:
                 if confirm_submit.lower() not in ["y", "yes"]:
                     return None
             logger.info(f'GRIST: Attempting to PATCH records in [{table_name}] at {self.document_id}...')
-            response = self.api.update_records(table_name, record_dicts=record_dicts, chunk_size=chunk_size)
+            response = self.api.update_records(table_name, record_dicts=record_dicts, chunk_size=chunk_size,
+                                               group_if_needed=group_if_needed)
             logger.info(f'GRIST: Successfully patched {len(record_dicts)} records at [{table_name}].')
             return response
@@ -7,45 +7,29 @@ import pathlib
 import re
 import shutil
 import subprocess
+import time
 
-from typing import Dict
+from typing import Dict, List
 
 import imagehash
 import pandas as pd
 
 from PIL import Image
-from strsimpy.metric_lcs import MetricLCS
-from strsimpy.ngram import NGram
 
 from cyoa_archives.grist.api import GristAPIWrapper
+from cyoa_archives.grist.titles import TitleIndex
 from cyoa_archives.scrapers.praw import PrawAPIWrapper
 
 logger = logging.getLogger(__name__)
 
+# Submission metrics that change after a post is added to Grist
+METRIC_FIELDS = ['score', 'num_comments', 'upvote_ratio', 'total_awards_received']
+GRIST_CHUNK_SIZE = 500
+
 
 def find_closest_cyoa(title, cyoa_df):
-    # Loop through records and find nearest match
-    metriclcs = MetricLCS()
-    fourgram = NGram(4)
-
-    processed_text = re.sub(r'([\(\[]).*?([\)\]])', '', title)
-    processed_text = re.sub(r'[^A-Za-z0-9 ]+', '', processed_text)
-    processed_text = " ".join(processed_text.split()).replace('CYOA', '')
-    if processed_text:
-        mlcs = cyoa_df['official_title'].apply(lambda x: metriclcs.distance(processed_text, x))
-        fg = cyoa_df['official_title'].apply(lambda x: fourgram.distance(processed_text, x))
-        st = pd.DataFrame({
-            'cyoa': cyoa_df['id'],
-            'mlcs': mlcs,
-            'fg': fg,
-            'avg': (mlcs + fg) / 2
-        })
-        st.sort_values(by=['avg'], ascending=True, inplace=True)
-        min_st = st.iloc[0]
-        delta = st.iloc[1].avg - st.iloc[0].avg
-        if (min_st.mlcs < 0.2) and (min_st.fg < 0.2) and (delta > 0.3):
-            return int(min_st.cyoa)
-    return None
+    # To match many titles, build a TitleIndex once and use match_many
+    return TitleIndex(cyoa_df).match(title)
 
 def hash_static_url(static_url, temp_dir):
     if static_url:
@@ -97,6 +81,7 @@ def praw_fetch_add_update(config: Dict) -> None:
 
     grist_records_pd = api.fetch_table_pd('Records', col_names=['id', 'r_id'])
     grist_cyoa_pd = api.fetch_table_pd('CYOAs', col_names=['id', 'official_title'])
+    title_index = TitleIndex(grist_cyoa_pd)
 
     for subreddit in ['nsfwcyoa', 'makeyourchoice', 'InteractiveCYOA', 'allsync_mirror']:
 
@@ -120,7 +105,7 @@ def praw_fetch_add_update(config: Dict) -> None:
 
         # Next add new records
         new_pd = praw_pd.loc[~praw_pd['r_id'].isin(grist_records_pd['r_id'])]
-        new_pd['cyoa'] = new_pd['title'].apply(find_closest_cyoa, cyoa_df=grist_cyoa_pd)
+        new_pd['cyoa'] = title_index.match_many(new_pd['title'])
         new_pd['image_hashes'] = new_pd['static_url'].apply(hash_static_url, temp_dir=config.get('project').get('temp_dir'))
         add_pd = new_pd[[
             'author', 'created_utc', 'cyoa', 'r_id', 'is_self', 'link_flair_text', 'num_comments', 'permalink',
@@ -132,6 +117,59 @@ def praw_fetch_add_update(config: Dict) -> None:
         api.add_records('Records', add_object, mock=False, prompt=False)
 
 
+def changed_metrics(records_pd: pd.DataFrame, fresh_pd: pd.DataFrame, fields: List[str]) -> List[Dict]:
+    """Compare metrics of Grist records with freshly fetched values.
+
+    :param records_pd: A dataframe of Grist records with the columns id, r_id and fields.
+    :param fresh_pd: A dataframe of fetched submissions with the columns r_id and fields.
+    :param fields: Names of the metrics to compare.
+    :return: A list of Grist updates (id, parser_timestamp and the fields that changed) of records that changed.
+    """
+    merged = pd.merge(records_pd, fresh_pd, on='r_id', suffixes=('_old', ''))
+    parser_timestamp = int(time.time())
+    updates = []
+    for row in merged.to_dict(orient='records'):
+        update = {}
+        for field in fields:
+            old, new = row.get(field + '_old'), row.get(field)
+            if new is None or pd.isna(new) or (old == new) or (pd.isna(old) and pd.isna(new)):
+                continue
+            update[field] = new.item() if hasattr(new, 'item') else new
+        if update:
+            update['id'] = int(row['id'])
+            update['parser_timestamp'] = parser_timestamp
+            updates.append(update)
+    return updates
+
+
+def praw_refresh_metrics(config: Dict, chunk_size: int = GRIST_CHUNK_SIZE) -> None:
+    """Refresh the score, comments, upvote ratio and awards of every record in the Grist Records table.
+
+    Submissions are fetched from reddit's info endpoint in batches of 100 (see PrawAPIWrapper.fetch_info) and only
+    the metrics that changed are written back, in chunks of chunk_size records.
+
+    :param config: A config dictionary object
+    :param chunk_size: Maximum number of records per Grist request.
+    """
+    # Set up API
+    api = GristAPIWrapper.from_config(config.get('grist'))
+    praw = PrawAPIWrapper(config.get('reddit_scraper'))
+
+    grist_records_pd = api.fetch_table_pd('Records', col_names=['id', 'r_id'] + METRIC_FIELDS)
+    if grist_records_pd is None:
+        return None
+    grist_records_pd = grist_records_pd.loc[grist_records_pd['r_id'].notna() & grist_records_pd['r_id'].astype(bool)]
+    r_ids = grist_records_pd['r_id'].drop_duplicates().tolist()
+
+    # Fetch current metrics from reddit and write back the changes
+    fresh_pd = pd.DataFrame.from_records(list(praw.fetch_info(r_ids, METRIC_FIELDS)),
+                                         columns=['r_id'] + METRIC_FIELDS)
+    updates = changed_metrics(grist_records_pd, fresh_pd, METRIC_FIELDS)
+    logger.info(f'Refreshed {len(fresh_pd)} of {len(r_ids)} records; {len(updates)} changed.')
+    if updates:
+        api.update_records('Records', updates, chunk_size=chunk_size, mock=False, prompt=False, group_if_needed=True)
+
+
 def grist_fetch_deepl(config: Dict) -> pd.DataFrame:
     """Fetch a list of CYOAs from Grist that have been marked for Deep Learning.
 
@@ -0,0 +1,257 @@
+"""Matching reddit post titles to the official titles of CYOAs
+
+Provides an index over the official titles of the CYOAs table that finds the CYOA a post title refers to.
+
+A title matches a CYOA if, among all official titles, the closest one (by the average of the MetricLCS and 4-gram
+distances) has both distances below 0.2, and the second closest is more than 0.3 further away. Computing both
+distances against every official title is slow (they are quadratic in the title lengths and run in pure python), so
+the index does it in three steps:
+
+1. Retrieve the official titles with the highest TF-IDF cosine similarity of character 4-grams (a sparse matrix
+   product), and compute the exact distances of these candidates.
+2. Compute lower bounds of both distances against all official titles at once (vectorized), and add the titles that
+   could pass the distance thresholds to the candidates. The LCS of two strings is at most the overlap of their
+   character counts. The 4-gram distance is bounded from strsimpy's dynamic program (see TitleIndex.lower_bounds),
+   not by the difference in length: its first column wraps around to the last one, so a short string can be
+   matched against a long one repeated.
+3. If the closest candidate passes the thresholds, compute the exact distances of every title whose lower bound is
+   within 0.3 of it, since any of them could be the second closest.
+
+The result is the same as comparing against every official title.
+
+Typical usage example:
+
+  index = TitleIndex(grist_cyoa_pd)
+  cyoa_id = index.match('My new CYOA (v2)')
+  cyoa_ids = index.match_many(titles)
+
+"""
+
+import logging
+import re
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+from strsimpy.metric_lcs import MetricLCS
+from strsimpy.ngram import NGram
+
+logger = logging.getLogger(__name__)
+
+NGRAM_SIZE = 4
+DEFAULT_CANDIDATES = 10
+
+# Acceptance rule of a match
+MAX_DISTANCE = 0.2
+MIN_DELTA = 0.3
+
+# Margin for rounding errors when comparing lower bounds against exact distances
+EPSILON = 1e-9
+
+BRACKETS_REGEX = re.compile(r'([\(\[]).*?([\)\]])')
+NON_ALPHANUMERIC_REGEX = re.compile(r'[^A-Za-z0-9 ]+')
+
+
+def normalize_title(title: str) -> str:
+    """Remove bracketed text, punctuation, extra whitespace and the word CYOA from a post title."""
+    text = BRACKETS_REGEX.sub('', title)
+    text = NON_ALPHANUMERIC_REGEX.sub('', text)
+    return " ".join(text.split()).replace('CYOA', '')
+
+
+def char_ngrams(text: str, n: int = NGRAM_SIZE) -> List[str]:
+    """Split a text into overlapping character n-grams (case-insensitive, padded with spaces)."""
+    padded = f' {text.lower()} '
+    return [padded[i:i + n] for i in range(max(len(padded) - n + 1, 1))]
+
+
+def dp_ngrams(text: str, n: int = NGRAM_SIZE) -> List[str]:
+    """Split a text into the n-grams compared by strsimpy's NGram distance (case-sensitive, left-padded with newlines).
+
+    The j-th n-gram ends with the j-th character of the text.
+    """
+    padded = '\n' * (n - 1) + text
+    return [padded[i:i + n] for i in range(len(text))]
+
+
+def ngram_masks(gram: str) -> List[Tuple[int, str]]:
+    """Get the keys shared by two n-grams if and only if they differ in at most one character."""
+    return [(i, gram[:i] + gram[i + 1:]) for i in range(len(gram))]
+
+
+class TitleIndex:
+    """An index of official CYOA titles for finding the CYOA a post title refers to."""
+
+    def __init__(self, cyoa_df: pd.DataFrame, id_column: str = 'id', title_column: str = 'official_title',
+                 n_candidates: int = DEFAULT_CANDIDATES):
+        """Build the index.
+
+        :param cyoa_df: A dataframe of CYOAs.
+        :param id_column: Column of the CYOA ids.
+        :param title_column: Column of the official titles (missing titles never match).
+        :param n_candidates: Number of titles retrieved by TF-IDF similarity for each query.
+        """
+        self.ids = cyoa_df[id_column].to_numpy()
+        self.titles = [title if isinstance(title, str) else '' for title in cyoa_df[title_column]]
+        self.n_candidates = n_candidates
+        self.metriclcs = MetricLCS()
+        self.fourgram = NGram(NGRAM_SIZE)
+
+        # TF-IDF matrix (titles x 4-grams), with L2-normalized rows
+        self.vocabulary = {}
+        rows, columns = [], []
+        for row, title in enumerate(self.titles):
+            for gram in char_ngrams(title):
+                rows.append(row)
+                columns.append(self.vocabulary.setdefault(gram, len(self.vocabulary)))
+        shape = (len(self.titles), len(self.vocabulary))
+        tf = scipy.sparse.csr_matrix((np.ones(len(rows)), (rows, columns)), shape=shape)
+        document_frequency = np.bincount(tf.indices, minlength=shape[1])
+        self.idf = np.log((1 + shape[0]) / (1 + document_frequency)) + 1
+        self.tfidf = self.normalize_rows(tf @ scipy.sparse.diags(self.idf))
+
+        # Character counts (titles x characters) and lengths, for the lower bounds of the distances
+        self.alphabet = {char: i for i, char in enumerate(sorted(set(''.join(self.titles))))}
+        self.char_counts = np.zeros((len(self.titles), len(self.alphabet)), dtype=np.int32)
+        for row, title in enumerate(self.titles):
+            for char in title:
+                self.char_counts[row, self.alphabet[char]] += 1
+        self.lengths = np.array([len(title) for title in self.titles])
+
+        # Counts of the 4-grams compared by NGram (titles x 4-grams), and the keys of the 4-grams one character away
+        self.dp_vocabulary = {}
+        self.mask_vocabulary = {}
+        rows, columns = [], []
+        for row, title in enumerate(self.titles):
+            for gram in dp_ngrams(title):
+                rows.append(row)
+                columns.append(self.dp_vocabulary.setdefault(gram, len(self.dp_vocabulary)))
+        self.dp_counts = scipy.sparse.csr_matrix((np.ones(len(rows)), (rows, columns)),
+                                                 shape=(len(self.titles), len(self.dp_vocabulary)))
+        self.dp_masks = np.array([[self.mask_vocabulary.setdefault(key, len(self.mask_vocabulary))
+                                   for key in ngram_masks(gram)] for gram in self.dp_vocabulary],
+                                 dtype=np.int64).reshape(-1, NGRAM_SIZE)
+
+    @staticmethod
+    def normalize_rows(matrix: scipy.sparse.csr_matrix) -> scipy.sparse.csr_matrix:
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        return scipy.sparse.csr_matrix(scipy.sparse.diags(1 / norms) @ matrix)
+
+    def vectorize(self, texts: List[str]) -> scipy.sparse.csr_matrix:
+        """Get the TF-IDF vectors of texts (4-grams that do not occur in any official title are ignored)."""
+        rows, columns = [], []
+        for row, text in enumerate(texts):
+            for gram in char_ngrams(text):
+                column = self.vocabulary.get(gram)
+                if column is not None:
+                    rows.append(row)
+                    columns.append(column)
+        shape = (len(texts), len(self.vocabulary))
+        tf = scipy.sparse.csr_matrix((np.ones(len(rows)), (rows, columns)), shape=shape)
+        return self.normalize_rows(tf @ scipy.sparse.diags(self.idf))
+
+    def lower_bounds(self, text: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Get lower bounds of the MetricLCS and 4-gram distances between a non-empty text and every official title.
+
+        NGram.distance(text, title) is the cost of a path through a dynamic program with one row per 4-gram of the
+        title (see dp_ngrams) and one column per 4-gram of the text, divided by the longer length. Every row is
+        entered by a diagonal step, which costs the fraction of differing characters of the two 4-grams, or by a step
+        of cost 1. The first column reads the last column of the previous row (a wrapped 4-gram: the last character
+        of the text and padding), and the last column of the row before it, so a step of cost 1 may enter two rows.
+        A row thus costs at least 1/4 if its 4-gram is not one of the text, another 1/4 if no 4-gram of the text is
+        one character away from it, and at most 1/2 is counted per row. Below 4 characters, NGram compares the
+        characters at the same positions instead, so the distance is at least the difference in length.
+        """
+        counts = np.zeros(len(self.alphabet), dtype=np.int32)
+        for char in text:
+            column = self.alphabet.get(char)
+            if column is not None:
+                counts[column] += 1
+        overlap = np.minimum(self.char_counts, counts).sum(axis=1)
+        max_lengths = np.maximum(self.lengths, len(text))
+        mlcs = 1 - overlap / max_lengths
+
+        grams = set(dp_ngrams(text)) | {text[-1] + '\n' * (NGRAM_SIZE - 1)}
+        is_gram = np.zeros(len(self.dp_vocabulary), dtype=bool)
+        is_gram[[self.dp_vocabulary[gram] for gram in grams if gram in self.dp_vocabulary]] = True
+        is_mask = np.zeros(len(self.mask_vocabulary), dtype=bool)
+        is_mask[[self.mask_vocabulary[key] for gram in grams for key in ngram_masks(gram)
+                 if key in self.mask_vocabulary]] = True
+        is_near = is_gram | is_mask[self.dp_masks].any(axis=1)
+        row_costs = np.minimum(((~is_gram).astype(float) + ~is_near) / NGRAM_SIZE, 0.5)
+        fg = (self.dp_counts @ row_costs) / max_lengths
+        is_short = (self.lengths < NGRAM_SIZE) | (len(text) < NGRAM_SIZE)
+        fg[is_short] = (np.abs(self.lengths - len(text)) / max_lengths)[is_short]
+        return mlcs, fg
+
+    def distances(self, text: str, indices: Iterable[int]) -> dict:
+        """Compute the exact (mlcs, fg, avg) distances between a text and some official titles."""
+        result = {}
+        for i in indices:
+            mlcs = self.metriclcs.distance(text, self.titles[i])
+            fg = self.fourgram.distance(text, self.titles[i])
+            result[i] = (mlcs, fg, (mlcs + fg) / 2)
+        return result
+
+    def match_normalized(self, text: str, candidates: Iterable[int]) -> Optional[int]:
+        """Find the CYOA matching a normalized title, starting from some candidate official titles.
+
+        :param text: A normalized title (see normalize_title).
+        :param candidates: Indices of official titles to compare first.
+        :return: The id of the matching CYOA, or None.
+        """
+        if not text or len(self.titles) < 2:
+            return None
+        mlcs_bound, fg_bound = self.lower_bounds(text)
+        avg_bound = (mlcs_bound + fg_bound) / 2
+
+        # Exact distances of the candidates and of every title that could pass the thresholds
+        could_pass = np.flatnonzero((mlcs_bound < MAX_DISTANCE + EPSILON) & (fg_bound < MAX_DISTANCE + EPSILON))
+        scores = self.distances(text, set(candidates) | set(could_pass.tolist()))
+        if not scores:
+            return None
+        best = min(scores, key=lambda i: scores[i][2])
+        mlcs, fg, avg = scores[best]
+        if not (mlcs < MAX_DISTANCE and fg < MAX_DISTANCE):
+            return None
+
+        # Exact distances of every title that could be within MIN_DELTA of the best one
+        close = np.flatnonzero(avg_bound <= avg + MIN_DELTA + EPSILON)
+        scores.update(self.distances(text, [i for i in close.tolist() if i not in scores]))
+        ranked = sorted(scores.values(), key=lambda score: score[2])
+        if ranked[0][2] < avg:
+            # A title that cannot pass the thresholds is closer
+            return None
+        if len(ranked) > 1 and not (ranked[1][2] - ranked[0][2] > MIN_DELTA):
+            return None
+        return int(self.ids[best])
+
+    def match(self, title: str) -> Optional[int]:
+        """Find the CYOA a post title refers to.
+
+        :param title: A post title.
+        :return: The id of the matching CYOA, or None.
+        """
+        return self.match_many([title])[0]
+
+    def match_many(self, titles: Iterable[str]) -> List[Optional[int]]:
+        """Find the CYOAs that post titles refer to, retrieving the candidates of all titles in one sparse product.
+
+        :param titles: Post titles.
+        :return: The id of the matching CYOA (or None) for each title.
+        """
+        texts = [normalize_title(title) for title in titles]
+        if not texts:
+            return []
+        similarity = (self.vectorize(texts) @ self.tfidf.T).tocsr()
+        matches = []
+        for row, text in enumerate(texts):
+            start, end = similarity.indptr[row], similarity.indptr[row + 1]
+            indices, values = similarity.indices[start:end], similarity.data[start:end]
+            if len(values) > self.n_candidates:
+                top = np.argpartition(-values, self.n_candidates)[:self.n_candidates]
+                indices = indices[top]
+            matches.append(self.match_normalized(text, indices.tolist()))
+        return matches
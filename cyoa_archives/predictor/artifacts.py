@@ -0,0 +1,94 @@
+"""Derived model artifacts that are cached next to a project.
+
+Building an artifact (e.g. converting a model or indexing a tags file) can be slow, so the result is written into the
+project folder and recorded in a manifest. The manifest stores the size and modification time of the source files
+and the checksum of the artifact; an artifact is rebuilt if its sources changed or its contents do not match.
+
+Typical usage example:
+
+  artifacts = ProjectArtifacts('deepdanbooru-v3-20211112-sgd-e28')
+  path = artifacts.get('tags.npy', ['tags.txt'], build=write_tag_index)
+
+"""
+
+import json
+import logging
+import os
+import pathlib
+from typing import Callable, Dict, List
+
+from .cache import hash_file
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'artifacts.json'
+
+
+def stat_file(file_path: pathlib.Path) -> Dict[str, int]:
+    stat = os.stat(file_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+class ProjectArtifacts:
+    """Builds, validates and records artifacts derived from the files of a project folder."""
+
+    def __init__(self, project_path: pathlib.Path):
+        """Initializes ProjectArtifacts, loading the manifest if it exists.
+
+        :param project_path: Path to the project folder.
+        """
+        self.project_path = pathlib.Path(project_path)
+        self.manifest_path = pathlib.Path(self.project_path, MANIFEST_NAME)
+        self.manifest = {}
+        if self.manifest_path.exists():
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+
+    def is_valid(self, name: str, sources: List[str]) -> bool:
+        """Check that an artifact exists, was built from the current sources and has not been modified.
+
+        :param name: File name of the artifact in the project folder.
+        :param sources: File names of the source files in the project folder.
+        :return: True if the artifact can be used as is.
+        """
+        entry = self.manifest.get(name)
+        artifact_path = pathlib.Path(self.project_path, name)
+        if entry is None or not artifact_path.exists():
+            return False
+        current_sources = {source: stat_file(pathlib.Path(self.project_path, source)) for source in sources}
+        if entry.get('sources') != current_sources:
+            logger.info(f'ARTIFACT: Sources of {name} changed.')
+            return False
+        if entry.get('sha256') != hash_file(artifact_path):
+            logger.warning(f'ARTIFACT: Checksum of {name} does not match the manifest.')
+            return False
+        return True
+
+    def get(self, name: str, sources: List[str], build: Callable[[List[pathlib.Path], pathlib.Path], None]
+            ) -> pathlib.Path:
+        """Get the path to a valid artifact, building it first if necessary.
+
+        :param name: File name of the artifact in the project folder.
+        :param sources: File names of the source files in the project folder.
+        :param build: Function taking the source paths and the output path that writes the artifact.
+        :return: Path to the artifact.
+        """
+        artifact_path = pathlib.Path(self.project_path, name)
+        if self.is_valid(name, sources):
+            return artifact_path
+
+        logger.info(f'ARTIFACT: Building {name}...')
+        source_paths = [pathlib.Path(self.project_path, source) for source in sources]
+        build(source_paths, artifact_path)
+        self.manifest[name] = {
+            'sources': {source: stat_file(path) for source, path in zip(sources, source_paths)},
+            'sha256': hash_file(artifact_path)
+        }
+        self.save()
+        return artifact_path
+
+    def save(self) -> None:
+        temp_path = self.manifest_path.with_suffix('.tmp')
+        with open(temp_path, 'w') as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(temp_path, self.manifest_path)
@@ -0,0 +1,317 @@
+"""Content-addressed cache for per-page analysis results.
+
+Pages are identified by a hash of their file bytes, combined with the parameters of the pipeline that analysed them.
+Each entry is a compressed numpy archive of named arrays, so no pickling is involved. The cache is bounded by size
+and evicts the least recently used entries first.
+
+Reposted or updated CYOAs often contain the same pages re-encoded with different bytes. PageRegistry maps a
+perceptual fingerprint of each page to the hash of the first copy seen, so later copies reuse its cache entries. The
+fingerprint only finds candidate pages: an update that edits option text or points barely changes it, so a candidate
+is only reused if a pixel diff against a stored, block-averaged copy of it confirms that nothing has changed. These
+copies are stored as entries of the PageCache, so they count towards its size and are evicted like any other entry.
+
+Typical usage example:
+
+  cache = PageCache('cache', max_size=2 * 1024 ** 3)
+  registry = PageRegistry('cache/pages.jsonl', cache)
+  page_hash = registry.resolve(image_path)
+  key = cache.make_key(page_hash, {'analysis': 'ocr'})
+  arrays = cache.load(key)
+  if arrays is None:
+      cache.save(key, {'scores': np.zeros(10)})
+      registry.register(page_hash)
+
+"""
+
+import hashlib
+import json
+import logging
+import os
+import pathlib
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List
+
+import cv2
+import imagehash
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Bump this whenever the analysis code changes in a way that invalidates cached results
+PIPELINE_VERSION = 1
+DEFAULT_MAX_SIZE = 2 * 1024 ** 3
+PHASH_SIZE = 16
+COLORHASH_BITS = 3
+
+# Pixel diff used to confirm a fingerprint match: pages are compared as grayscale means of 4x4 pixel blocks. Re-encoding
+# a page as JPEG (quality 50 and up) changes block means by at most 15; editing a single 11px character changes them by
+# more than 35.
+REFERENCE_BLOCK = 4
+MAX_PIXEL_DIFF = 24
+
+
+def hash_file(file_path: pathlib.Path, block_size: int = 1024 * 1024) -> str:
+    """Compute the sha256 hash of a file's contents.
+
+    :param file_path: Path to the file to hash.
+    :param block_size: Number of bytes to read at a time.
+    :return: The hex digest of the file contents.
+    """
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def fingerprint_image(file_path: pathlib.Path) -> Dict[str, str]:
+    """Compute a perceptual fingerprint of an image that survives re-encoding.
+
+    :param file_path: Path to the image.
+    :return: A dictionary with the image dimensions, perceptual hash and color hash.
+    """
+    with Image.open(file_path) as img:
+        width, height = img.size
+        rgb = img.convert('RGB')
+        p_hash = imagehash.phash(rgb, hash_size=PHASH_SIZE)
+        color_hash = imagehash.colorhash(rgb, binbits=COLORHASH_BITS)
+    return {
+        'dim': f'{width}x{height}',
+        'phash': str(p_hash),
+        'colorhash': str(color_hash)
+    }
+
+
+def reference_image(file_path: pathlib.Path) -> np.ndarray:
+    """Compute the block-averaged grayscale copy of an image used to confirm that two pages are the same.
+
+    :param file_path: Path to the image.
+    :return: A uint8 array of the mean of each REFERENCE_BLOCK x REFERENCE_BLOCK block of pixels.
+    """
+    with Image.open(file_path) as img:
+        gray = np.asarray(img.convert('L'))
+    height, width = gray.shape
+    dim = (max(1, width // REFERENCE_BLOCK), max(1, height // REFERENCE_BLOCK))
+    return cv2.resize(gray, dim, interpolation=cv2.INTER_AREA)
+
+
+class PageRegistry:
+    """Maps perceptual page fingerprints to the content hash of the first copy of each page that was seen.
+
+    Two pages are candidates if they have the same dimensions and their perceptual and color hashes are within a
+    small hamming distance of each other. A candidate only matches if no block of its reference image (see
+    reference_image) differs by more than max_pixel_diff. Reference images are kept in a PageCache; registered pages
+    whose reference image was evicted never match.
+    """
+
+    def __init__(self, registry_path: pathlib.Path, cache: 'PageCache', max_distance: int = 32,
+                 max_color_distance: int = 2, max_pixel_diff: int = MAX_PIXEL_DIFF):
+        """Initializes a PageRegistry, loading any existing registry file.
+
+        :param registry_path: Path to an append-only JSON lines file to keep the registry in.
+        :param cache: The PageCache to keep reference images in.
+        :param max_distance: Maximum hamming distance between perceptual hashes (out of 256 bits).
+        :param max_color_distance: Maximum hamming distance between color hashes.
+        :param max_pixel_diff: Maximum difference between two blocks of the reference images of matching pages.
+        """
+        self.registry_path = pathlib.Path(registry_path)
+        self.cache = cache
+        self.max_distance = max_distance
+        self.max_color_distance = max_color_distance
+        self.max_pixel_diff = max_pixel_diff
+
+        # Pages are bucketed by their dimensions, since only pages of the same size can match
+        self.pages = {}
+        self.hashes = set()
+        self.size = 0
+        if self.registry_path.exists():
+            with open(self.registry_path) as f:
+                for line in f:
+                    if line.strip():
+                        self.add(json.loads(line))
+        logger.info(f'REGISTRY: Found {self.size} pages at {self.registry_path.resolve()}.')
+
+        # Pages resolved to their own hash, waiting for their results to be saved (see register)
+        self.pending = {}
+
+    def add(self, entry: Dict[str, str]) -> None:
+        bucket = self.pages.setdefault(entry['dim'], [])
+        bucket.append((
+            imagehash.hex_to_hash(entry['phash']),
+            imagehash.hex_to_flathash(entry['colorhash'], COLORHASH_BITS),
+            entry['page_hash']
+        ))
+        self.hashes.add(entry['page_hash'])
+        self.size += 1
+
+    @staticmethod
+    def get_reference_key(page_hash: str) -> str:
+        return PageCache.make_key(page_hash, {'reference_block': REFERENCE_BLOCK})
+
+    def candidates(self, fingerprint: Dict[str, str]) -> List[str]:
+        """Find the registered pages whose fingerprints are close to a fingerprint.
+
+        :param fingerprint: A fingerprint returned by fingerprint_image.
+        :return: The page hashes of the candidates, closest first.
+        """
+        p_hash = imagehash.hex_to_hash(fingerprint['phash'])
+        color_hash = imagehash.hex_to_flathash(fingerprint['colorhash'], COLORHASH_BITS)
+        candidates = []
+        for other_p_hash, other_color_hash, page_hash in self.pages.get(fingerprint['dim'], []):
+            distance = p_hash - other_p_hash
+            if distance <= self.max_distance and color_hash - other_color_hash <= self.max_color_distance:
+                candidates.append((distance, page_hash))
+        return [page_hash for distance, page_hash in sorted(candidates, key=lambda candidate: candidate[0])]
+
+    def find(self, fingerprint: Dict[str, str], reference: np.ndarray) -> Optional[str]:
+        """Find a registered page with a close fingerprint whose pixels are confirmed to be the same.
+
+        :param fingerprint: A fingerprint returned by fingerprint_image.
+        :param reference: The reference image of the page, returned by reference_image.
+        :return: The page hash of the closest matching registered page, or None if there is no match.
+        """
+        for page_hash in self.candidates(fingerprint):
+            arrays = self.cache.load(self.get_reference_key(page_hash))
+            if arrays is None:
+                continue
+            other = arrays['reference']
+            if other.shape != reference.shape:
+                continue
+            diff = int(np.abs(reference.astype(np.int16) - other.astype(np.int16)).max())
+            if diff <= self.max_pixel_diff:
+                return page_hash
+            logger.debug(f'REGISTRY: Page {page_hash} has a close fingerprint but differs by {diff}.')
+        return None
+
+    def resolve(self, file_path: pathlib.Path) -> str:
+        """Get the page hash to use for a page.
+
+        If the page is new (or changed), its own content hash is returned; call register once its results have been
+        saved so that later copies can reuse them.
+
+        :param file_path: Path to the page image.
+        :return: The content hash of the first registered copy of this page, or of this page if there is none.
+        """
+        # Copies with the same bytes are the same page
+        page_hash = hash_file(file_path)
+        if page_hash in self.hashes:
+            return page_hash
+
+        fingerprint = fingerprint_image(file_path)
+        reference = reference_image(file_path)
+        match = self.find(fingerprint, reference)
+        if match:
+            logger.debug(f'REGISTRY: {file_path.name} matches a known page ({match}).')
+            return match
+
+        self.pending[page_hash] = (dict(fingerprint, page_hash=page_hash), reference)
+        return page_hash
+
+    def register(self, page_hash: str) -> None:
+        """Register a page returned by resolve, after its results have been saved.
+
+        :param page_hash: A page hash returned by resolve (already registered pages are ignored).
+        """
+        if page_hash not in self.pending:
+            return
+        entry, reference = self.pending.pop(page_hash)
+        self.cache.save(self.get_reference_key(page_hash), {'reference': reference})
+        self.add(entry)
+        with open(self.registry_path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+
+
+class PageCache:
+    """A size-bounded, least-recently-used cache of numpy arrays on disk."""
+
+    def __init__(self, cache_dir: pathlib.Path, max_size: int = DEFAULT_MAX_SIZE):
+        """Initializes a PageCache, indexing any entries already on disk.
+
+        :param cache_dir: Directory to keep cache entries in (created if it does not exist).
+        :param max_size: Maximum total size of the cache in bytes.
+        """
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.max_size = max_size
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # Index existing entries from oldest to newest use
+        self.entries = OrderedDict()
+        paths = sorted(self.cache_dir.glob('*/*.npz'), key=lambda p: p.stat().st_mtime)
+        for path in paths:
+            self.entries[path.stem] = path.stat().st_size
+        self.size = sum(self.entries.values())
+        logger.info(f'CACHE: Found {len(self.entries)} entries ({self.size} bytes) at {self.cache_dir.resolve()}.')
+
+    @staticmethod
+    def make_key(page_hash: str, params: Dict[str, Any]) -> str:
+        """Make a cache key from the hash of a page and the parameters used to analyse it.
+
+        :param page_hash: Hash of the page contents (see hash_file and PageRegistry.resolve).
+        :param params: JSON-serializable pipeline parameters.
+        :return: A hex string identifying the cache entry.
+        """
+        h = hashlib.sha256()
+        h.update(page_hash.encode())
+        h.update(json.dumps(params, sort_keys=True, default=str).encode())
+        h.update(str(PIPELINE_VERSION).encode())
+        return h.hexdigest()
+
+    def get_path(self, key: str) -> pathlib.Path:
+        return pathlib.Path(self.cache_dir, key[:2], key + '.npz')
+
+    def load(self, key: str) -> Optional[Dict[str, np.ndarray]]:
+        """Load a cache entry and mark it as recently used.
+
+        :param key: Cache key returned by make_key.
+        :return: A dictionary of arrays, or None if the entry does not exist.
+        """
+        path = self.get_path(key)
+        if key not in self.entries or not path.exists():
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                arrays = {name: data[name] for name in data.files}
+        except (OSError, ValueError) as e:
+            logger.warning(f'CACHE: Could not read {path}; discarding entry. Exception: {e}')
+            self.remove(key)
+            return None
+        os.utime(path)
+        self.entries.move_to_end(key)
+        logger.debug(f'CACHE: Hit {key}.')
+        return arrays
+
+    def save(self, key: str, arrays: Dict[str, np.ndarray]) -> None:
+        """Write a cache entry, then evict old entries until the cache fits within max_size.
+
+        :param key: Cache key returned by make_key.
+        :param arrays: A dictionary of arrays to store.
+        """
+        path = self.get_path(key)
+        os.makedirs(path.parent, exist_ok=True)
+
+        # Write to a temporary file first so that readers never see a partial entry
+        temp_path = path.with_suffix('.tmp')
+        with open(temp_path, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(temp_path, path)
+
+        if key in self.entries:
+            self.size -= self.entries.pop(key)
+        self.entries[key] = path.stat().st_size
+        self.size += self.entries[key]
+        self.evict()
+
+    def remove(self, key: str) -> None:
+        path = self.get_path(key)
+        if path.exists():
+            os.remove(path)
+        if key in self.entries:
+            self.size -= self.entries.pop(key)
+
+    def evict(self) -> None:
+        """Remove the least recently used entries until the cache fits within max_size."""
+        while self.size > self.max_size and len(self.entries) > 1:
+            key = next(iter(self.entries))
+            logger.debug(f'CACHE: Evicting {key}.')
+            self.remove(key)
@@ -1,10 +1,11 @@
 import logging
 import math
 from collections import namedtuple
-from typing import Optional, List
+from typing import Optional, List, Dict
 
 import cv2
 import numpy as np
+import pandas as pd
 import pytesseract
 
 from ..util.functions import calc_intersect
@@ -14,6 +15,16 @@ logger = logging.getLogger(__name__)
 BBoxTuple = namedtuple('BBoxTuple', ['xmin', 'xmax', 'ymin', 'ymax'])
 ChunkTuple = namedtuple('ChunkTuple', ['start', 'end', 'delta'])
 
+# Tesseract reads best when capital letters are roughly 20-35px tall
+OCR_MIN_CAP_HEIGHT = 20
+OCR_MAX_CAP_HEIGHT = 35
+OCR_DEFAULT_SCALE = 2
+X_HEIGHT_RATIO = 0.7
+
+# Integer columns returned by pytesseract.image_to_data (besides conf and text)
+TESSERACT_INT_COLUMNS = ['level', 'page_num', 'block_num', 'par_num', 'line_num', 'word_num',
+                         'left', 'top', 'width', 'height']
+
 
 class CvChunk:
 
@@ -34,6 +45,7 @@ class CvChunk:
         self.text = None
         self.text_bboxes = None
         self.tesseract = None
+        self.tesseract_scale = None
 
     def generate_subchunks(
             self,
@@ -214,30 +226,89 @@ class CvChunk:
         final_boundaries = sorted(final_boundaries)
         return final_boundaries
 
-    def run_tesseract(self, scale: int, blur_kernel: int = 3) -> None:
+    def estimate_x_height(self, min_glyphs: int = 5) -> Optional[float]:
+        """Estimate the x-height of the text in this chunk from connected component statistics.
+
+        The chunk is binarized with Otsu's method and the minority polarity is taken as the foreground, so both dark
+        text on light backgrounds and light text on dark backgrounds work. Components that are not glyph-shaped
+        (too wide, too thin, solid blocks, or spanning the chunk) are ignored.
+
+        :param min_glyphs: Minimum number of glyph-like components required to make an estimate.
+        :return: The median glyph height in pixels, or None if there are not enough glyphs.
+        """
+        gray = cv2.cvtColor(self.cv, cv2.COLOR_BGR2GRAY)
+        (T, thresh) = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+        if np.count_nonzero(thresh) > thresh.size / 2:
+            thresh = 255 - thresh
+
+        n, labels, stats, _ = cv2.connectedComponentsWithStats(thresh, connectivity=8)
+        stats = stats[1:]
+        w = stats[:, cv2.CC_STAT_WIDTH]
+        h = stats[:, cv2.CC_STAT_HEIGHT]
+        fill = stats[:, cv2.CC_STAT_AREA] / (w * h)
+        is_glyph = (h >= 3) & (h < self.height) & (w <= 2 * h) & (fill > 0.1) & (fill < 0.95)
+        if np.count_nonzero(is_glyph) < min_glyphs:
+            return None
+        return float(np.median(h[is_glyph]))
+
+    def plan_ocr_scale(self, default_scale: float = OCR_DEFAULT_SCALE) -> float:
+        """Pick the smallest scale factor that brings the estimated cap height into tesseract's preferred range.
+
+        Chunks whose text is already in range are left alone, and chunks with oversized text are downscaled.
+
+        :param default_scale: Scale to use if the glyph height cannot be estimated.
+        :return: A scale factor to resize the chunk by before running tesseract.
+        """
+        x_height = self.estimate_x_height()
+        if x_height is None:
+            return default_scale
+        cap_height = x_height / X_HEIGHT_RATIO
+        if OCR_MIN_CAP_HEIGHT <= cap_height <= OCR_MAX_CAP_HEIGHT:
+            return 1
+        return OCR_MIN_CAP_HEIGHT / cap_height
+
+    def run_tesseract(self, scale: Optional[float] = None, blur_kernel: int = 3) -> None:
         """Run tesseract on this Chunk and store the results.
 
-        :param scale: Factor to scale image by before performing tesseract.
-        :param blur_kernel: Size of kernel to perform median blur. (e.g. 3)
+        :param scale: Factor to scale image by before performing tesseract. If None, the scale is planned from the
+            estimated glyph height of the chunk.
+        :param blur_kernel: Size of kernel to perform median blur when upscaling. (e.g. 3)
         """
-        # First we transform image for tesseract because it performs better with larger images
+        if scale is None:
+            scale = self.plan_ocr_scale()
+
         # Tesseract's max dimension size is around 30000
         scale = scale if self.height * scale < 30000 else 30000 / self.height
-        resize = cv2.resize(self.cv, (int(self.width * scale), int(self.height * scale)), interpolation=cv2.INTER_CUBIC)
-        blur = cv2.medianBlur(resize, blur_kernel)
+        dim = (max(1, int(self.width * scale)), max(1, int(self.height * scale)))
+        if scale > 1:
+            # Smooth out interpolation artifacts after upscaling
+            resize = cv2.resize(self.cv, dim, interpolation=cv2.INTER_CUBIC)
+            image = cv2.medianBlur(resize, blur_kernel)
+        elif scale < 1:
+            image = cv2.resize(self.cv, dim, interpolation=cv2.INTER_AREA)
+        else:
+            image = self.cv
 
         # Run tesseract
-        logger.debug(f'Starting tesseract on chunk: {self.xmin}-{self.ymin} ({self.width}x{self.height})...')
-        data = pytesseract.image_to_data(blur, output_type=pytesseract.Output.DICT)
+        logger.debug(f'Starting tesseract on chunk: {self.xmin}-{self.ymin} ({self.width}x{self.height}) '
+                     f'at scale {scale:.2f}...')
+        data = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
         logger.debug(f'Finished tesseract. Found {len(data["level"])} words.')
 
         # Store data
-        self.tesseract = data
+        self.tesseract = tesseract_to_df(data)
+        self.tesseract_scale = scale
 
-    def get_text(self, scale: int, blur_kernel: int = 3, minimum_conf: float = 50, recalculate: bool = False) -> str:
+    def get_text(
+            self,
+            scale: Optional[float] = None,
+            blur_kernel: int = 3,
+            minimum_conf: float = 50,
+            recalculate: bool = False
+    ) -> str:
         """Get the text in this chunk as a string.
 
-        :param scale: Factor to scale image by before performing tesseract.
+        :param scale: Factor to scale image by before performing tesseract (None to plan it from the text size).
         :param blur_kernel: Size of kernel to perform median blur. (e.g. 3)
         :param minimum_conf: Minimum confidence required to report text.
         :param recalculate: Recalculate the string if set to True.
@@ -251,19 +322,16 @@ class CvChunk:
         if self.text is not None and not recalculate:
             return self.text
 
-        # Loop through tesseract data
-        text_list = []
-        last_block = 0
-        for i in range(len(self.tesseract['level'])):
-            block = self.tesseract['block_num'][i]
-            conf = self.tesseract['conf'][i]
-            text = self.tesseract['text'][i]
-            if block != last_block:
-                # Newline to indicate paragraph break
-                text_list.append('\n')
-            if conf > minimum_conf:
-                text_list.append(text)
-            last_block = block
+        # Insert a newline token whenever the block changes, followed by the word if it passes the threshold
+        data = self.tesseract
+        block = data['block_num'].to_numpy()
+        new_block = block != np.concatenate(([0], block[:-1]))
+        keep_text = data['conf'].to_numpy() > minimum_conf
+        tokens = np.empty(len(data) * 2, dtype=object)
+        tokens[0::2] = np.where(new_block, '\n', None)
+        tokens[1::2] = np.where(keep_text, data['text'].to_numpy(), None)
+        text_list = tokens[pd.notna(tokens)].tolist()
+
         # Set the text in this chunk
         self.text = " ".join(text_list).strip()
         return self.text
@@ -271,7 +339,7 @@ class CvChunk:
     def get_text_bboxes(
             self,
             level: int,
-            scale: int,
+            scale: Optional[float] = None,
             blur_kernel: int = 3,
             minimum_conf: float = 50,
             absolute_coordinate: bool = True,
@@ -290,7 +358,7 @@ class CvChunk:
         of words within the level. If the confidence does not exceed a threshold, we do not return the parent block.
 
         :param level: The text level (e.g. paragraph, sentence) as indicated by tesseract.
-        :param scale: The scale factor used to resize the image before running tesseract.
+        :param scale: Factor to scale image by before performing tesseract (None to plan it from the text size).
         :param blur_kernel: Size of kernel to perform median blur. (e.g. 3).
         :param minimum_conf: Average text confidence required to pass parent bounding box.
         :param absolute_coordinate: Set to True if coordinates should be absolute as opposed to relative.
@@ -306,55 +374,93 @@ class CvChunk:
             return self.text_bboxes
 
         # Set scale and absolute coordinates
-        scale = scale
+        scale = self.tesseract_scale
         x_offset = self.xmin if absolute_coordinate else 0
         y_offset = self.ymin if absolute_coordinate else 0
 
-        # Next iterate through the results and take the level we're interested in
-        bboxes = []
-        buffer = None
-        conf_list = []
-        logger.debug(f'Iterating through {len(self.tesseract["level"])} words...')
-        for i in range(len(self.tesseract['level'])):
-            this_level = self.tesseract['level'][i]
-            text = self.tesseract['text'][i].strip()
-            conf = self.tesseract['conf'][i]
-            if this_level == level:
-                # Flush any old results
-                # logger.debug(f'Found level {level}.')
-                if buffer is not None:
-                    # logger.debug(f'Conf average: {np.average(conf_list)}.')
-                    if len(conf_list) and np.average(conf_list) > minimum_conf:
-                        bboxes.append(buffer)
-                conf_list = []
-
-                # Start a new buffer
-                buffer = BBoxTuple(
-                    xmin=int(self.tesseract['left'][i] / scale + x_offset),
-                    xmax=int((self.tesseract['left'][i] + self.tesseract['width'][i]) / scale + x_offset),
-                    ymin=int(self.tesseract['top'][i] / scale + y_offset),
-                    ymax=int((self.tesseract['top'][i] + self.tesseract['height'][i]) / scale + y_offset)
-                )
-            if conf != -1 and text:
-                # A conf of -1 means that it is not a word
-                # logger.debug(f'Found word: {text}')
-                conf_list.append(conf)
-
-            if i == len(self.tesseract['level']):
-                # Flush at the end of the loop
-                if buffer is not None and len(text.strip()):
-                    if len(conf_list) and np.average(conf_list) > minimum_conf:
-                        bboxes.append(buffer)
+        # Every row at the requested level starts a new group; words before the first group are discarded
+        data = self.tesseract
+        logger.debug(f'Grouping {len(data)} words...')
+        group = (data['level'] == level).cumsum()
+        is_word = (data['conf'] != -1) & (data['text'].str.strip() != '')
+        conf_avg = data['conf'].where(is_word).groupby(group).mean()
+
+        # Keep groups whose average word confidence passes the threshold
+        heads = data.loc[data['level'] == level]
+        passed = (conf_avg.reindex(group[heads.index]) > minimum_conf).to_numpy()
+        heads = heads.loc[passed]
+
+        # Rescale the group coordinates back to the original image
+        left = heads['left'].to_numpy()
+        top = heads['top'].to_numpy()
+        xmin = (left / scale + x_offset).astype(int)
+        xmax = ((left + heads['width'].to_numpy()) / scale + x_offset).astype(int)
+        ymin = (top / scale + y_offset).astype(int)
+        ymax = ((top + heads['height'].to_numpy()) / scale + y_offset).astype(int)
+        bboxes = [BBoxTuple(*row) for row in zip(xmin.tolist(), xmax.tolist(), ymin.tolist(), ymax.tolist())]
 
         logger.debug(f'Found {len(bboxes)} results.')
         self.text_bboxes = bboxes
         return bboxes
 
     def get_text_conf(self):
-        conf = np.array(self.tesseract['conf'])
+        conf = self.tesseract['conf'].to_numpy()
         true_conf = conf[conf != -1]
         return np.average(true_conf)
 
+    def get_text_score(self, max_width: int = 600, min_fill: float = 0.45, max_line_height: int = 40,
+                       n_scales: int = 3) -> float:
+        """Estimate how likely this chunk is to contain text, without running tesseract.
+
+        We downscale the chunk and take its morphological gradient, which is dense around glyph strokes. Closing the
+        gradient horizontally merges glyphs into line-shaped blobs. Blobs that are wider than tall, short, and mostly
+        filled are counted as text; the score is the fraction of the chunk area covered by such blobs. Large glyphs
+        only light up along their outlines, so the score is the maximum over several scales (each half the last).
+
+        :param max_width: Width to downscale the chunk to before scoring.
+        :param min_fill: Minimum fraction of a blob's bounding box that must be filled by gradient pixels.
+        :param max_line_height: Maximum height (in downscaled pixels) of a blob to be considered a line of text.
+        :param n_scales: Number of scales to score the chunk at.
+        :return: A score between 0 (no text) and 1 (all text).
+        """
+        image = self.cv
+        if self.width > max_width:
+            ratio = max_width / self.width
+            dim = (max_width, max(1, int(self.height * ratio)))
+            image = cv2.resize(image, dim, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+        score = 0.0
+        for i in range(n_scales):
+            if i > 0:
+                if min(gray.shape) < 16:
+                    break
+                gray = cv2.resize(gray, (gray.shape[1] // 2, gray.shape[0] // 2), interpolation=cv2.INTER_AREA)
+            score = max(score, self.text_score_at_scale(gray, min_fill, max_line_height))
+        return score
+
+    @staticmethod
+    def text_score_at_scale(gray: np.ndarray, min_fill: float, max_line_height: int) -> float:
+        """Score a single scale of a grayscale image (see get_text_score)."""
+        # Glyph edges light up in the gradient; join neighbouring glyphs into lines
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+        gradient = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT, kernel)
+        (T, thresh) = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+        line_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (9, 1))
+        connected = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, line_kernel)
+
+        # Measure the fill ratio of each blob against the (unclosed) gradient mask
+        n, labels, stats, _ = cv2.connectedComponentsWithStats(connected, connectivity=8)
+        if n <= 1:
+            return 0.0
+        stats = stats[1:]
+        filled = np.bincount(labels[thresh > 0], minlength=n)[1:]
+        w = stats[:, cv2.CC_STAT_WIDTH]
+        h = stats[:, cv2.CC_STAT_HEIGHT]
+        box_area = w * h
+        is_text = (w > h) & (h >= 3) & (h <= max_line_height) & (filled / box_area >= min_fill)
+        return float(box_area[is_text].sum() / (gray.shape[0] * gray.shape[1]))
+
     def get_image_bboxes(
             self,
             min_size: int = 10,
@@ -432,9 +538,24 @@ class CvChunk:
         return False
 
     def get_color_diversity(self):
-        b, g, r = cv2.split(self.cv)
-        shiftet_im = b + 1000 * (g + 1) + 1000 * 1000 * (r + 1)
-        return len(np.unique(shiftet_im))
+        # Pack each pixel into a single integer (in a wide enough type to not overflow)
+        b, g, r = cv2.split(self.cv.astype(np.int32))
+        shifted_im = b + 256 * g + 256 * 256 * r
+        return len(np.unique(shifted_im))
+
+
+def tesseract_to_df(data: Dict[str, List]) -> pd.DataFrame:
+    """Convert the dictionary output of pytesseract.image_to_data into a typed DataFrame.
+
+    :param data: Output of pytesseract.image_to_data with output_type=Output.DICT.
+    :return: A DataFrame with one row per tesseract entry.
+    """
+    df = pd.DataFrame(data, columns=TESSERACT_INT_COLUMNS + ['conf', 'text'])
+    for column in TESSERACT_INT_COLUMNS:
+        df[column] = pd.to_numeric(df[column]).astype(int)
+    df['conf'] = pd.to_numeric(df['conf']).astype(float)
+    df['text'] = df['text'].fillna('').astype(str)
+    return df
 
 
 def reduce_boundary_proposals(sorted_proposal_list, min_size: float):
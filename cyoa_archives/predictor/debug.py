@@ -0,0 +1,110 @@
+"""Asynchronous writer for debug artifacts (ROI images, OCR chunks, DeepDanbooru crops and tables).
+
+Encoding JPEGs and writing files is slow compared to the analysis itself, so artifacts are queued and written by a
+background thread. The queue is bounded; when it is full, new artifacts are dropped (or the caller waits, if
+block is set) rather than buffering an unbounded number of images in memory.
+
+Writing artifacts is off by default: a DebugSink without an output directory ignores everything it is given.
+
+Typical usage example:
+
+  sink = DebugSink.from_config(config.get('predictor'))
+  sink.write_image('page_0_0.jpg', roi)
+  sink.close()
+
+"""
+
+import logging
+import os
+import pathlib
+import queue
+import threading
+from typing import Any, Callable, Dict, Optional
+
+import cv2
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 64
+
+
+class DebugSink:
+    """Writes debug artifacts into a directory from a background thread."""
+
+    def __init__(self, output_dir: Optional[pathlib.Path] = None, max_queue: int = DEFAULT_QUEUE_SIZE,
+                 block: bool = False):
+        """Initializes a DebugSink. The writer thread is started on the first artifact.
+
+        :param output_dir: Directory to write artifacts to; None disables the sink.
+        :param max_queue: Maximum number of artifacts waiting to be written.
+        :param block: Wait for space in the queue instead of dropping artifacts when it is full.
+        """
+        self.output_dir = pathlib.Path(output_dir) if output_dir else None
+        self.block = block
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.thread = None
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config_object: Optional[Dict[str, Any]]) -> 'DebugSink':
+        """Create a sink from the debug_dir and debug_queue_size keys of a configuration object."""
+        config_object = config_object or {}
+        return cls(
+            output_dir=config_object.get('debug_dir'),
+            max_queue=config_object.get('debug_queue_size', DEFAULT_QUEUE_SIZE)
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.output_dir is not None
+
+    def write_image(self, name: str, image) -> None:
+        """Queue a CV2 image to be written to output_dir/name. The image must not be modified afterwards."""
+        self.put(name, lambda path: cv2.imwrite(str(path), image))
+
+    def write_csv(self, name: str, df: pd.DataFrame) -> None:
+        """Queue a DataFrame to be written as a CSV file to output_dir/name."""
+        self.put(name, lambda path: df.to_csv(path))
+
+    def put(self, name: str, write: Callable[[pathlib.Path], Any]) -> None:
+        """Queue an artifact.
+
+        :param name: Path of the artifact relative to the output directory.
+        :param write: Function that writes the artifact to the given path.
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            if self.thread is None:
+                os.makedirs(self.output_dir, exist_ok=True)
+                self.thread = threading.Thread(target=self.run, name='DebugSink', daemon=True)
+                self.thread.start()
+        try:
+            self.queue.put((pathlib.Path(self.output_dir, name), write), block=self.block)
+        except queue.Full:
+            self.dropped += 1
+            logger.debug(f'DEBUG: Queue is full; dropped {name}.')
+
+    def run(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            path, write = item
+            try:
+                os.makedirs(path.parent, exist_ok=True)
+                write(path)
+            except Exception as e:
+                logger.warning(f'DEBUG: Could not write {path}. Exception: {e}')
+
+    def close(self) -> None:
+        """Wait for all queued artifacts to be written and stop the writer thread."""
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+        if self.dropped:
+            logger.warning(f'DEBUG: Dropped {self.dropped} artifacts because the queue was full.')
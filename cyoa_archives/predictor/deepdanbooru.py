@@ -1,56 +1,365 @@
+"""DeepDanbooru tagger.
+
+Tensorflow and the deepdanbooru package take several seconds to import, so they are only imported when a model is
+first loaded. Constructing a DeepDanbooru object is cheap; the model and tags are loaded on the first evaluation.
+
+"""
+
 from collections import OrderedDict
 import logging
 import math
+import pathlib
+
+from typing import List, Optional
+
+import cv2
+import numpy as np
 
-import deepdanbooru as dd
-import tensorflow as tf
+from .artifacts import ProjectArtifacts
 
 PROJECT_PATH = 'deepdanbooru-v3-20211112-sgd-e28'
 DD_THRESHOLD = 0.5
 DD_REPORT_THRESHOLD = 0.03
+TFLITE_QUANTIZATIONS = ['none', 'dynamic', 'float16']
+TAGS_NAME = 'tags.txt'
+TAG_INDEX_NAME = 'tags.npy'
 
 logger = logging.getLogger(__name__)
 
+
+def set_thread_pools(intra_op_threads: int = 0, inter_op_threads: int = 0) -> None:
+    """Configure the tensorflow thread pools. This only has an effect before tensorflow is initialized.
+
+    :param intra_op_threads: Threads used within a single op (0 lets tensorflow decide).
+    :param inter_op_threads: Threads used to run independent ops (0 lets tensorflow decide).
+    """
+    import tensorflow as tf
+    try:
+        if intra_op_threads:
+            tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+        if inter_op_threads:
+            tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    except RuntimeError as e:
+        logger.warning(f'Could not set tensorflow thread pools (already initialized): {e}')
+
+
+def load_tags(tags_path: pathlib.Path) -> List[str]:
+    """Read a DeepDanbooru tags file (one tag per line), as deepdanbooru.data.load_tags does."""
+    with open(tags_path, 'r') as f:
+        return [tag for tag in (line.strip() for line in f) if tag]
+
+
+def write_tag_index(source_paths: List[pathlib.Path], output_path: pathlib.Path) -> None:
+    """Write the tags file of a project as a binary numpy array."""
+    with open(output_path, 'wb') as f:
+        np.save(f, np.array(load_tags(source_paths[0]), dtype=str))
+
+
+def load_project_model(project_path: pathlib.Path):
+    import deepdanbooru as dd
+    logger.info(f'Loading DeepDanbooru model from {project_path}...')
+    return dd.project.load_model_from_project(project_path, compile_model=False)
+
+
+def get_model_sources(project_path: pathlib.Path) -> List[str]:
+    """List the files of a project that the model is loaded from."""
+    sources = [path.name for path in pathlib.Path(project_path).glob('*.h5')]
+    return sorted(sources) + ['project.json']
+
+
+def convert_to_tflite(model, output_path: pathlib.Path, quantization: str = 'dynamic') -> pathlib.Path:
+    """Convert a Keras model to a TFLite flatbuffer.
+
+    Dynamic-range quantization stores weights as int8 and quantizes activations on the fly, which needs no
+    calibration data and gives most of the CPU speed-up.
+
+    :param model: A Keras model.
+    :param output_path: Path to write the converted model to.
+    :param quantization: One of 'none', 'dynamic' (int8 weights) or 'float16'.
+    :return: The output path.
+    """
+    import tensorflow as tf
+    if quantization not in TFLITE_QUANTIZATIONS:
+        raise ValueError(f'Unknown quantization ({quantization}); expected one of {TFLITE_QUANTIZATIONS}.')
+
+    logger.info(f'Converting model to TFLite ({quantization} quantization)...')
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization != 'none':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    flatbuffer = converter.convert()
+
+    output_path = pathlib.Path(output_path)
+    with open(output_path, 'wb') as f:
+        f.write(flatbuffer)
+    logger.info(f'Wrote TFLite model to {output_path.resolve()} ({len(flatbuffer)} bytes).')
+    return output_path
+
+
+def get_embedding_features(model, layer_name: Optional[str] = None):
+    """Find the penultimate features of a model, i.e. the input to its final classification layer.
+
+    DeepDanbooru ends with a 1x1 convolution to one channel per tag followed by global average pooling, so by default
+    this is the feature map of the last residual block. Spatial feature maps are average-pooled into vectors.
+
+    :param model: A Keras model.
+    :param layer_name: Name of a layer to use the output of instead of searching for the classification layer.
+    :return: A (batch, features) Keras tensor.
+    """
+    import tensorflow as tf
+    if layer_name:
+        features = model.get_layer(layer_name).output
+    else:
+        n_outputs = model.output_shape[-1]
+        features = model.layers[-2].output
+        for layer in reversed(model.layers):
+            if isinstance(layer, (tf.keras.layers.Conv2D, tf.keras.layers.Dense)) and \
+                    layer.output.shape[-1] == n_outputs:
+                features = layer.input
+                break
+    if len(features.shape) == 4:
+        features = tf.keras.layers.GlobalAveragePooling2D()(features)
+    return features
+
+
+def add_embedding_output(model, layer_name: Optional[str] = None):
+    """Build a model that returns the penultimate features (see get_embedding_features) next to the scores."""
+    import tensorflow as tf
+    return tf.keras.Model(model.inputs, [model.outputs[0], get_embedding_features(model, layer_name)])
+
+
+def get_interpreter_class():
+    """Use the standalone tflite_runtime interpreter if it is installed, since it imports much faster."""
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+class TFLiteModel:
+    """Runs a TFLite model on fixed-shape float32 batches, like the compiled Keras inference function.
+
+    Models with several outputs return a list of arrays: the scores first (identified by their width, n_scores),
+    followed by the other outputs.
+    """
+
+    def __init__(self, model_path: pathlib.Path, n_scores: int, num_threads: Optional[int] = None):
+        """Load a TFLite model.
+
+        :param model_path: Path to the .tflite file.
+        :param n_scores: Number of scores (tags) output by the model.
+        :param num_threads: Number of threads for the interpreter (None lets TFLite decide).
+        """
+        self.interpreter = get_interpreter_class()(model_path=str(model_path), num_threads=num_threads)
+        self.input_index = self.interpreter.get_input_details()[0]['index']
+
+        # The converter names outputs after the traced function (e.g. StatefulPartitionedCall:1), which does not
+        # follow the order of the Keras outputs, so the scores are found by their width instead
+        output_details = self.interpreter.get_output_details()
+        scores = [d for d in output_details if d['shape'][-1] == n_scores]
+        if len(scores) != 1:
+            raise ValueError(f'Expected exactly one output of width {n_scores} in {model_path}, found '
+                             f'{[d["shape"].tolist() for d in output_details]}.')
+        others = [d for d in output_details if d['shape'][-1] != n_scores]
+        self.output_indices = [d['index'] for d in scores + others]
+        self.input_shape = tuple(self.interpreter.get_input_details()[0]['shape'])
+
+    def resize(self, batch_shape: tuple) -> None:
+        """Allocate the tensors of the interpreter for a fixed batch shape (batch, height, width, channels)."""
+        self.interpreter.resize_tensor_input(self.input_index, batch_shape)
+        self.interpreter.allocate_tensors()
+
+    def __call__(self, batch: np.ndarray):
+        self.interpreter.set_tensor(self.input_index, batch)
+        self.interpreter.invoke()
+        outputs = [self.interpreter.get_tensor(index) for index in self.output_indices]
+        return outputs[0] if len(outputs) == 1 else outputs
+
+
 class DeepDanbooru:
     """A wrapper around the DeepDanbooru project.
 
     The default model uses images of 512x512 size.
     """
 
-    def __init__(self, project_path=PROJECT_PATH, tags_path=None, special_tags=None, threshold=0.5):
-        self.model = dd.project.load_model_from_project(project_path, compile_model=False)
+    def __init__(self, project_path=PROJECT_PATH, tags_path=None, special_tags=None, threshold=0.5, batch_size=1,
+                 intra_op_threads=0, inter_op_threads=0, backend='keras', quantization='dynamic', embeddings=False,
+                 embedding_layer=None):
+        """Configure a DeepDanbooru model; the model itself is loaded on first use (see load).
+
+        With the 'tflite' backend, the project model is converted once and cached in the project folder as
+        model-{quantization}.tflite. The project tags are likewise cached as a binary index. Both are recorded with
+        checksums in the project's artifact manifest and rebuilt if the project files change.
+
+        :param project_path: Path to the DeepDanbooru project folder.
+        :param tags_path: Path to a tags file (defaults to the tags of the project).
+        :param special_tags: A dictionary of special tag -> list of tags to take the maximum score of.
+        :param threshold: Scores at or below this threshold are reported as 0.
+        :param batch_size: Number of images passed to the model per call.
+        :param intra_op_threads: Threads used within a single op (0 lets tensorflow decide).
+        :param inter_op_threads: Threads used to run independent ops (0 lets tensorflow decide).
+        :param backend: Either 'keras' or 'tflite'.
+        :param quantization: Quantization of the TFLite model (see convert_to_tflite).
+        :param embeddings: Also return the penultimate features of each image from the same forward pass.
+        :param embedding_layer: Name of the layer to take embeddings from (see get_embedding_features).
+        """
+        if backend not in ['keras', 'tflite']:
+            raise ValueError(f'Unknown DeepDanbooru backend ({backend}).')
+        self.project_path = pathlib.Path(project_path)
+        self.tags_path = tags_path
         self.special_tags = special_tags
         self.threshold = threshold
-        if tags_path:
-            self.tags = dd.data.load_tags(tags_path)
+        self.batch_size = batch_size
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.backend = backend
+        self.quantization = quantization
+        self.embeddings = embeddings
+        self.embedding_layer = embedding_layer
+
+        # Loaded lazily
+        self.model = None
+        self.infer = None
+        self.tags = None
+        self.batch = None
+
+    def load(self) -> None:
+        """Load the tags and model and compile a fixed-shape inference function. Does nothing if already loaded."""
+        if self.infer is not None:
+            return
+        artifacts = ProjectArtifacts(self.project_path)
+
+        # Load tags
+        if self.tags_path:
+            self.tags = load_tags(self.tags_path)
+        else:
+            tag_index = artifacts.get(TAG_INDEX_NAME, [TAGS_NAME], build=write_tag_index)
+            self.tags = np.load(tag_index, allow_pickle=False).tolist()
+
+        # Load model
+        if self.backend == 'tflite':
+            suffix = '-embedding' if self.embeddings else ''
+            tflite_path = artifacts.get(
+                f'model-{self.quantization}{suffix}.tflite',
+                get_model_sources(self.project_path),
+                build=lambda sources, output: convert_to_tflite(
+                    self.load_keras_model(), output, self.quantization
+                )
+            )
+            self.infer = TFLiteModel(tflite_path, len(self.tags), num_threads=self.intra_op_threads or None)
+            input_shape = self.infer.input_shape
         else:
-            self.tags = dd.project.load_tags_from_project(PROJECT_PATH)
+            set_thread_pools(self.intra_op_threads, self.inter_op_threads)
+            self.model = self.load_keras_model()
+            input_shape = self.model.input_shape
+
+        # Preallocated input buffer (batch, height, width, channels)
+        self.input_height = input_shape[1]
+        self.input_width = input_shape[2]
+        self.batch = np.zeros((self.batch_size, self.input_height, self.input_width, 3), dtype=np.float32)
+
+        if self.backend == 'tflite':
+            self.infer.resize(self.batch.shape)
+        else:
+            # Calling the model through a traced function avoids the per-call overhead of Keras predict
+            import tensorflow as tf
+            self.infer = tf.function(
+                lambda x: self.model(x, training=False),
+                input_signature=[tf.TensorSpec(self.batch.shape, tf.float32)]
+            )
+        self.infer(self.batch)
+
+    def load_keras_model(self):
+        model = load_project_model(self.project_path)
+        if self.embeddings:
+            model = add_embedding_output(model, self.embedding_layer)
+        return model
 
     def evaluate_from_file(self, filename, threshold):
+        import deepdanbooru as dd
+        self.load()
+        if self.model is None or self.embeddings:
+            raise ValueError('evaluate_from_file requires the keras backend without embeddings.')
         tag_dict = {}
         for tag, score in dd.commands.evaluate_image(filename, self.model, self.tags, threshold):
             tag_dict[tag] = score
         return tag_dict
 
+    def preprocess(self, cv: np.ndarray, out: np.ndarray) -> np.ndarray:
+        """Resize, center and normalize an image into a slot of the input buffer.
+
+        This reproduces tf.image.resize (AREA, preserve_aspect_ratio) followed by dd.image.transform_and_pad_image
+        and division by 255, without leaving numpy or making full-size float64 copies.
+
+        :param cv: A CV2 image (height, width, 3).
+        :param out: A float32 array of shape (input_height, input_width, 3) to write into.
+        :return: The out array.
+        """
+        height, width = out.shape[0], out.shape[1]
+        h, w = cv.shape[0], cv.shape[1]
+
+        # Compute the aspect-preserving size the same way tensorflow does (float32, round half to even)
+        scale = min(np.float32(height) / np.float32(h), np.float32(width) / np.float32(w))
+        new_h = int(np.round(scale * np.float32(h)))
+        new_w = int(np.round(scale * np.float32(w)))
+
+        image = cv.astype(np.float32)
+        if (new_h, new_w) != (h, w):
+            image = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_AREA)
+
+        if (new_h, new_w) == (height, width):
+            np.divide(image, 255.0, out=out)
+        else:
+            # Center the image with edge padding (bilinear, as in skimage.transform.warp with mode='edge')
+            matrix = np.float32([[1, 0, (width - new_w) * 0.5], [0, 1, (height - new_h) * 0.5]])
+            cv2.warpAffine(image, matrix, (width, height), dst=out, flags=cv2.INTER_LINEAR,
+                           borderMode=cv2.BORDER_REPLICATE)
+            np.divide(out, 255.0, out=out)
+        return out
+
     def evaluate(self, cv):
-        # Resize image
-        image = tf.image.resize(
-            cv,
-            size=(self.model.input_shape[1], self.model.input_shape[2]),
-            method=tf.image.ResizeMethod.AREA,
-            preserve_aspect_ratio=True,
-        )
-
-        # Center, warp, and normalize image
-        image = image.numpy()
-        image = dd.image.transform_and_pad_image(image, self.model.input_shape[2], self.model.input_shape[1])
-        image = image / 255.0
-
-        # Run the model
-        logger.debug(f'Starting DeepDanbooru...')
-        image = image.reshape((1, image.shape[0], image.shape[1], image.shape[2]))
-        y = self.model.predict(image)[0]
+        return self.evaluate_batch([cv])[0]
+
+    def evaluate_batch(self, cv_list: List[np.ndarray], return_embeddings: bool = False):
+        """Run DeepDanbooru on a list of images, batch_size images at a time.
+
+        :param cv_list: A list of CV2 images.
+        :param return_embeddings: Also return the embeddings of the images (requires embeddings=True).
+        :return: A list of tag -> score dictionaries, one per image, and an (images x features) float32 array of
+            embeddings if return_embeddings is set.
+        """
+        if return_embeddings and not self.embeddings:
+            raise ValueError('DeepDanbooru was not configured to compute embeddings.')
+        self.load()
+        results = []
+        embeddings = []
+        for start in range(0, len(cv_list), self.batch_size):
+            # Resize, center, and normalize images; unused slots keep stale data and are ignored
+            batch_list = cv_list[start:start + self.batch_size]
+            for i, cv in enumerate(batch_list):
+                self.preprocess(cv, self.batch[i])
+
+            # Run the model
+            logger.debug(f'Starting DeepDanbooru...')
+            outputs = self.infer(self.batch)
+            if self.embeddings:
+                y = np.asarray(outputs[0])
+                embeddings.append(np.asarray(outputs[1])[:len(batch_list)])
+            else:
+                y = np.asarray(outputs)
+            for i in range(len(batch_list)):
+                results.append(self.scores_to_dict(y[i]))
+
+        if return_embeddings:
+            if embeddings:
+                return results, np.concatenate(embeddings).astype(np.float32)
+            return results, np.zeros((0, 0), dtype=np.float32)
+        return results
 
+    def scores_to_dict(self, y: np.ndarray) -> OrderedDict:
         # Return results
         result_dict = OrderedDict()
         for i, tag in enumerate(self.tags):
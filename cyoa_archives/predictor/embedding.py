@@ -0,0 +1,224 @@
+"""Per-CYOA image embeddings and an approximate nearest neighbour index over them.
+
+DeepDanbooru can return the penultimate features of each sampled window from the same forward pass as the tag scores
+(see DeepDanbooru.evaluate_batch). The features of all windows of a CYOA are averaged into a single embedding and
+appended to an EmbeddingStore. An EmbeddingIndex is built offline from the store and answers "which CYOAs look like
+this one" queries without comparing against every CYOA.
+
+The index is an inverted file (IVF): embeddings are clustered with spherical k-means, and a query only scans the
+clusters whose centroids are closest to it. Vectors are stored as float16 and memory-mapped when the index is loaded.
+
+Typical usage example:
+
+  store = EmbeddingStore('database/embeddings')
+  store.append(uuid, embeddings.mean(axis=0))
+  index = EmbeddingIndex.build('database/embedding_index', *store.load())
+  neighbours = index.search_id(uuid, k=10)
+
+"""
+
+import logging
+import math
+import os
+import pathlib
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DTYPE = np.float16
+IDS_NAME = 'ids.txt'
+VECTORS_NAME = 'vectors.f16'
+DIM_NAME = 'dim.txt'
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize the rows of an array, so that dot products are cosine similarities."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def train_centroids(vectors: np.ndarray, n_lists: int, n_iterations: int = 20, seed: int = 0) -> np.ndarray:
+    """Cluster normalized vectors with spherical k-means.
+
+    :param vectors: An (n x features) array of normalized vectors.
+    :param n_lists: Number of clusters.
+    :param n_iterations: Number of k-means iterations.
+    :param seed: Seed for the initial choice of centroids.
+    :return: An (n_lists x features) array of normalized centroids.
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=n_lists, replace=False)]
+    for i in range(n_iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+
+        # Re-seed empty clusters with random vectors
+        empty = np.bincount(assignments, minlength=n_lists) == 0
+        sums[empty] = vectors[rng.choice(len(vectors), size=int(empty.sum()))]
+        centroids = normalize(sums)
+    return centroids
+
+
+class EmbeddingStore:
+    """An append-only store of one embedding per CYOA.
+
+    Embeddings are appended as raw float16 vectors to one file and their ids to another, so adding a CYOA does not
+    rewrite the store. The number of features is recorded when the store is created. If an id is appended more than
+    once, the last embedding wins.
+    """
+
+    def __init__(self, store_path: pathlib.Path):
+        """Initializes an EmbeddingStore.
+
+        :param store_path: Folder to keep the store in (created on the first append).
+        """
+        self.store_path = pathlib.Path(store_path)
+        self.ids_path = pathlib.Path(self.store_path, IDS_NAME)
+        self.vectors_path = pathlib.Path(self.store_path, VECTORS_NAME)
+        self.dim_path = pathlib.Path(self.store_path, DIM_NAME)
+
+    def read_ids(self) -> List[str]:
+        if not self.ids_path.exists():
+            return []
+        with open(self.ids_path) as f:
+            return [line.strip() for line in f if line.strip()]
+
+    def get_dim(self, n_ids: int) -> Optional[int]:
+        """Get the number of features of the embeddings in the store.
+
+        :param n_ids: Number of ids in the store.
+        :return: The number of features, or None if the store has not been created.
+        """
+        if self.dim_path.exists():
+            with open(self.dim_path) as f:
+                return int(f.read())
+        if not n_ids:
+            return None
+
+        # Stores created before the number of features was recorded
+        n_values = self.vectors_path.stat().st_size // np.dtype(EMBEDDING_DTYPE).itemsize
+        if n_values % n_ids:
+            raise ValueError(f'Cannot infer the number of features of {self.store_path}; write it to {DIM_NAME}.')
+        return n_values // n_ids
+
+    def append(self, uuid: str, vector: np.ndarray) -> None:
+        vector = np.asarray(vector, dtype=EMBEDDING_DTYPE).ravel()
+        os.makedirs(self.store_path, exist_ok=True)
+        n_ids = len(self.read_ids())
+        dim = self.get_dim(n_ids)
+        if dim is None:
+            dim = len(vector)
+            with open(self.dim_path, 'w') as f:
+                f.write(f'{dim}\n')
+        elif len(vector) != dim:
+            raise ValueError(f'Expected an embedding of {dim} features, got {len(vector)}.')
+
+        # Write the vector before the id, so that an interrupted append leaves no id without a vector. A vector left
+        # by an interrupted append is dropped first, so that vectors stay aligned with ids.
+        with open(self.vectors_path, 'ab') as f:
+            f.truncate(n_ids * dim * vector.itemsize)
+            f.write(vector.tobytes())
+        with open(self.ids_path, 'a') as f:
+            f.write(f'{uuid}\n')
+
+    def load(self) -> Tuple[List[str], np.ndarray]:
+        """Read the latest embedding of every id in the store.
+
+        :return: A list of ids and an (ids x features) float16 array of embeddings.
+        """
+        ids = self.read_ids()
+        n_features = self.get_dim(len(ids))
+        if not ids or n_features is None:
+            return [], np.zeros((0, n_features or 0), dtype=EMBEDDING_DTYPE)
+        vectors = np.fromfile(self.vectors_path, dtype=EMBEDDING_DTYPE)
+        vectors = vectors[:len(ids) * n_features].reshape(len(ids), n_features)
+
+        # Keep the last row of each id
+        rows = OrderedDict()
+        for i, uuid in enumerate(ids):
+            rows.pop(uuid, None)
+            rows[uuid] = i
+        logger.info(f'EMBEDDING: Loaded {len(rows)} embeddings ({n_features} features) from {self.store_path}.')
+        return list(rows.keys()), vectors[list(rows.values())]
+
+
+class EmbeddingIndex:
+    """An inverted file index for cosine-similarity search over float16 embeddings."""
+
+    def __init__(self, index_path: pathlib.Path):
+        """Load an index written by EmbeddingIndex.build. Vectors are memory-mapped rather than read.
+
+        :param index_path: Folder containing the index.
+        """
+        self.index_path = pathlib.Path(index_path)
+        self.centroids = np.load(pathlib.Path(self.index_path, 'centroids.npy'))
+        self.offsets = np.load(pathlib.Path(self.index_path, 'offsets.npy'))
+        self.vectors = np.load(pathlib.Path(self.index_path, 'vectors.npy'), mmap_mode='r')
+        self.ids = np.load(pathlib.Path(self.index_path, 'ids.npy')).tolist()
+        self.id_rows = {uuid: i for i, uuid in enumerate(self.ids)}
+
+    @classmethod
+    def build(cls, index_path: pathlib.Path, ids: List[str], vectors: np.ndarray, n_lists: Optional[int] = None,
+              n_iterations: int = 20) -> 'EmbeddingIndex':
+        """Cluster embeddings and write an index.
+
+        :param index_path: Folder to write the index to.
+        :param ids: The id of each embedding.
+        :param vectors: An (ids x features) array of embeddings.
+        :param n_lists: Number of clusters (defaults to the square root of the number of embeddings).
+        :param n_iterations: Number of k-means iterations.
+        :return: The loaded index.
+        """
+        if len(ids) == 0:
+            raise ValueError('Cannot build an embedding index without embeddings.')
+        vectors = normalize(vectors)
+        n_lists = min(n_lists or max(1, int(math.sqrt(len(ids)))), len(ids))
+        logger.info(f'EMBEDDING: Building index of {len(ids)} embeddings with {n_lists} lists...')
+        centroids = train_centroids(vectors, n_lists, n_iterations=n_iterations)
+
+        # Sort vectors by cluster so that each inverted list is a contiguous range of rows
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        order = np.argsort(assignments, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=n_lists))])
+
+        index_path = pathlib.Path(index_path)
+        os.makedirs(index_path, exist_ok=True)
+        np.save(pathlib.Path(index_path, 'centroids.npy'), centroids.astype(np.float32))
+        np.save(pathlib.Path(index_path, 'offsets.npy'), offsets.astype(np.int64))
+        np.save(pathlib.Path(index_path, 'vectors.npy'), vectors[order].astype(EMBEDDING_DTYPE))
+        np.save(pathlib.Path(index_path, 'ids.npy'), np.array(ids, dtype=str)[order])
+        return cls(index_path)
+
+    def search(self, vector: np.ndarray, k: int = 10, n_probe: int = 8) -> List[Tuple[str, float]]:
+        """Find the most similar embeddings to a vector.
+
+        :param vector: A query embedding.
+        :param k: Number of results.
+        :param n_probe: Number of inverted lists to scan; more is slower but more accurate.
+        :return: A list of (id, cosine similarity) tuples, most similar first.
+        """
+        query = normalize(vector).ravel()
+        lists = np.argsort(-(self.centroids @ query))[:n_probe]
+        rows = np.concatenate([np.arange(self.offsets[i], self.offsets[i + 1]) for i in lists])
+        if len(rows) == 0:
+            return []
+        scores = np.asarray(self.vectors[rows], dtype=np.float32) @ query
+        top = np.argsort(-scores)[:k]
+        return [(self.ids[rows[i]], float(scores[i])) for i in top]
+
+    def search_id(self, uuid: str, k: int = 10, n_probe: int = 8) -> List[Tuple[str, float]]:
+        """Find the most similar embeddings to an embedding in the index, excluding itself.
+
+        :param uuid: Id of an embedding in the index.
+        :param k: Number of results.
+        :param n_probe: Number of inverted lists to scan.
+        :return: A list of (id, cosine similarity) tuples, most similar first.
+        """
+        vector = np.asarray(self.vectors[self.id_rows[uuid]], dtype=np.float32)
+        results = self.search(vector, k=k + 1, n_probe=n_probe)
+        return [(other, score) for other, score in results if other != uuid][:k]
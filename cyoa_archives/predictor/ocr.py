@@ -1,82 +1,158 @@
+"""Keras OCR engine.
+
+keras_ocr (and tensorflow) take several seconds to import and the pipeline loads both the CRAFT detector and the
+CRNN recognizer, so nothing is loaded until the first ROI is read. All per-image state is kept in an ImageContext
+that is passed explicitly, so one engine can read several images at once from multiple threads.
+
+Typical usage example:
+
+  engine = KerasOCR(batch_size=8)
+  texts = engine.read_rois(rois, ImageContext.from_cv(cyoa_image.cv))
+
+"""
+
 import logging
+import threading
 import numpy
 from typing import List, Dict
 
-import cv2
-import keras_ocr
-
-from .roi import CyoaROI, BoundingBox, Chunk
+from .debug import DebugSink
+from .roi import CyoaROI, BoundingBox, Chunk, ImageContext
+from ..util.functions import DisjointSet, overlapping_pairs, suppress_overlaps
 
 logger = logging.getLogger(__name__)
 
 class KerasOCR:
     """Given a list of ROIs, fetch the text"""
 
-    PIPELINE = keras_ocr.pipeline.Pipeline()
-    img_xmax = None
-    img_ymax = None
-    cv = None
-
-    @classmethod
-    def set_image_dim(cls, x, y, cv):
-        cls.img_xmax = x
-        cls.img_ymax = y
-        cls.cv =cv
-        BoundingBox.set_image_dim(x, y)
-        Chunk.set_image_dim(x, y)
+    def __init__(self, batch_size: int = 8, scale: float = 2, max_size: int = 2048, max_padding: float = 1.5,
+                 debug_sink: DebugSink = None):
+        """Configure a KerasOCR engine; the pipeline itself is loaded on first use (see load).
 
-    @classmethod
-    def read_rois(cls, rois: List[CyoaROI], padding_factor: float = 1):
+        :param batch_size: Maximum number of ROIs passed to the pipeline per call.
+        :param scale: Maximum upscaling of ROIs by the pipeline.
+        :param max_size: Maximum size of the longer side of ROIs after scaling.
+        :param max_padding: Maximum ratio of padded to actual pixels in a batch (see get_batches).
+        :param debug_sink: A DebugSink to write the image of each chunk to (optional).
+        """
+        self.batch_size = batch_size
+        self.scale = scale
+        self.max_size = max_size
+        self.max_padding = max_padding
+        self.debug_sink = debug_sink
+        self.pipeline = None
+        self.lock = threading.Lock()
+
+    def load(self) -> None:
+        """Load the keras_ocr pipeline. Does nothing if already loaded."""
+        with self.lock:
+            if self.pipeline is None:
+                import keras_ocr
+                logger.info('Loading keras_ocr pipeline...')
+                self.pipeline = keras_ocr.pipeline.Pipeline(scale=self.scale, max_size=self.max_size)
+
+    def get_batches(self, rois: List[CyoaROI]) -> List[List[int]]:
+        """Group ROIs of similar size into batches.
+
+        The pipeline pads every image of a batch to the largest height and width in the batch, so ROIs are sorted by
+        size and a batch is closed once padding would waste too many pixels.
+
+        :param rois: A list of ROIs.
+        :return: A list of batches of indices into rois.
+        """
+        shapes = [roi.roi.shape[:2] for roi in rois]
+        order = sorted(range(len(rois)), key=lambda i: shapes[i])
+
+        batches = []
+        batch = []
+        max_height = max_width = pixels = 0
+        for i in order:
+            height, width = shapes[i]
+            new_height = max(max_height, height)
+            new_width = max(max_width, width)
+            new_pixels = pixels + height * width
+            if batch and (len(batch) == self.batch_size or
+                          new_height * new_width * (len(batch) + 1) > self.max_padding * max(new_pixels, 1)):
+                batches.append(batch)
+                batch = []
+                new_height, new_width, new_pixels = height, width, height * width
+            batch.append(i)
+            max_height, max_width, pixels = new_height, new_width, new_pixels
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def read_rois(self, rois: List[CyoaROI], context: ImageContext, padding_factor: float = 1) -> List[str]:
         """Read a list of ROIs, stitch together, and get text in a natural order.
 
         :param rois: A list of ROIs (cv images)
+        :param context: The image the ROIs were taken from.
         :param padding_factor: How many character units to pad each bounding box
-        :return:
+        :return: The text of each chunk of nearby words, from the top left.
         """
         # First, we get a list of all bounding boxes in all ROIs
         all_bounding_boxes = []
-        for i, roi in enumerate(rois[0:21]):
-            roi_boxes = cls.read_roi(roi)
-            logger.info(f'Detected {len(roi_boxes)} words in {i}/{len(rois)} rois.')
+        for roi_boxes in self.read_roi_batch(rois, context):
             all_bounding_boxes.extend(roi_boxes)
-        logger.info(f'Read a total of {len(all_bounding_boxes)} detections.')
+        logger.info(f'Read a total of {len(all_bounding_boxes)} detections in {len(rois)} rois.')
+        if not all_bounding_boxes:
+            return []
 
         # Sort the bounding boxes on the yaxis
         all_bboxes = sorted(all_bounding_boxes, key=lambda b: b.ymin)
 
         # Now, we chunk ROIs, after expanding each bounding box by a factor
-        chunks = cls.chunk_rois(all_bboxes, 1)
+        chunks = self.chunk_rois(all_bboxes, padding_factor)
 
-        # Lets print the chunks for debuging purposes
-        logger.info(f'Chunks: {len(chunks)}')
-        for i, chunk in enumerate(chunks):
-            cv = cls.cv[chunk.ymin:chunk.ymax, chunk.xmin:chunk.xmax]
-            cv2.imwrite(f'chunk_{i}.jpg', cv)
+        # Lets write the chunks for debuging purposes
+        if self.debug_sink is not None and context.cv is not None:
+            for i, chunk in enumerate(chunks):
+                cv = context.cv[chunk.ymin:chunk.ymax, chunk.xmin:chunk.xmax]
+                self.debug_sink.write_image(f'{context.name}_chunk_{i}.jpg', cv)
 
         # Perform non-maxima suppression to remove overlapping bounding boxes
         # Also print to text
+        texts = []
         for chunk in sorted(chunks, key=lambda c: c.get_distance()):
-            #logger.info(f'BEFORE: {len(chunk.boxes)}')
             # Perform suppression on bounding boxes
-            logger.info(chunk.to_string())
-            chunk.boxes = cls.nonmaxima_suppression(chunk.boxes, 0.7)
-            # logger.info(f'AFTER: {len(bboxes)}')
-            logger.info(chunk.to_string())
+            chunk.boxes = self.nonmaxima_suppression(chunk.boxes, 0.7)
+            texts.append(chunk.to_string())
+            logger.debug(texts[-1])
+        return texts
 
+    def read_roi_batch(self, rois: List[CyoaROI], context: ImageContext) -> List[List[BoundingBox]]:
+        """Runs Keras OCR on a list of ROI images, batching ROIs of similar size.
 
-    @classmethod
-    def read_roi(cls, roi: CyoaROI) -> List[BoundingBox]:
+        :param rois: A list of CyoaROI objects representing CV2 ROI images.
+        :param context: The image the ROIs were taken from.
+        :return: A list of BoundingBox's representing text and coordinates for each ROI
+        """
+        self.load()
+        results = [[] for roi in rois]
+        for batch in self.get_batches(rois):
+            # Perform keras ocr inference
+            # Keras models are not guaranteed to be thread-safe, so threads take turns running the pipeline
+            with self.lock:
+                predictions = self.pipeline.recognize([rois[i].roi for i in batch])
+            for i, groups in zip(batch, predictions):
+                results[i] = self.predictions_to_bboxes(rois[i], groups, context)
+            logger.debug(f'Read {len(batch)} rois of size {rois[batch[0]].roi.shape[:2]}.')
+        return results
+
+    def read_roi(self, roi: CyoaROI, context: ImageContext) -> List[BoundingBox]:
         """Runs Keras OCR on a single ROI image.
 
         :param roi: A CyoaROI object representing a CV2 ROI image.
+        :param context: The image the ROI was taken from.
         :return: A list of BoundingBox's representing text and coordinates
         """
-        # Perform keras ocr inference
-        read_image = keras_ocr.tools.read(roi.roi)
-        predictions = cls.PIPELINE.recognize([read_image])
+        return self.read_roi_batch([roi], context)[0]
 
+    @classmethod
+    def predictions_to_bboxes(cls, roi: CyoaROI, groups: List, context: ImageContext) -> List[BoundingBox]:
+        """Convert the keras_ocr predictions of an ROI (a list of (text, box) tuples) into BoundingBox's."""
         bounding_boxes = []
-        for group in predictions[0]:
+        for group in groups:
             text = group[0]
             if len(text):
                 top_left_x, top_left_y = group[1][0]
@@ -88,7 +164,8 @@ class KerasOCR:
                     xmin=top_left_x,
                     xmax=bottom_right_x,
                     ymin=bottom_right_y,
-                    ymax=top_left_y
+                    ymax=top_left_y,
+                    context=context
                 )
                 if bbox.is_valid():
                     bounding_boxes.append(bbox)
@@ -99,12 +176,16 @@ class KerasOCR:
     def chunk_rois(cls, rois: List[BoundingBox], padding_factor: float) -> List[Chunk]:
         """Given a list of bounding boxes, make a union of all intersecting boxes.
 
+        Overlapping pairs of padded boxes are found with a spatial grid (see overlapping_pairs), and each connected
+        component of overlapping boxes is merged into one chunk with a disjoint-set structure. A merged chunk covers
+        the hull of its boxes, which may overlap boxes or chunks that none of its boxes overlap, so the merge is
+        repeated on the chunks until no two chunks overlap.
+
         The padding factor is a value to multiply char_length units by.
         Since characters are taller than they are wide, define an arbitrary height-width
         radio (e.g. 0.7) so that the padding is greater on the y-axis.
 
         """
-        chunks = []
         queue = []
 
         # First, we add all rois to the queue and convert to a chunk datatype
@@ -126,92 +207,37 @@ class KerasOCR:
         for item in queue:
             item.pad_xy(pad_x, pad_y)
 
-        # We loop through the queue until it is empty
-        while len(queue) > 0:
-            this_item = queue[0]
-            queue_end = queue[1:]
-            # logger.info(f'Queue Length: {queue_end}')
-
-            # Break loop on last item
-            if len(queue_end) == 0:
-                chunks.append(this_item)
-                logger.info(f'Chunk: {(this_item.xmax - this_item.xmin)} x {(this_item.ymax - this_item.ymin)}')
+        # Merge the connected components of overlapping chunks, until the merged hulls no longer overlap
+        chunks = queue
+        while True:
+            coords = numpy.array([[c.xmin, c.ymin, c.xmax, c.ymax] for c in chunks])
+            components = DisjointSet(len(chunks))
+            for i, j in overlapping_pairs(coords).tolist():
+                components.union(i, j)
+
+            groups = {}
+            for chunk, label in zip(chunks, components.labels().tolist()):
+                groups.setdefault(label, []).append(chunk)
+            if len(groups) == len(chunks):
                 break
+            chunks = [group[0] if len(group) == 1 else Chunk.union(group) for group in groups.values()]
 
-            intersect_set = Chunk.intersect_set(this_item, queue_end)
-            overlap_list_idx = numpy.where(intersect_set)[0]
-            remainder_list_idx = numpy.where(~intersect_set)[0]
-            logger.info(f'Chunks: {len(chunks)} - Before: {len(queue_end)} - Overlap: {len(overlap_list_idx)} - Remainder: {len(remainder_list_idx)}')
-
-            # If there are any matches by intersection...
-            if len(overlap_list_idx) > 0:
-
-                overlap_list = []
-                for i in overlap_list_idx:
-                    overlap_list.append(queue_end[i])
-
-                # Create a union of the intersecting chunks
-                # logger.info(overlap_list)
-                union = Chunk.union(overlap_list)
-                logger.info(f'Union: {(union.xmax - union.xmin)} x {(union.ymax - union.ymin)}')
-
-                # Put the chunk back into the remaining queue
-                remainder_list = []
-                for i in remainder_list_idx:
-                    remainder_list.append(queue_end[i])
-                remainder_list.append(union)
-
-                # Reset the queue
-                queue = remainder_list
-
-            # If there are no matches, we report it as a distinct chunk
-            else:
-                chunks.append(this_item)
-                logger.info(f'Chunk: {(this_item.xmax - this_item.xmin)} x {(this_item.ymax - this_item.ymin)}')
-                queue = queue_end
-
+        logger.info(f'Chunks: {len(chunks)}')
         return chunks
 
     @classmethod
-    def nonmaxima_suppression(cls, rois: List[BoundingBox], threshold=0.3):
+    def nonmaxima_suppression(cls, rois: List[BoundingBox], threshold=0.3) -> List[BoundingBox]:
         """Suppress all bounding boxes when they overlap, and they're the smaller of the two boxes.
 
-        :param rois:
-        :return:
-        """
-        keep_list = []
-        queue = rois
-
-        while len(queue) > 0:
-            this_item = queue[0]
-            queue_end = queue[1:]
-            intersect_set = BoundingBox.intersect_set(this_item, queue_end, threshold)
-            overlap_list_idx = numpy.where(intersect_set)[0]
-            remainder_list_idx = numpy.where(~intersect_set)[0]
-
-            # If there are any matches by intersection...
-            if len(overlap_list_idx) > 0:
-
-                overlap_list = []
-                for i in overlap_list_idx:
-                    overlap_list.append(queue_end[i])
-
-                # Keep the largest intersecting BoundingBox
-                keep = BoundingBox.get_max_area_bbox(this_item, overlap_list)
-
-                # Put the largest back into the remaining queue
-                remainder_list = []
-                for i in remainder_list_idx:
-                    remainder_list.append(queue_end[i])
-                remainder_list.append(keep)
-
-                # Reset the queue
-                queue = remainder_list
-
-            # If there are no matches, we report it as a distinct chunk
-            else:
-                keep_list.append(this_item)
-                queue = queue_end
-
-        return keep_list
+        Boxes are resolved in list order: each box is merged with the boxes that cover more than threshold of its
+        own area, and only the largest of them is kept (see suppress_overlaps).
 
+        :param rois: A list of BoundingBox's.
+        :param threshold: Minimum fraction of a box that must be covered by another box to merge them.
+        :return: The kept BoundingBox's, in their original order.
+        """
+        if len(rois) < 2:
+            return list(rois)
+        coords = numpy.array([[b.xmin, b.ymin, b.xmax, b.ymax] for b in rois])
+        areas = numpy.array([b.area for b in rois])
+        return [rois[i] for i in suppress_overlaps(coords, areas, threshold)]
@@ -0,0 +1,118 @@
+"""Append-only store of DeepDanbooru results for the whole archive.
+
+Each run of a CYOA appends one row: the average score of every tag as a float16 vector, and a JSON line with the
+uuid and run information (pages, pixels, coverage, threshold and timestamp). The score file is a raw matrix of
+rows x tags that is memory-mapped on read, so aggregating or exporting the archive is a single vectorized read.
+
+Rows are never rewritten; if a CYOA is run again its newest row is the current result and older rows are kept as
+history (e.g. for diffing results between runs).
+
+Typical usage example:
+
+  store = ResultsStore('database/dd_results')
+  store.append(uuid, {'dd_sex': 0.1, 'dd_girl': 0.8}, {'pages': 3, 'timestamp': time.time()})
+  info, scores = store.load_latest()
+  df = store.to_frame()
+
+"""
+
+import json
+import logging
+import os
+import pathlib
+from typing import Dict, List, Tuple, Any, Optional
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+SCORE_DTYPE = np.float16
+TAGS_NAME = 'tags.npy'
+SCORES_NAME = 'scores.f16'
+ROWS_NAME = 'rows.jsonl'
+
+
+class ResultsStore:
+    """A memory-mappable matrix of CYOA runs x tags with a JSON lines index of the runs."""
+
+    def __init__(self, store_path: pathlib.Path):
+        """Initializes a ResultsStore, loading the tag order if the store exists.
+
+        :param store_path: Folder to keep the store in (created on the first append).
+        """
+        self.store_path = pathlib.Path(store_path)
+        self.tags_path = pathlib.Path(self.store_path, TAGS_NAME)
+        self.scores_path = pathlib.Path(self.store_path, SCORES_NAME)
+        self.rows_path = pathlib.Path(self.store_path, ROWS_NAME)
+        self.tags = np.load(self.tags_path).tolist() if self.tags_path.exists() else None
+        self.tag_columns = {tag: i for i, tag in enumerate(self.tags)} if self.tags else None
+
+    def set_tags(self, tags: List[str]) -> None:
+        """Fix the tag order (columns) of a new store."""
+        os.makedirs(self.store_path, exist_ok=True)
+        np.save(self.tags_path, np.array(tags, dtype=str))
+        self.tags = list(tags)
+        self.tag_columns = {tag: i for i, tag in enumerate(self.tags)}
+
+    def append(self, uuid: str, scores: Dict[str, float], info: Optional[Dict[str, Any]] = None) -> None:
+        """Append the result of a run of a CYOA.
+
+        The columns of the store are the tags of the first appended result. Tags missing from a result are stored as
+        0; tags that are not columns of the store are dropped.
+
+        :param uuid: The uuid of the CYOA.
+        :param scores: A dictionary of tag -> average score.
+        :param info: JSON-serializable run information (e.g. pages, pixels, coverage, threshold, timestamp).
+        """
+        if self.tags is None:
+            if not scores:
+                logger.warning(f'RESULTS: Cannot start a store without tags; skipping {uuid}.')
+                return
+            self.set_tags(list(scores.keys()))
+        unknown = [tag for tag in scores if tag not in self.tag_columns]
+        if unknown:
+            logger.warning(f'RESULTS: Dropping {len(unknown)} tags that are not in the store (e.g. {unknown[0]}).')
+
+        row = np.zeros(len(self.tags), dtype=SCORE_DTYPE)
+        for tag, score in scores.items():
+            column = self.tag_columns.get(tag)
+            if column is not None:
+                row[column] = score
+
+        # Write the scores before the index, so that an interrupted append leaves no index row without scores
+        with open(self.scores_path, 'ab') as f:
+            f.write(row.tobytes())
+        with open(self.rows_path, 'a') as f:
+            f.write(json.dumps(dict(info or {}, uuid=uuid), default=str) + '\n')
+
+    def load(self) -> Tuple[pd.DataFrame, np.ndarray]:
+        """Read every row of the store, including older runs of the same CYOA.
+
+        :return: A DataFrame of run information (one row per run, in append order) and a memory-mapped
+            (runs x tags) float16 matrix of scores.
+        """
+        if self.tags is None or not self.rows_path.exists():
+            return pd.DataFrame(columns=['uuid']), np.zeros((0, len(self.tags or [])), dtype=SCORE_DTYPE)
+        info = pd.read_json(self.rows_path, lines=True, dtype=False, convert_dates=False)
+        scores = np.memmap(self.scores_path, dtype=SCORE_DTYPE, mode='r', shape=(len(info), len(self.tags)))
+        return info, scores
+
+    def load_latest(self) -> Tuple[pd.DataFrame, np.ndarray]:
+        """Read the newest row of every CYOA.
+
+        :return: A DataFrame of run information indexed by uuid and a (CYOAs x tags) float16 matrix of scores.
+        """
+        info, scores = self.load()
+        latest = ~info['uuid'].duplicated(keep='last').to_numpy() if len(info) else np.zeros(0, dtype=bool)
+        return info[latest].set_index('uuid'), np.asarray(scores[latest])
+
+    def to_frame(self, tags: Optional[List[str]] = None) -> pd.DataFrame:
+        """Get the newest scores of every CYOA as a DataFrame.
+
+        :param tags: Tags (columns) to include; defaults to all tags.
+        :return: A (CYOAs x tags) float32 DataFrame indexed by uuid.
+        """
+        info, scores = self.load_latest()
+        df = pd.DataFrame(scores.astype(np.float32), index=info.index, columns=self.tags or [])
+        return df[tags] if tags is not None else df
@@ -4,23 +4,31 @@ import numpy
 import pathlib
 from typing import TypeVar, List
 
-import cv2
 
 logger = logging.getLogger(__name__)
 
 class CyoaROI:
     """Represents a region of interest (ROI) in a CYOA image."""
 
-    def __init__(self, roi, x: int, y: int, size: int, cyoa_filepath: pathlib.Path):
+    def __init__(self, roi, x: int, y: int, size: int, cyoa_filepath: pathlib.Path, debug_sink=None):
+        """Construct a CyoaROI.
+
+        :param roi: A slice from a loaded CV2 image.
+        :param x: The absolute xmin coordinate (left).
+        :param y: The absolute ymin coordinate (top).
+        :param size: Size of the ROI.
+        :param cyoa_filepath: Path to the CYOA image the ROI was taken from.
+        :param debug_sink: A DebugSink to write the ROI image to (optional).
+        """
         self.roi = roi
         self.x = x
         self.y = y
         self.size = size
 
-        # Save ROI to file
-        self.filename = str(pathlib.Path(cyoa_filepath.parent, cyoa_filepath.stem + f'_{y}_{x}.jpg'))
-        logger.info(f'Writing to file: {self.filename}')
-        cv2.imwrite(self.filename, self.roi)
+        # Save ROI to the debug directory
+        self.filename = cyoa_filepath.stem + f'_{y}_{x}.jpg'
+        if debug_sink is not None:
+            debug_sink.write_image(self.filename, self.roi)
 
     def ocr_text(self):
         pass
@@ -29,29 +37,53 @@ class CyoaROI:
         pass
 
 
+class ImageContext:
+    """The image that a set of bounding boxes and chunks belong to.
+
+    Boxes and chunks keep a reference to their context instead of sharing class attributes, so several images can be
+    processed at the same time.
+    """
+
+    def __init__(self, xmax: int, ymax: int, cv=None, char_hw_ratio: float = 0.7, name: str = 'image'):
+        """Construct an ImageContext.
+
+        :param xmax: Width of the image; coordinates are clamped to it.
+        :param ymax: Height of the image; coordinates are clamped to it.
+        :param cv: The CV2 image (optional).
+        :param char_hw_ratio: Ratio of character width to height, used to estimate the height of text boxes.
+        :param name: Name of the image, used to name debug artifacts.
+        """
+        self.xmax = xmax
+        self.ymax = ymax
+        self.cv = cv
+        self.char_hw_ratio = char_hw_ratio
+        self.name = name
+
+    @classmethod
+    def from_cv(cls, cv, char_hw_ratio: float = 0.7, name: str = 'image'):
+        return cls(xmax=cv.shape[1], ymax=cv.shape[0], cv=cv, char_hw_ratio=char_hw_ratio, name=name)
+
+
 class BoundingBox:
-    char_hw_ratio = 1
-    img_xmax = None
-    img_ymax = None
-    def __init__(self, text: str, roi_x: int, roi_y: int, xmin: float, xmax: float, ymin: float, ymax: float):
+    def __init__(self, text: str, roi_x: int, roi_y: int, xmin: float, xmax: float, ymin: float, ymax: float,
+                 context: ImageContext = None):
+        self.context = context
+        img_xmax = context.xmax if context else None
+        img_ymax = context.ymax if context else None
+        char_hw_ratio = context.char_hw_ratio if context else 1
+
         input_ymin = roi_y + int(ymin if ymin > 0 else 0)
         input_ymax = roi_y + int(ymax if ymax > 0 else 0)
 
         self.text = text
-        self.xmin = self.safe_set(roi_x + int(xmin if xmin > 0 else 0), max_value=self.img_xmax)
-        self.xmax = self.safe_set(roi_x + int(xmax if xmax > 0 else 0), max_value=self.img_xmax)
-        self.ymin = self.safe_set(int((input_ymin + input_ymax) / 2), max_value=self.img_ymax)
+        self.xmin = self.safe_set(roi_x + int(xmin if xmin > 0 else 0), max_value=img_xmax)
+        self.xmax = self.safe_set(roi_x + int(xmax if xmax > 0 else 0), max_value=img_xmax)
+        self.ymin = self.safe_set(int((input_ymin + input_ymax) / 2), max_value=img_ymax)
         self.len_char = (self.xmax - self.xmin) / len(text)
-        self.yheight = self.len_char / self.char_hw_ratio
-        self.ymax = self.safe_set(int(self.ymin + self.yheight), max_value=self.img_ymax)
+        self.yheight = self.len_char / char_hw_ratio
+        self.ymax = self.safe_set(int(self.ymin + self.yheight), max_value=img_ymax)
         self.area = (self.xmax - self.xmin) * self.yheight
 
-    @classmethod
-    def set_image_dim(cls, x, y, char_hw_ratio=0.7):
-        cls.img_xmax = x
-        cls.img_ymax = y
-        cls.char_hw_ratio = char_hw_ratio
-
     @classmethod
     def safe_set(cls, value: int, max_value: int):
         if value < 0:
@@ -97,22 +129,16 @@ class BoundingBox:
         return top_bbox
 
 class Chunk:
-    img_xmax = None
-    img_ymax = None
 
-    def __init__(self, boxes, xmin, xmax, ymin, ymax, line_height=10):
+    def __init__(self, boxes, xmin, xmax, ymin, ymax, line_height=10, context: ImageContext = None):
         self.boxes = boxes if boxes else []
+        self.context = context
         self.xmin = xmin
         self.xmax = xmax
         self.ymin = ymin
         self.ymax = ymax
         self.line_height = line_height
 
-    @classmethod
-    def set_image_dim(cls, x, y):
-        cls.img_xmax = x
-        cls.img_ymax = y
-
     @classmethod
     def from_bbox(cls, bbox: BoundingBox):
         return cls(
@@ -120,14 +146,17 @@ class Chunk:
             xmin=bbox.xmin,
             xmax=bbox.xmax,
             ymin=bbox.ymin,
-            ymax=bbox.ymax
+            ymax=bbox.ymax,
+            context=bbox.context
         )
 
     def pad_xy(self, pad_x, pad_y):
-        self.xmin = self.safe_set(self.xmin - pad_x, max_value=self.img_xmax)
-        self.xmax = self.safe_set(self.xmax + pad_x, max_value=self.img_xmax)
-        self.ymin = self.safe_set(self.ymin - pad_y, max_value=self.img_ymax)
-        self.ymax = self.safe_set(self.ymax + pad_y, max_value=self.img_ymax)
+        img_xmax = self.context.xmax if self.context else None
+        img_ymax = self.context.ymax if self.context else None
+        self.xmin = self.safe_set(self.xmin - pad_x, max_value=img_xmax)
+        self.xmax = self.safe_set(self.xmax + pad_x, max_value=img_xmax)
+        self.ymin = self.safe_set(self.ymin - pad_y, max_value=img_ymax)
+        self.ymax = self.safe_set(self.ymax + pad_y, max_value=img_ymax)
         self.line_height = pad_y
 
     def get_distance(self):
@@ -180,37 +209,38 @@ class Chunk:
             xmin=min(xmin),
             xmax=max(xmax),
             ymin=min(ymin),
-            ymax=max(ymax)
+            ymax=max(ymax),
+            context=chunk_list[0].context
         )
 
-    def to_string(self):
-        # Sort the bounding boxes on the x-axis
-        self.boxes = sorted(self.boxes, key=lambda b: b.xmin)
-        queue = self.boxes
+    def get_lines(self, gap_factor: float = 0.5) -> List[List[BoundingBox]]:
+        """Group the boxes of the chunk into lines of text in reading order.
 
+        Boxes are sorted by their vertical centre and swept once: a box starts a new line if its centre is more than
+        gap_factor times the median box height below the mean centre of the current line.
+
+        :param gap_factor: Vertical gap between lines, relative to the median box height.
+        :return: A list of lines from top to bottom, each a list of boxes from left to right.
         """
-        t = ""
-        for box in queue:
-            t = t + " " + box.text
-        return t
-        """
+        if not self.boxes:
+            return []
+        boxes = sorted(self.boxes, key=lambda b: (b.ymin + b.ymax) / 2)
+        threshold = gap_factor * numpy.median([b.ymax - b.ymin for b in boxes])
+
+        lines = []
+        line = [boxes[0]]
+        line_centre = (boxes[0].ymin + boxes[0].ymax) / 2
+        for bbox in boxes[1:]:
+            centre = (bbox.ymin + bbox.ymax) / 2
+            if centre - line_centre > threshold:
+                lines.append(line)
+                line = [bbox]
+                line_centre = centre
+            else:
+                line.append(bbox)
+                line_centre += (centre - line_centre) / len(line)
+        lines.append(line)
+        return [sorted(line, key=lambda b: b.xmin) for line in lines]
 
-        # Iterate through the entire y-axis
-        rows = []
-        step_size = int(self.line_height)
-        for y in range(self.ymin, self.ymax, step_size):
-            this_row = []
-            for i, bbox in enumerate(queue):
-                if bbox.ymin <= y < bbox.ymax:
-                    item = queue[0]
-                    queue = queue[1:]
-                    this_row.append(item.text)
-            if len(this_row):
-                rows.append(this_row)
-
-        # Now print the rows
-        text = ""
-        for row in rows:
-            for word in row:
-                text = text + " " + word
-        return text.strip()
+    def to_string(self):
+        return ' '.join(bbox.text for line in self.get_lines() for bbox in line)
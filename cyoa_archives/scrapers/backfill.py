@@ -0,0 +1,192 @@
+"""Resumable Pulseshift backfill
+
+Provides a class for scraping a long time range of a subreddit from the Pulseshift API.
+
+The range [after, before) is split into time shards (aligned to multiples of the shard length). Shards are fetched
+concurrently by a pool of threads; the requests of all threads share the rate limiter of the PulseshiftAPIWrapper.
+Each shard pages backwards from its end with PulseshiftAPIWrapper.next_page (like PulseshiftAPIWrapper.scrape),
+and every page is appended to the JSON lines file of the shard as soon as it arrives, so results are never held in
+memory.
+
+After every page, the shard's paging state (the timestamp to continue from, and the ids already fetched at that
+second) and the size of its file are saved in a small checkpoint file. If a backfill is interrupted, or a shard runs
+out of retries, running it again continues every unfinished shard from its cursor; anything written after the last
+checkpoint is truncated, so no row is duplicated.
+
+Files are kept in <output_dir>/<subreddit>/:
+  backfill.json                   The range of the backfill (so that it can be resumed without passing before).
+  <start>_<end>.jsonl             Raw submissions with start <= created_utc < end, newest first.
+  <start>_<end>.json              Checkpoint of the shard (cursor, seen ids, file size, done).
+
+Typical usage example:
+
+  backfill = PulseshiftBackfill(PulseshiftAPIWrapper(config.get('reddit_scraper')), 'database/pulseshift')
+  backfill.run('makeyourchoice', after=1586842926, before=1672531200)
+  df = backfill.to_pd('makeyourchoice')
+
+"""
+
+import json
+import logging
+import os
+import pathlib
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+from .normalize import normalize_submissions
+from .pulseshift import PulseshiftAPIWrapper
+
+logger = logging.getLogger(__name__)
+MANIFEST_NAME = 'backfill.json'
+DEFAULT_SHARD_DAYS = 30
+DEFAULT_WORKERS = 4
+MAX_RETRY_WAIT = 60
+
+
+def write_json(path: pathlib.Path, obj: Dict[str, Any]) -> None:
+    """Write a JSON file atomically (a reader sees either the old or the new file)."""
+    temp_path = path.with_suffix(path.suffix + '.tmp')
+    with open(temp_path, 'w') as f:
+        json.dump(obj, f)
+    os.replace(temp_path, path)
+
+
+class PulseshiftBackfill:
+    """Time-sharded, concurrent and resumable scrape of the Pulseshift API."""
+
+    def __init__(self, api: PulseshiftAPIWrapper, output_dir: pathlib.Path, shard_days: Optional[float] = None,
+                 workers: Optional[int] = None, size: Optional[int] = None):
+        """Initializes a PulseshiftBackfill.
+
+        :param api: The API wrapper used for (and rate limiting) requests.
+        :param output_dir: Folder to keep shard files and checkpoints in.
+        :param shard_days: Length of a shard in days (defaults to pulseshift_shard_days or 30).
+        :param workers: Number of shards fetched concurrently (defaults to pulseshift_workers or 4).
+        :param size: Number of results per request (defaults to pulseshift_limit).
+        """
+        self.api = api
+        self.output_dir = pathlib.Path(output_dir)
+        self.shard_seconds = int(86400 * (shard_days or api.config.get('pulseshift_shard_days', DEFAULT_SHARD_DAYS)))
+        self.workers = workers or api.config.get('pulseshift_workers', DEFAULT_WORKERS)
+        self.size = size or api.config.get('pulseshift_limit')
+        self.max_retry = api.config.get('pulseshift_max_retry') or 1
+
+    def shards(self, after: int, before: int) -> List[Tuple[int, int]]:
+        """Split [after, before) into shards aligned to multiples of the shard length, newest first."""
+        shards = []
+        end = before
+        while end > after:
+            start = max(after, (end - 1) // self.shard_seconds * self.shard_seconds)
+            shards.append((start, end))
+            end = start
+        return shards
+
+    def shard_paths(self, subreddit_name: str, shard: Tuple[int, int]) -> Tuple[pathlib.Path, pathlib.Path]:
+        """Get the paths of the results and checkpoint files of a shard."""
+        name = f'{shard[0]}_{shard[1]}'
+        folder = pathlib.Path(self.output_dir, subreddit_name)
+        return pathlib.Path(folder, name + '.jsonl'), pathlib.Path(folder, name + '.json')
+
+    def load_manifest(self, subreddit_name: str) -> Optional[Dict[str, Any]]:
+        path = pathlib.Path(self.output_dir, subreddit_name, MANIFEST_NAME)
+        if path.exists():
+            with open(path) as f:
+                return json.load(f)
+        return None
+
+    def run(self, subreddit_name: str, after: Optional[int] = None, before: Optional[int] = None) -> bool:
+        """Fetch (or continue fetching) every shard of a subreddit between two timestamps.
+
+        :param subreddit_name: Name of subreddit as a string (without r/ prefixed).
+        :param after: Fetch results created at or after this unix timestamp (defaults to the previous run or 0).
+        :param before: Fetch results created before this unix timestamp (defaults to the previous run or now).
+        :return: True if every shard is complete; False if some shards should be resumed.
+        """
+        manifest = self.load_manifest(subreddit_name) or {}
+        if after is None:
+            after = manifest.get('after', 0)
+        if before is None:
+            before = manifest.get('before') if manifest.get('after') == after else None
+            before = before or int(time.time())
+        os.makedirs(pathlib.Path(self.output_dir, subreddit_name), exist_ok=True)
+        write_json(pathlib.Path(self.output_dir, subreddit_name, MANIFEST_NAME), {'after': after, 'before': before})
+
+        shards = self.shards(after, before)
+        logger.info(f'BACKFILL: Fetching [{subreddit_name}] ({after}-{before}) in {len(shards)} shards '
+                    f'with {self.workers} workers...')
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            complete = list(executor.map(lambda shard: self.fetch_shard(subreddit_name, shard), shards))
+        logger.info(f'BACKFILL: Completed {sum(complete)} of {len(shards)} shards of [{subreddit_name}].')
+        return all(complete)
+
+    def fetch_shard(self, subreddit_name: str, shard: Tuple[int, int]) -> bool:
+        """Fetch a shard from its checkpoint until it is complete or runs out of retries.
+
+        :param subreddit_name: Name of subreddit as a string (without r/ prefixed).
+        :param shard: The (start, end) timestamps of the shard.
+        :return: True if the shard is complete.
+        """
+        start, end = shard
+        results_path, checkpoint_path = self.shard_paths(subreddit_name, shard)
+        checkpoint = {'cursor': end - 1, 'seen': [], 'offset': 0, 'rows': 0, 'done': False}
+        if checkpoint_path.exists():
+            with open(checkpoint_path) as f:
+                checkpoint = json.load(f)
+        if checkpoint['done']:
+            return True
+
+        num_errors = 0
+        with open(results_path, 'ab') as f:
+            # Drop anything written after the last checkpoint
+            f.truncate(checkpoint['offset'])
+            while not checkpoint['done'] and checkpoint['cursor'] >= start:
+                try:
+                    page = self.api.next_page(subreddit_name, checkpoint, size=self.size,
+                                              after=start - 1 if start else None)
+                except Exception as e:
+                    num_errors = num_errors + 1
+                    logger.warning(f'BACKFILL: Failed request at {checkpoint["cursor"]} from [{subreddit_name}] '
+                                   f'({num_errors}/{self.max_retry}). Exception: {e}')
+                    if num_errors >= self.max_retry:
+                        return False
+                    time.sleep(min(2 ** num_errors, MAX_RETRY_WAIT))
+                    continue
+
+                f.write(''.join(json.dumps(row) + '\n' for row in page).encode('utf-8'))
+                f.flush()
+                os.fsync(f.fileno())
+                checkpoint['offset'] = f.tell()
+                checkpoint['rows'] += len(page)
+                write_json(checkpoint_path, checkpoint)
+
+        checkpoint['done'] = True
+        write_json(checkpoint_path, checkpoint)
+        logger.info(f'BACKFILL: Fetched {checkpoint["rows"]} submissions from [{subreddit_name}] ({start}-{end}).')
+        return True
+
+    def iter_json(self, subreddit_name: str) -> Iterator[Dict[str, Any]]:
+        """Read the raw submissions of the last backfill of a subreddit (complete or not), newest first."""
+        manifest = self.load_manifest(subreddit_name)
+        if not manifest:
+            return
+        for shard in self.shards(manifest['after'], manifest['before']):
+            results_path, checkpoint_path = self.shard_paths(subreddit_name, shard)
+            if not checkpoint_path.exists():
+                continue
+            with open(checkpoint_path) as f:
+                offset = json.load(f)['offset']
+            with open(results_path, 'rb') as f:
+                position = 0
+                for line in f:
+                    position += len(line)
+                    if position > offset:
+                        break
+                    yield json.loads(line)
+
+    def to_pd(self, subreddit_name: str, remove_low_score: bool = True) -> pd.DataFrame:
+        """Process the submissions of the last backfill of a subreddit (see normalize_submissions)."""
+        return normalize_submissions(list(self.iter_json(subreddit_name)), remove_low_score=remove_low_score)
@@ -0,0 +1,96 @@
+"""Matching texts against lists of substrings.
+
+The reddit scraper configuration has several lists of substrings (bad urls, bad titles, good flairs, ...) that every
+submission is checked against. SubstringMatcher compiles such a list once. Lists of fewer than 100 patterns, which
+includes every list of the current configuration, are checked with one str.__contains__ per pattern: it is implemented
+in C, and a single-pass regex is 2-4x slower at that size (see code_snippets/benchmark_matcher.py). Longer lists are
+compiled into a single regular expression factored into a trie, so that each text is scanned once regardless of the
+number of patterns; from about 200 patterns this is faster.
+
+Typical usage example:
+
+  matcher = SubstringMatcher(['Meta', 'Discussion'])
+  if matcher.search(flair):
+      ...
+
+"""
+
+import re
+from typing import Dict, Iterable, List, Optional
+
+# Number of patterns from which a trie regex is used; below it, checking each pattern in turn is faster
+REGEX_MIN_PATTERNS = 100
+
+
+def trie_regex(words: List[str]) -> str:
+    """Compile a list of words into a regular expression that matches any of them, factored by common prefixes.
+
+    :param words: A list of literal words.
+    :return: A non-capturing regular expression.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def node_regex(node: Dict) -> str:
+        branches = [re.escape(char) + node_regex(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        optional = '' in node
+        if len(branches) == 1 and not optional:
+            return branches[0]
+        return '(?:' + '|'.join(branches) + ')' + ('?' if optional else '')
+
+    return node_regex(trie)
+
+
+class SubstringMatcher:
+    """Finds which of a list of substrings occur in a text (case-sensitive, like the in operator)."""
+
+    def __init__(self, patterns: Optional[Iterable[str]], min_regex_patterns: int = REGEX_MIN_PATTERNS):
+        """Compile a list of substrings.
+
+        :param patterns: The substrings to look for (None is treated as an empty list).
+        :param min_regex_patterns: Number of patterns from which a trie regex is used.
+        """
+        self.patterns = list(dict.fromkeys(patterns or []))
+
+        # The empty string is a substring of every text
+        self.match_all = '' in self.patterns
+        self.regex = None
+        if len(self.patterns) >= min_regex_patterns:
+            self.regex = re.compile(trie_regex([pattern for pattern in self.patterns if pattern]))
+
+    def search(self, text: Optional[str]) -> Optional[str]:
+        """Find the first pattern (in order of the list, or leftmost in the text for long lists) that occurs in text.
+
+        :param text: The text to search (None never matches).
+        :return: A matching pattern, or None if there is no match.
+        """
+        if text is None:
+            return None
+        if self.match_all:
+            return ''
+        if self.regex is not None:
+            match = self.regex.search(text)
+            return match.group(0) if match else None
+        for pattern in self.patterns:
+            if pattern in text:
+                return pattern
+        return None
+
+    def find_all(self, text: Optional[str]) -> List[str]:
+        """Find every pattern that occurs in text.
+
+        :param text: The text to search (None never matches).
+        :return: The matching patterns, in order of the list.
+        """
+        if text is None:
+            return []
+        return [pattern for pattern in self.patterns if pattern in text]
+
+    def __bool__(self) -> bool:
+        return len(self.patterns) > 0
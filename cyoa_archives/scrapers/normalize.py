@@ -0,0 +1,186 @@
+"""Batch normalization of reddit submissions
+
+Provides the DataFrame equivalent of RedditSubmission: a whole batch of raw submissions (e.g. a Pulseshift backfill)
+is validated once and processed column by column, instead of constructing one RedditSubmission per post.
+
+The output has one row per submission and the same columns (in the same order) and values as a DataFrame built from
+the dictionaries of RedditSubmission objects (i.e. pd.DataFrame.from_dict([dict(RedditSubmission(row)) for row in
+rows])), so it can be merged with Grist tables and uploaded the same way.
+
+Typical usage example:
+
+  RedditSubmission.load_config(config.get('reddit_scraper'))
+  df = normalize_submissions(pulseshift_rows, remove_low_score=True)
+
+"""
+
+import logging
+import time
+
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Union
+
+import numpy
+import pandas as pd
+import redditcleaner
+
+from .submission import RedditSubmission, IMAGE_EXTENSIONS, REQUIRED_FIELDS, OPTIONAL_FIELDS, YES, NO, NULL
+from .urls import extract_urls
+
+logger = logging.getLogger(__name__)
+URL_TYPES = ['static', 'interactive']
+OUTPUT_FIELDS = ['urls', 'static_url', 'interactive_url', 'is_cyoa', 'r_id', 'parser_timestamp']
+
+
+def validate_records(records: List[Dict[str, Any]]) -> None:
+    """Raise a ValueError if any record lacks a required attribute."""
+    counts = Counter(key for record in records for key in record)
+    for key in REQUIRED_FIELDS:
+        if counts[key] < len(records):
+            raise ValueError(f'{len(records) - counts[key]} reddit submission(s) lack ({key}) attribute.')
+
+
+def submission_columns(key_lists: Iterable[Iterable[str]]) -> List[str]:
+    """The columns of a DataFrame built from the dictionaries of RedditSubmission objects.
+
+    Each RedditSubmission keeps the keys of its JSON (except id), then adds the missing optional fields and the output
+    fields; a DataFrame built from several dictionaries has their columns in order of first appearance.
+
+    :param key_lists: The keys of each raw submission (only distinct lists of keys are needed).
+    :return: A list of column names.
+    """
+    columns = {}
+    for keys in key_lists:
+        columns.update(dict.fromkeys(key for key in keys if key != 'id'))
+        columns.update(dict.fromkeys(OPTIONAL_FIELDS + OUTPUT_FIELDS))
+    return list(columns)
+
+
+def clean_texts(texts: pd.Series) -> pd.Series:
+    """Clean reddit markdown from a column of texts (see RedditSubmission.clean_text)."""
+    cleaned = {text: redditcleaner.clean(text, link=False) for text in texts.unique()}
+    return texts.map(cleaned).str.replace('\r', '', regex=False).str.replace('\\', '', regex=False) \
+        .str.split().str.join(' ')
+
+
+def concat_submissions(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenate DataFrames of processed submissions, with the columns of a DataFrame built from all of them."""
+    if not frames:
+        return normalize_submissions([])
+    columns = list(dict.fromkeys(column for df in frames for column in df.columns))
+    return pd.concat(frames, ignore_index=True).reindex(columns=columns)
+
+
+def normalize_submissions(data: Union[List[Dict[str, Any]], pd.DataFrame], remove_low_score: bool = False,
+                          skip_invalid: bool = False) -> pd.DataFrame:
+    """Process a batch of reddit submissions like RedditSubmission.
+
+    Missing values (None or NaN) of a DataFrame are treated as None, so a DataFrame gives the same result as the list
+    of records it was built from. RedditSubmission.load_config must have been called.
+
+    :param data: A list of JSON representations of reddit submissions, or a DataFrame with one submission per row.
+    :param remove_low_score: Classify submissions with few comments and a low score as not CYOAs.
+    :param skip_invalid: If a submission cannot be processed, log and drop it instead of raising an error.
+    :return: A DataFrame with one row per submission.
+    """
+    if skip_invalid:
+        try:
+            return normalize_submissions(data, remove_low_score=remove_low_score)
+        except Exception as e:
+            logger.warning(f'NORMALIZE: Failed to process a batch of {len(data)} submissions, retrying one by one.')
+            logger.warning(f'Exception: {e}')
+
+        # Process submissions one at a time, so that only the invalid ones are dropped
+        frames = []
+        for i in range(len(data)):
+            row = data.iloc[i:i + 1] if isinstance(data, pd.DataFrame) else data[i:i + 1]
+            try:
+                frames.append(normalize_submissions(row, remove_low_score=remove_low_score))
+            except Exception as e:
+                logger.warning(f'NORMALIZE: Skipped invalid reddit submission {i} of the batch: {e}')
+        return concat_submissions(frames) if frames else normalize_submissions(data[:0])
+
+    config = RedditSubmission.CONFIG
+    if not config:
+        raise ValueError(f'Configuration file for RedditSubmission class was not set.')
+    if RedditSubmission.MATCHERS is None:
+        RedditSubmission.load_config(config)
+    matchers = RedditSubmission.MATCHERS
+
+    # Validate the batch once, and process it as objects so that values are the same as in the JSON
+    if isinstance(data, pd.DataFrame):
+        for key in REQUIRED_FIELDS:
+            if key not in data:
+                raise ValueError(f'Reddit submissions lack ({key}) attribute.')
+        df = data.reset_index(drop=True).astype(object)
+    else:
+        validate_records(data)
+        df = pd.DataFrame(list(data), columns=None if len(data) else REQUIRED_FIELDS, dtype=object)
+    df = df.where(df.notna(), None)
+    for key in OPTIONAL_FIELDS:
+        if key not in df:
+            df[key] = None
+    if df.empty:
+        return pd.DataFrame(columns=[key for key in df.columns if key != 'id'] + OUTPUT_FIELDS)
+    not_text = ~df['selftext'].map(lambda text: isinstance(text, str))
+    if not_text.any():
+        raise ValueError(f'{not_text.sum()} reddit submission(s) have a (selftext) that is not a string.')
+
+    # Extract urls from the selftext and url (without duplicates, in order of appearance)
+    texts = (df['selftext'] + ' ' + df['url'].where(df['url'].astype(bool), '')).str.replace('\\', '', regex=False)
+    url_lists = [list(dict.fromkeys(urls)) for urls in texts.map(extract_urls)]
+
+    # Remove urls that link back to their post or contain bad substrings; every distinct url is only matched once
+    unique_urls = set(url for urls in url_lists for url in urls)
+    is_bad = {url: matchers.get('bad_urls').search(url) is not None for url in unique_urls}
+    url_lists = [[url for url in urls if not is_bad[url] and permalink not in url]
+                 for urls, permalink in zip(url_lists, df['permalink'])]
+
+    # The first gallery url of each type, or the image url if there is exactly one
+    unique_urls = set(url for urls in url_lists for url in urls)
+    is_image = {url: IMAGE_EXTENSIONS.search(url) is not None for url in unique_urls}
+    first_urls = {}
+    for cyoa_type in URL_TYPES:
+        url_matcher = matchers.get('good_urls').get(cyoa_type)
+        is_match = {url: url_matcher.search(url) is not None for url in unique_urls}
+        first_urls[cyoa_type] = []
+        for urls in url_lists:
+            galleries = [url for url in urls if is_match[url] and not is_image[url]]
+            images = [url for url in urls if is_match[url] and is_image[url]]
+            first_urls[cyoa_type].append(galleries[0] if galleries else images[0] if len(images) == 1 else None)
+
+    # Classify submissions; any reason to reject takes precedence over a good flair
+    has_urls = numpy.array([len(urls) > 0 for urls in url_lists], dtype=bool)
+    is_no = df['removed_by_category'].astype(bool) | df['locked'].astype(bool)
+    is_no |= df['selftext'].map(lambda text: matchers.get('bad_selftext').search(text) is not None)
+    is_no |= df['title'].map(lambda text: matchers.get('bad_title').search(text) is not None)
+    if config.get('remove_text_only'):
+        is_no |= df['is_self'].astype(bool) & ~has_urls
+    if remove_low_score:
+        low_karma_threshold = config.get('low_karma_threshold')
+        is_no |= (df['num_comments'].map(int) <= low_karma_threshold.get('comments')) & \
+                 (df['score'].map(int) <= low_karma_threshold.get('score'))
+    flairs = df['link_flair_text'].where(df['link_flair_text'].astype(bool), None)
+    is_no |= flairs.map(lambda flair: matchers.get('bad_flair').search(flair) is not None)
+    is_yes = flairs.map(lambda flair: matchers.get('good_flair').search(flair) is not None)
+
+    # Assemble the columns in the order RedditSubmission adds them
+    columns = {key: df[key] for key in df.columns if key != 'id'}
+    columns.update({
+        'urls': [', '.join(urls) for urls in url_lists],
+        'static_url': first_urls['static'],
+        'interactive_url': first_urls['interactive'],
+        'is_cyoa': [NO if no else YES if yes else NULL for no, yes in zip(is_no, is_yes)],
+        'selftext': clean_texts(df['selftext']),
+        'permalink': config.get('reddit_url') + df['permalink'],
+        'author': df['author'].map(str),
+        'subreddit': df['subreddit'].map(str),
+        'r_id': df['id'],
+        'parser_timestamp': int(time.time())
+    })
+    result = pd.DataFrame({key: value.tolist() if isinstance(value, pd.Series) else value
+                           for key, value in columns.items()}, index=df.index)
+    key_lists = [data.columns] if isinstance(data, pd.DataFrame) else dict.fromkeys(tuple(record) for record in data)
+    result = result[submission_columns(key_lists)]
+    logger.debug(f'NORMALIZE: Processed {len(result)} submissions ({(result["is_cyoa"] == YES).sum()} CYOAs).')
+    return result
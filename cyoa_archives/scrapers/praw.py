@@ -9,12 +9,22 @@ __version__ = 0.5
 import logging
 import praw
 
-from typing import List, Dict, Any
+from typing import List, Dict, Any, AsyncIterator, Iterator, Tuple
 
+import pandas as pd
+
+from .ratelimit import TokenBucket
+from .streaming import DEFAULT_BATCH_SIZE, aiterate, batched, normalized_batches
 from .submission import RedditSubmission
 
 logger = logging.getLogger(__name__)
 
+# Reddit's info endpoint accepts up to 100 fullnames per request
+INFO_BATCH_SIZE = 100
+
+# Reddit allows 100 requests per minute for OAuth clients
+DEFAULT_SLEEP_INTERVAL = 0.6
+
 
 class PrawAPIWrapper:
 
@@ -29,17 +39,132 @@ class PrawAPIWrapper:
         )
         RedditSubmission.load_config(config_object)
 
-    def scrape(self, subreddit_name: str, limit: int = None, col_names: List[str] = None) -> List[Dict]:
+        # Spaces the requests of fetch_info (praw_sleep_interval seconds apart)
+        self.rate_limiter = TokenBucket.from_interval(
+            self.config.get('praw_sleep_interval', DEFAULT_SLEEP_INTERVAL),
+            capacity=self.config.get('praw_burst', 1)
+        )
+
+    @staticmethod
+    def read_fields(submission: praw.models.Submission, col_names: List[str]) -> Tuple[Dict[str, Any], List[str]]:
+        """Read attributes of a submission from the JSON it was created with, without fetching it.
+
+        PRAW objects fetch themselves from reddit when an attribute that is not in their JSON is accessed; this reads
+        the JSON (and properties computed from it, such as fullname) directly instead.
+
+        :param submission: A submission returned by a listing or the info endpoint.
+        :param col_names: Attributes of the submission to read.
+        :return: A dictionary of col_names (None if missing) and the list of missing attributes.
+        """
+        values = vars(submission)
+        d = {}
+        missing = []
+        for key in col_names:
+            if key in values:
+                d[key] = values[key]
+            elif isinstance(getattr(type(submission), key, None), property):
+                d[key] = getattr(submission, key)
+            else:
+                d[key] = None
+                missing.append(key)
+        return d, missing
+
+    def iter_json(self, subreddit_name: str, limit: int = None, col_names: List[str] = None,
+                  fetch_missing: bool = True) -> Iterator[Dict[str, Any]]:
+        """Yield the newest submissions of a subreddit as dictionaries of col_names, as the listing pages arrive.
+
+        Attributes are read from the listing. If some submissions of a page lack attributes, they are fetched for the
+        whole page in one request to the info endpoint (instead of one request per submission).
+
+        :param subreddit_name: Name of subreddit as a string (without r/ prefixed).
+        :param limit: Maximum number of submissions to fetch.
+        :param col_names: Attributes of the submissions to fetch (defaults to the configured default_fields).
+        :param fetch_missing: Fetch attributes missing from the listing; if False, they are None.
+        :return: An iterator of dictionaries.
+        """
         logger.info(f'PRAW: Attempting to fetch submissions from [{subreddit_name}] (limit={limit})...')
-        generator = self.reddit.subreddit(subreddit_name).new(limit=limit)
+        keys = col_names if col_names else self.config.get('default_fields')
+        count = 0
+        listing = self.reddit.subreddit(subreddit_name).new(limit=limit)
+        for page in batched(listing, INFO_BATCH_SIZE):
+            rows = []
+            missing_ids = []
+            missing_keys = set()
+            for submission in page:
+                d, missing = self.read_fields(submission, keys)
+                rows.append(d)
+                if missing:
+                    missing_ids.append(submission.id)
+                    missing_keys.update(missing)
+
+            if missing_ids and fetch_missing:
+                logger.debug(f'PRAW: Fetching {sorted(missing_keys)} of {len(missing_ids)} submissions...')
+                fetched = {d['r_id']: d for d in self.fetch_info_batch(missing_ids, sorted(missing_keys))}
+                for d, submission in zip(rows, page):
+                    for key, value in fetched.get(submission.id, {}).items():
+                        if key in missing_keys and d[key] is None:
+                            d[key] = value
+
+            count += len(rows)
+            yield from rows
+        logger.info(f'PRAW: Successfully fetched {count} submissions from [{subreddit_name}].')
+
+    def iter_submissions(self, subreddit_name: str, limit: int = None, col_names: List[str] = None
+                         ) -> Iterator[Dict[str, Any]]:
+        """Like scrape, but yields processed submissions as the listing pages arrive."""
+        for d in self.iter_json(subreddit_name, limit=limit, col_names=col_names):
+            yield dict(RedditSubmission(d))
+
+    def iter_pd(self, subreddit_name: str, limit: int = None, col_names: List[str] = None,
+                batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[pd.DataFrame]:
+        """Yield DataFrames of batch_size processed submissions as the listing pages arrive."""
+        return normalized_batches(self.iter_json(subreddit_name, limit=limit, col_names=col_names),
+                                  batch_size=batch_size)
+
+    def aiter_submissions(self, subreddit_name: str, limit: int = None, col_names: List[str] = None
+                          ) -> AsyncIterator[Dict[str, Any]]:
+        """Async version of iter_submissions; requests are made in worker threads."""
+        return aiterate(self.iter_submissions(subreddit_name, limit=limit, col_names=col_names))
+
+    def aiter_pd(self, subreddit_name: str, limit: int = None, col_names: List[str] = None,
+                 batch_size: int = DEFAULT_BATCH_SIZE) -> AsyncIterator[pd.DataFrame]:
+        """Async version of iter_pd; requests and processing are done in worker threads."""
+        return aiterate(self.iter_pd(subreddit_name, limit=limit, col_names=col_names, batch_size=batch_size))
+
+    def scrape(self, subreddit_name: str, limit: int = None, col_names: List[str] = None) -> List[Dict]:
+        return list(self.iter_submissions(subreddit_name, limit=limit, col_names=col_names))
+
+    def fetch_info_batch(self, r_ids: List[str], col_names: List[str]) -> List[Dict[str, Any]]:
+        """Fetch attributes of up to 100 submissions in a single request to the info endpoint.
+
+        Attributes are read from the JSON returned by the endpoint; a missing attribute is None (rather than making
+        PRAW fetch every submission again).
+
+        :param r_ids: Reddit ids of the submissions (without t3_ prefixed).
+        :param col_names: Attributes of the submissions to fetch.
+        :return: A list of dictionaries of r_id and col_names; submissions that were not found are left out.
+        """
+        self.rate_limiter.acquire()
         results = []
-        for submission in generator:
-            keys = col_names if col_names else self.config.get('default_fields')
-            d = {}
-            for key in keys:
-                value = getattr(submission, key, None)
-                d[key] = value
-            result = RedditSubmission(d)
-            results.append(dict(result))
-        logger.info(f'PRAW: Successfully fetched {len(results)} submissions from [{subreddit_name}].')
+        for submission in self.reddit.info(fullnames=[f't3_{r_id}' for r_id in r_ids]):
+            d, missing = self.read_fields(submission, col_names)
+            d['r_id'] = submission.id
+            results.append(d)
         return results
+
+    def fetch_info(self, r_ids: List[str], col_names: List[str]) -> Iterator[Dict[str, Any]]:
+        """Fetch attributes of many submissions, in batches of 100 made one at a time within the rate limit.
+
+        Requests are not made concurrently, since a praw.Reddit instance is not thread-safe.
+
+        :param r_ids: Reddit ids of the submissions (without t3_ prefixed).
+        :param col_names: Attributes of the submissions to fetch.
+        :return: An iterator of dictionaries of r_id and col_names, in the order of r_ids.
+        """
+        logger.info(f'PRAW: Attempting to fetch info of {len(r_ids)} submissions...')
+        count = 0
+        for batch in batched(r_ids, INFO_BATCH_SIZE):
+            results = self.fetch_info_batch(batch, col_names)
+            count += len(results)
+            yield from results
+        logger.info(f'PRAW: Successfully fetched info of {count} submissions.')
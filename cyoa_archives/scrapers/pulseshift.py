@@ -13,8 +13,13 @@ import logging
 import requests
 import time
 
-from typing import Optional, TypeVar, List, Dict, Any
+import pandas as pd
 
+from typing import Optional, TypeVar, List, Dict, Any, AsyncIterator, Iterator
+
+from .normalize import concat_submissions, normalize_submissions
+from .ratelimit import TokenBucket
+from .streaming import DEFAULT_BATCH_SIZE, aiterate, normalized_batches
 from .submission import RedditSubmission
 
 logger = logging.getLogger(__name__)
@@ -32,8 +37,14 @@ class PulseshiftAPIWrapper:
         self.config = config_object
         RedditSubmission.load_config(config_object)
 
-    def rest_get(self, subreddit_name: str, size: Optional[int] = None, before: Optional[int] = None,
-                 after: Optional[int] = None) -> List[RedditSubmission]:
+        # Requests are spaced by pulseshift_sleep_interval, shared by every thread using this instance
+        self.rate_limiter = TokenBucket.from_interval(
+            self.config.get('pulseshift_sleep_interval'),
+            capacity=self.config.get('pulseshift_burst', 1)
+        )
+
+    def rest_get_json(self, subreddit_name: str, size: Optional[int] = None, before: Optional[int] = None,
+                      after: Optional[int] = None) -> List[Dict[str, Any]]:
         """Get a single response from the Pulseshift API endpoint using the python requests library.
 
         The Pulseshift API currently limits requests to a maximum of 500 results.
@@ -42,7 +53,7 @@ class PulseshiftAPIWrapper:
         :param size: Maximum number of results to fetch. If None, allow default behavior.
         :param before: Fetch  results before unix timestamp.
         :param after: Fetch results after unix timestamp.
-        :return: A list of Reddit Submission objects.
+        :return: A list of JSON representations of reddit submissions.
         """
         logger.info(f'PULSESHIFT: Attempting to fetch submissions '
                     f'from [{subreddit_name}] (limit={size}) ({before}-{after})...')
@@ -59,45 +70,146 @@ class PulseshiftAPIWrapper:
             params['after'] = after
 
         # Make request
+        self.rate_limiter.acquire()
         r = requests.get(url=self.config.get('pulseshift_url'), params=params)
         data = r.json().get('data')
-        l: List[RedditSubmission] = []
-        for row in data:
-            rs = RedditSubmission(row, remove_low_score=True)
-            l.append(rs)
         logger.info(f'PULSESHIFT: Successfully fetched {len(data)} submissions from [{subreddit_name}].')
-        return l
+        return data
 
-    def scrape(self, subreddit_name: str, size: int = None, before: int = None, after: int = 0) -> List[Dict]:
+    def rest_get(self, subreddit_name: str, size: Optional[int] = None, before: Optional[int] = None,
+                 after: Optional[int] = None) -> List[RedditSubmission]:
+        """Get a single response from the Pulseshift API endpoint as Reddit Submission objects.
+
+        :param subreddit_name: Name of subreddit as a string (without r/ prefixed).
+        :param size: Maximum number of results to fetch. If None, allow default behavior.
+        :param before: Fetch  results before unix timestamp.
+        :param after: Fetch results after unix timestamp.
+        :return: A list of Reddit Submission objects.
+        """
+        data = self.rest_get_json(subreddit_name=subreddit_name, size=size, before=before, after=after)
+        return [RedditSubmission(row, remove_low_score=True) for row in data]
+
+    def next_page(self, subreddit_name: str, state: Dict[str, Any], size: Optional[int] = None,
+                  after: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Fetch the next page of submissions created at or before a cursor, newest first.
+
+        The before parameter of the API is exclusive and several submissions can share a second, so the page is
+        requested up to the end of the cursor's second and the submissions of that second that were already returned
+        are dropped (the page is enlarged by their number, so that they never fill it). The cursor only moves back once
+        a page reaches older submissions.
+
+        :param subreddit_name: Name of subreddit as a string (without r/ prefixed).
+        :param state: The paging state, updated in place: cursor (a unix timestamp, inclusive), seen (ids of the
+            submissions created at the cursor that were already returned) and done (no submissions are left).
+        :param size: Number of results per request. If None, use the configured pulseshift_limit.
+        :param after: Fetch results after unix timestamp.
+        :return: A list of JSON representations of the new submissions (empty once done).
+        """
+        page_size = size or self.config.get('pulseshift_limit')
+        cursor = state['cursor']
+        seen = set(state['seen'])
+        response = self.rest_get_json(subreddit_name=subreddit_name, size=page_size + len(seen) if page_size else None,
+                                      before=cursor + 1, after=after)
+        page = [row for row in response if row.get('id') not in seen]
+        if page:
+            oldest = min(row.get('created_utc') for row in page)
+            oldest_ids = [row.get('id') for row in page if row.get('created_utc') == oldest]
+            state['seen'] = state['seen'] + oldest_ids if oldest == cursor else oldest_ids
+            state['cursor'] = oldest
+        elif page_size and len(response) >= page_size:
+            # At least a page of submissions created at the cursor, all already returned (the API caps the page size)
+            logger.warning(f'PULSESHIFT: Could not fetch past {len(seen)} submissions at {cursor} from '
+                           f'[{subreddit_name}]; skipping a second.')
+            state['cursor'] = cursor - 1
+            state['seen'] = []
+        else:
+            state['done'] = True
+        return page
+
+    def iter_pages(self, subreddit_name: str, size: int = None, before: int = None, after: int = 0
+                   ) -> Iterator[List[Dict[str, Any]]]:
+        """Page backwards through the submissions of a subreddit between two timestamps, yielding each page.
+
+        :param subreddit_name: Name of subreddit as a string (without r/ prefixed).
+        :param size: Number of results per request. If None, use the configured pulseshift_limit.
+        :param before: Fetch results before unix timestamp (defaults to now).
+        :param after: Fetch results after unix timestamp.
+        :return: An iterator of lists of JSON representations of reddit submissions, newest first.
+        """
         # Initalize values for while loop
-        results = []
+        total = 0
         num_errors = 0
-        chunk_size = size if size else self.config.get('pulseshift_limit')
-        last_timestamp = int(time.time())
-        if before:
-            last_timestamp = before
+        state = {'cursor': (before or int(time.time())) - 1, 'seen': [], 'done': False}
 
         # Loop until no more results or time boundaries exceeded
-        while last_timestamp > after and num_errors < self.config.get('pulseshift_max_retry'):
-
-            # Sleep for time to hitting rate limits
-            time.sleep(self.config.get('pulseshift_sleep_interval'))
+        while not state['done'] and state['cursor'] > after and num_errors < self.config.get('pulseshift_max_retry'):
 
-            # Make request
+            # Make request (rest_get_json waits for the rate limiter)
             try:
-                response = self.rest_get(subreddit_name=subreddit_name, size=size, before=last_timestamp, after=after)
-                results = results + response
-                if len(response) > 0:
-                    last_timestamp = response[-1].json.get('created_utc')
-                elif len(response) < chunk_size:
-                    break
+                page = self.next_page(subreddit_name, state, size=size, after=after)
             except Exception as e:
-                logger.warning(f'PULSESHIFT: Failed to complete request at {last_timestamp} from [{subreddit_name}].')
+                logger.warning(f'PULSESHIFT: Failed to complete request at {state["cursor"]} from [{subreddit_name}].')
                 logger.warning(f'Exception: {e}')
                 num_errors = num_errors + 1
+                continue
+            if page:
+                total += len(page)
+                yield page
+
+        logger.info(f'PULSESHIFT: Fetched a total of {total} submissions from [{subreddit_name}].')
+
+    def iter_json(self, subreddit_name: str, size: int = None, before: int = None, after: int = 0
+                  ) -> Iterator[Dict[str, Any]]:
+        """Like iter_pages, but yields raw submissions one at a time."""
+        for page in self.iter_pages(subreddit_name=subreddit_name, size=size, before=before, after=after):
+            yield from page
+
+    def iter_submissions(self, subreddit_name: str, size: int = None, before: int = None, after: int = 0
+                         ) -> Iterator[Dict[str, Any]]:
+        """Like scrape, but yields processed submissions as the pages arrive (invalid submissions are skipped)."""
+        for row in self.iter_json(subreddit_name=subreddit_name, size=size, before=before, after=after):
+            try:
+                submission = RedditSubmission(row, remove_low_score=True)
+            except Exception as e:
+                logger.warning(f'PULSESHIFT: Skipped invalid submission ({row.get("id")}) from [{subreddit_name}].')
+                logger.warning(f'Exception: {e}')
+                continue
+            yield dict(submission)
+
+    def iter_pd(self, subreddit_name: str, size: int = None, before: int = None, after: int = 0,
+                batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[pd.DataFrame]:
+        """Like scrape_pd, but yields DataFrames of batch_size processed submissions as the pages arrive."""
+        rows = self.iter_json(subreddit_name=subreddit_name, size=size, before=before, after=after)
+        return normalized_batches(rows, batch_size=batch_size, remove_low_score=True, skip_invalid=True)
+
+    def aiter_submissions(self, subreddit_name: str, size: int = None, before: int = None, after: int = 0
+                          ) -> AsyncIterator[Dict[str, Any]]:
+        """Async version of iter_submissions; requests are made in worker threads."""
+        return aiterate(self.iter_submissions(subreddit_name=subreddit_name, size=size, before=before, after=after))
+
+    def aiter_pd(self, subreddit_name: str, size: int = None, before: int = None, after: int = 0,
+                 batch_size: int = DEFAULT_BATCH_SIZE) -> AsyncIterator[pd.DataFrame]:
+        """Async version of iter_pd; requests and processing are done in worker threads."""
+        return aiterate(self.iter_pd(subreddit_name=subreddit_name, size=size, before=before, after=after,
+                                     batch_size=batch_size))
+
+    def scrape_json(self, subreddit_name: str, size: int = None, before: int = None, after: int = 0
+                    ) -> List[Dict[str, Any]]:
+        """Page backwards through the submissions of a subreddit between two timestamps.
+
+        :param subreddit_name: Name of subreddit as a string (without r/ prefixed).
+        :param size: Number of results per request. If None, use the configured pulseshift_limit.
+        :param before: Fetch results before unix timestamp (defaults to now).
+        :param after: Fetch results after unix timestamp.
+        :return: A list of JSON representations of reddit submissions, newest first.
+        """
+        return list(self.iter_json(subreddit_name=subreddit_name, size=size, before=before, after=after))
+
+    def scrape(self, subreddit_name: str, size: int = None, before: int = None, after: int = 0) -> List[Dict]:
+        return list(self.iter_submissions(subreddit_name=subreddit_name, size=size, before=before, after=after))
 
-        logger.info(f'PULSESHIFT: Fetched a total of {len(results)} submissions from [{subreddit_name}].')
-        as_dict_list: List[Dict] = []
-        for result in results:
-            as_dict_list.append(dict(result))
-        return as_dict_list
+    def scrape_pd(self, subreddit_name: str, size: int = None, before: int = None, after: int = 0) -> pd.DataFrame:
+        """Like scrape, but processes each page at once and returns the submissions as a DataFrame."""
+        pages = self.iter_pages(subreddit_name=subreddit_name, size=size, before=before, after=after)
+        return concat_submissions([normalize_submissions(page, remove_low_score=True, skip_invalid=True)
+                                   for page in pages])
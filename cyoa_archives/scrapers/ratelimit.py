@@ -0,0 +1,58 @@
+"""Token bucket rate limiter
+
+Provides a thread-safe rate limiter that can be shared by several threads making requests to the same API.
+
+Tokens are added at a fixed rate up to a maximum (the burst size); every request takes one token and waits until a
+token is available. With a burst size of 1, requests are spaced exactly 1/rate seconds apart.
+
+Typical usage example:
+
+  limiter = TokenBucket(rate=2, capacity=1)
+  limiter.acquire()
+  requests.get(...)
+
+"""
+
+import threading
+import time
+
+
+class TokenBucket:
+    """A thread-safe token bucket."""
+
+    def __init__(self, rate: float, capacity: float = 1):
+        """Initializes a full TokenBucket.
+
+        :param rate: Tokens added per second (i.e. the sustained number of requests per second); 0 disables limiting.
+        :param capacity: Maximum number of tokens (i.e. the number of requests that may be made in a burst).
+        """
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self.tokens = self.capacity
+        self.timestamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_interval(cls, interval: float, capacity: float = 1) -> 'TokenBucket':
+        """Create a bucket that allows one request every interval seconds."""
+        return cls(rate=1 / interval if interval else 0, capacity=capacity)
+
+    def acquire(self, tokens: float = 1) -> float:
+        """Take tokens from the bucket, waiting until enough are available.
+
+        :param tokens: Number of tokens to take.
+        :return: The number of seconds waited.
+        """
+        if not self.rate:
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.timestamp) * self.rate)
+            self.timestamp = now
+
+            # Reserve the tokens now, so that concurrent callers queue up behind this one
+            self.tokens -= tokens
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
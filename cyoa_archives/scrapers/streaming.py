@@ -0,0 +1,65 @@
+"""Streaming helpers for the reddit API wrappers
+
+Provides functions to consume submissions as they arrive: grouping a stream of raw submissions into fixed-size,
+normalized DataFrames, and turning any (blocking) iterator into an async iterator.
+
+Typical usage example:
+
+  for df in normalized_batches(api.iter_json('makeyourchoice'), batch_size=100):
+      ...
+
+  async for df in aiterate(api.iter_pd('makeyourchoice')):
+      ...
+
+"""
+
+import asyncio
+import itertools
+
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, TypeVar
+
+import pandas as pd
+
+from .normalize import normalize_submissions
+
+T = TypeVar('T')
+DEFAULT_BATCH_SIZE = 100
+
+
+def batched(iterable: Iterable[T], batch_size: int) -> Iterator[List[T]]:
+    """Group an iterable into lists of batch_size items (the last list may be shorter)."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def normalized_batches(rows: Iterable[Dict[str, Any]], batch_size: int = DEFAULT_BATCH_SIZE,
+                       remove_low_score: bool = False, skip_invalid: bool = False) -> Iterator[pd.DataFrame]:
+    """Process a stream of raw reddit submissions into DataFrames of batch_size rows (see normalize_submissions).
+
+    :param rows: An iterable of JSON representations of reddit submissions.
+    :param batch_size: Number of submissions per DataFrame.
+    :param remove_low_score: Classify submissions with few comments and a low score as not CYOAs.
+    :param skip_invalid: If a submission cannot be processed, log and drop it instead of raising an error.
+    :return: An iterator of DataFrames.
+    """
+    for batch in batched(rows, batch_size):
+        yield normalize_submissions(batch, remove_low_score=remove_low_score, skip_invalid=skip_invalid)
+
+
+async def aiterate(iterator: Iterator[T]) -> AsyncIterator[T]:
+    """Iterate over a blocking iterator without blocking the event loop; each item is fetched in a worker thread.
+
+    :param iterator: An iterator (e.g. a generator making HTTP requests).
+    :return: An async iterator of the same items.
+    """
+    iterator = iter(iterator)
+    done = object()
+    while True:
+        item = await asyncio.to_thread(next, iterator, done)
+        if item is done:
+            return
+        yield item
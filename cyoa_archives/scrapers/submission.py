@@ -11,17 +11,25 @@ Typical usage example:
 
 import json
 import logging
-import re
 import time
 
 from typing import Optional, List, Dict, Any
 
 import redditcleaner
 
+from .matcher import SubstringMatcher
+from .urls import extract_urls
+
 logger = logging.getLogger(__name__)
 YES = "Yes"
 NO = "No"
 NULL = ""
+IMAGE_EXTENSIONS = SubstringMatcher(['.jpg', '.jpeg', '.png'])
+REQUIRED_FIELDS = [
+    'id', 'created_utc', 'author', 'subreddit', 'permalink', 'url', 'title', 'is_self', 'num_comments', 'score',
+    'selftext'
+]
+OPTIONAL_FIELDS = ['link_flair_text', 'removed_by_category', 'locked']
 
 
 class RedditSubmission:
@@ -34,6 +42,9 @@ class RedditSubmission:
     # Class variable storing configuration
     CONFIG = None
 
+    # Substring lists of the configuration, compiled by load_config
+    MATCHERS = None
+
     def __init__(self, json_data: Dict[str, Any], remove_low_score: bool = False):
         """Initializes an instance of RedditSubmission.
 
@@ -45,38 +56,18 @@ class RedditSubmission:
         # Assert that config file is set
         if not self.CONFIG:
             raise ValueError(f'Configuration file for RedditSubmission class was not set.')
+        if self.MATCHERS is None:
+            self.load_config(self.CONFIG)
 
         # Assert that JSON contains essential required values
-        if 'id' not in self.json:
-            raise ValueError(f'Reddit submission lacks (id) attribute.')
-        if 'created_utc' not in self.json:
-            raise ValueError(f'Reddit submission lacks (created_utc) attribute.')
-        if 'author' not in self.json:
-            raise ValueError(f'Reddit submission lacks (author) attribute.')
-        if 'subreddit' not in self.json:
-            raise ValueError(f'Reddit submission lacks (subreddit) attribute.')
-        if 'permalink' not in self.json:
-            raise ValueError(f'Reddit submission lacks (permalink) attribute.')
-        if 'url' not in self.json:
-            raise ValueError(f'Reddit submission lacks (url) attribute.')
-        if 'title' not in self.json:
-            raise ValueError(f'Reddit submission lacks (title) attribute.')
-        if 'is_self' not in self.json:
-            raise ValueError(f'Reddit submission lacks (is_self) attribute.')
-        if 'num_comments' not in self.json:
-            raise ValueError(f'Reddit submission lacks (num_comments) attribute.')
-        if 'score' not in self.json:
-            raise ValueError(f'Reddit submission lacks (score) attribute.')
+        for key in REQUIRED_FIELDS:
+            if key not in self.json:
+                raise ValueError(f'Reddit submission lacks ({key}) attribute.')
 
         # Assert that JSON contains essential optional values
-        if 'selftext' not in self.json:
-            raise ValueError(f'Reddit submission lacks (selftext) attribute.')
-        if 'link_flair_text' not in self.json:
-            self.json['link_flair_text'] = None
-        if 'removed_by_category' not in self.json:
-            self.json['removed_by_category'] = None
-        if 'locked' not in self.json:
-            self.json['locked'] = None
+        for key in OPTIONAL_FIELDS:
+            if key not in self.json:
+                self.json[key] = None
 
         # Perform any processing
         self.json['urls'] = self.extract_urls()
@@ -106,6 +97,15 @@ class RedditSubmission:
     @classmethod
     def load_config(cls, config_object: Dict[str, Any]) -> None:
         cls.CONFIG = config_object
+        good_urls = config_object.get('good_urls') or {}
+        cls.MATCHERS = {
+            'bad_urls': SubstringMatcher(config_object.get('bad_urls')),
+            'good_urls': {cyoa_type: SubstringMatcher(substrings) for cyoa_type, substrings in good_urls.items()},
+            'bad_selftext': SubstringMatcher(config_object.get('bad_selftext')),
+            'bad_title': SubstringMatcher(config_object.get('bad_title')),
+            'bad_flair': SubstringMatcher(config_object.get('bad_flair')),
+            'good_flair': SubstringMatcher(config_object.get('good_flair'))
+        }
 
     def clean_text(self, attribute: str) -> str:
         if attribute not in self.json:
@@ -121,11 +121,9 @@ class RedditSubmission:
         url = self.json.get('url') if self.json.get('url') else ""
         text = self.json.get('selftext') + ' ' + url
 
-        # Next, extract urls using regex
+        # Next, extract urls
         text = text.replace('\\', '')
-        pattern = re.compile(
-            r"""(?i)\b((?:https?:(?:/{1,3}|[a-z0-9%])|[a-z0-9.\-]+[.](?:com|net|org|edu|gov|mil|aero|asia|biz|cat|coop|info|int|jobs|mobi|museum|name|post|pro|tel|travel|xxx|ac|ad|ae|af|ag|ai|al|am|an|ao|aq|ar|as|at|au|aw|ax|az|ba|bb|bd|be|bf|bg|bh|bi|bj|bm|bn|bo|br|bs|bt|bv|bw|by|bz|ca|cc|cd|cf|cg|ch|ci|ck|cl|cm|cn|co|cr|cs|cu|cv|cx|cy|cz|dd|de|dj|dk|dm|do|dz|ec|ee|eg|eh|er|es|et|eu|fi|fj|fk|fm|fo|fr|ga|gb|gd|ge|gf|gg|gh|gi|gl|gm|gn|gp|gq|gr|gs|gt|gu|gw|gy|hk|hm|hn|hr|ht|hu|id|ie|il|im|in|io|iq|ir|is|it|je|jm|jo|jp|ke|kg|kh|ki|km|kn|kp|kr|kw|ky|kz|la|lb|lc|li|lk|lr|ls|lt|lu|lv|ly|ma|mc|md|me|mg|mh|mk|ml|mm|mn|mo|mp|mq|mr|ms|mt|mu|mv|mw|mx|my|mz|na|nc|ne|nf|ng|ni|nl|no|np|nr|nu|nz|om|pa|pe|pf|pg|ph|pk|pl|pm|pn|pr|ps|pt|pw|py|qa|re|ro|rs|ru|rw|sa|sb|sc|sd|se|sg|sh|si|sj|Ja|sk|sl|sm|sn|so|sr|ss|st|su|sv|sx|sy|sz|tc|td|tf|tg|th|tj|tk|tl|tm|tn|to|tp|tr|tt|tv|tw|tz|ua|ug|uk|us|uy|uz|va|vc|ve|vg|vi|vn|vu|wf|ws|ye|yt|yu|za|zm|zw)/)(?:[^\s()<>{}\[\]]+|\([^\s()]*?\([^\s()]+\)[^\s()]*?\)|\([^\s]+?\))+(?:\([^\s()]*?\([^\s()]+\)[^\s()]*?\)|\([^\s]+?\)|[^\s`!()\[\]{};:'".,<>?«»“”‘’])|(?:(?<!@)[a-z0-9]+(?:[.\-][a-z0-9]+)*[.](?:com|net|org|edu|gov|mil|aero|asia|biz|cat|coop|info|int|jobs|mobi|museum|name|post|pro|tel|travel|xxx|ac|ad|ae|af|ag|ai|al|am|an|ao|aq|ar|as|at|au|aw|ax|az|ba|bb|bd|be|bf|bg|bh|bi|bj|bm|bn|bo|br|bs|bt|bv|bw|by|bz|ca|cc|cd|cf|cg|ch|ci|ck|cl|cm|cn|co|cr|cs|cu|cv|cx|cy|cz|dd|de|dj|dk|dm|do|dz|ec|ee|eg|eh|er|es|et|eu|fi|fj|fk|fm|fo|fr|ga|gb|gd|ge|gf|gg|gh|gi|gl|gm|gn|gp|gq|gr|gs|gt|gu|gw|gy|hk|hm|hn|hr|ht|hu|id|ie|il|im|in|io|iq|ir|is|it|je|jm|jo|jp|ke|kg|kh|ki|km|kn|kp|kr|kw|ky|kz|la|lb|lc|li|lk|lr|ls|lt|lu|lv|ly|ma|mc|md|me|mg|mh|mk|ml|mm|mn|mo|mp|mq|mr|ms|mt|mu|mv|mw|mx|my|mz|na|nc|ne|nf|ng|ni|nl|no|np|nr|nu|nz|om|pa|pe|pf|pg|ph|pk|pl|pm|pn|pr|ps|pt|pw|py|qa|re|ro|rs|ru|rw|sa|sb|sc|sd|se|sg|sh|si|sj|Ja|sk|sl|sm|sn|so|sr|ss|st|su|sv|sx|sy|sz|tc|td|tf|tg|th|tj|tk|tl|tm|tn|to|tp|tr|tt|tv|tw|tz|ua|ug|uk|us|uy|uz|va|vc|ve|vg|vi|vn|vu|wf|ws|ye|yt|yu|za|zm|zw)\b/?(?!@)))""")
-        urls = re.findall(pattern, str(text))
+        urls = extract_urls(text)
 
         # Next append the url field and remove duplicate urls
         seen_urls = {}
@@ -138,43 +136,32 @@ class RedditSubmission:
         return final_url_list
 
     def parse_urls(self) -> List[str]:
-        # First, define all bad url substrings
-        bad_url_substrings = [self.json.get('permalink')]
-        if self.CONFIG:
-            bad_url_substrings = bad_url_substrings + self.CONFIG.get('bad_urls')
-
-        # Next, remove urls that contain bad substrings
+        # Remove urls that link back to this post or contain bad substrings
+        permalink = self.json.get('permalink')
+        bad_urls = self.MATCHERS.get('bad_urls') if self.CONFIG else None
         good_urls = []
         if self.json.get('urls'):
             for url in self.json.get('urls'):
-                is_good = True
-                for substring in bad_url_substrings:
-                    if substring in url:
-                        is_good = False
-                        break
-                if is_good:
-                    good_urls.append(url)
+                if permalink in url:
+                    continue
+                if bad_urls and bad_urls.search(url) is not None:
+                    continue
+                good_urls.append(url)
 
         return good_urls
 
     def get_first_url(self, cyoa_type) -> Optional[str]:
         if self.CONFIG:
             urls = self.json.get('urls')
-            url_substrings = self.CONFIG.get('good_urls').get(cyoa_type)
+            url_matcher = self.MATCHERS.get('good_urls').get(cyoa_type)
             image_urls = []
             gallery_urls = []
             for url in urls:
-                for substring in url_substrings:
-                    if substring in url:
-                        is_gallery = True
-                        for extension in ['.jpg', '.jpeg', '.png']:
-                            if extension in url:
-                                is_gallery = False
-                                image_urls.append(url)
-                                break
-                        if is_gallery:
-                            gallery_urls.append(url)
-                        break
+                if url_matcher.search(url) is not None:
+                    if IMAGE_EXTENSIONS.search(url) is not None:
+                        image_urls.append(url)
+                    else:
+                        gallery_urls.append(url)
             if len(gallery_urls) > 0:
                 return gallery_urls[0]
             elif len(image_urls) == 1:
@@ -188,16 +175,12 @@ class RedditSubmission:
 
         if self.CONFIG:
             # Check if selftext contains bad substrings
-            bad_selftext_substrings = self.CONFIG.get('bad_selftext')
-            for substring in bad_selftext_substrings:
-                if substring in self.json.get('selftext'):
-                    return NO
+            if self.MATCHERS.get('bad_selftext').search(self.json.get('selftext')) is not None:
+                return NO
 
             # Check if title is bad
-            bad_title_substrings = self.CONFIG.get('bad_title')
-            for substring in bad_title_substrings:
-                if substring in self.json.get('title'):
-                    return NO
+            if self.MATCHERS.get('bad_title').search(self.json.get('title')) is not None:
+                return NO
 
             # Exclude text only posts
             if self.CONFIG.get('remove_text_only'):
@@ -217,16 +200,12 @@ class RedditSubmission:
             post_flair = self.json.get('link_flair_text')
             if post_flair:
                 # Check if flair is bad
-                bad_flair_substrings = self.CONFIG.get('bad_flair')
-                for substring in bad_flair_substrings:
-                    if substring in self.json.get('link_flair_text'):
-                        return NO
+                if self.MATCHERS.get('bad_flair').search(post_flair) is not None:
+                    return NO
 
                 # Check if flair is good
-                good_flair_substrings = self.CONFIG.get('good_flair')
-                for substring in good_flair_substrings:
-                    if substring in self.json.get('link_flair_text'):
-                        return YES
+                if self.MATCHERS.get('good_flair').search(post_flair) is not None:
+                    return YES
 
         return NULL
 
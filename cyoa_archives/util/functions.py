@@ -1,6 +1,148 @@
+import collections
+
+import numpy
+
+
 def calc_intersect(xmin_a, xmax_a, ymin_a, ymax_a, xmin_b, xmax_b, ymin_b, ymax_b):
     dx = min(xmax_a, xmax_b) - max(xmin_a, xmin_b)
     dy = min(ymax_a, ymax_b) - max(ymin_a, ymin_b)
     if (dx > 0) and (dy > 0):
         return dx * dy
     return 0
+
+
+class DisjointSet:
+    """A union-find structure over the integers 0..n-1, with path halving and union by size."""
+
+    def __init__(self, n: int):
+        self.parent = list(range(n))
+        self.size = [1] * n
+
+    def find(self, i: int) -> int:
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(self, i: int, j: int) -> bool:
+        """Merge the sets of i and j; returns False if they were already in the same set."""
+        root_i = self.find(i)
+        root_j = self.find(j)
+        if root_i == root_j:
+            return False
+        if self.size[root_i] < self.size[root_j]:
+            root_i, root_j = root_j, root_i
+        self.parent[root_j] = root_i
+        self.size[root_i] += self.size[root_j]
+        return True
+
+    def labels(self) -> numpy.ndarray:
+        """Get a component label (0..n_components-1) for every element."""
+        roots = numpy.array([self.find(i) for i in range(len(self.parent))], dtype=numpy.int64)
+        return numpy.unique(roots, return_inverse=True)[1].reshape(-1) if len(roots) else roots
+
+
+def overlapping_pairs(boxes: numpy.ndarray, cell_size: float = None) -> numpy.ndarray:
+    """Find all pairs of boxes whose interiors intersect, using a uniform grid so only nearby boxes are compared.
+
+    Every box is binned into the grid cells it covers; only boxes that share a cell are tested for overlap.
+
+    :param boxes: An (n x 4) array of (xmin, ymin, xmax, ymax) coordinates.
+    :param cell_size: Size of the grid cells (defaults to twice the median box side).
+    :return: A (pairs x 2) array of box indices i < j. A pair may appear more than once.
+    """
+    boxes = numpy.asarray(boxes, dtype=numpy.float64).reshape(-1, 4)
+    n = len(boxes)
+    if n < 2:
+        return numpy.zeros((0, 2), dtype=numpy.int64)
+    if not cell_size:
+        sides = numpy.maximum(boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1])
+        cell_size = max(2 * float(numpy.median(sides)), 1)
+
+    # Bin every box into the cells it covers
+    cx0 = numpy.floor(boxes[:, 0] / cell_size).astype(numpy.int64)
+    cy0 = numpy.floor(boxes[:, 1] / cell_size).astype(numpy.int64)
+    nx = numpy.floor(boxes[:, 2] / cell_size).astype(numpy.int64) - cx0 + 1
+    ny = numpy.floor(boxes[:, 3] / cell_size).astype(numpy.int64) - cy0 + 1
+    n_cells = nx * ny
+    box_ids = numpy.repeat(numpy.arange(n), n_cells)
+    offsets = numpy.arange(n_cells.sum()) - numpy.repeat(numpy.cumsum(n_cells) - n_cells, n_cells)
+    cell_x = cx0[box_ids] + offsets % nx[box_ids]
+    cell_y = cy0[box_ids] + offsets // nx[box_ids]
+    width = int(cell_x.max() - cell_x.min() + 1)
+    cell_ids = (cell_y - cell_y.min()) * width + (cell_x - cell_x.min())
+
+    # Generate every pair of entries within the same cell
+    order = numpy.lexsort((box_ids, cell_ids))
+    cell_ids = cell_ids[order]
+    box_ids = box_ids[order]
+    starts = numpy.flatnonzero(numpy.r_[True, cell_ids[1:] != cell_ids[:-1]])
+    ends = numpy.r_[starts[1:], len(cell_ids)]
+    group_end = numpy.repeat(ends, ends - starts)
+    partners = group_end - numpy.arange(len(cell_ids)) - 1
+    left = numpy.repeat(numpy.arange(len(cell_ids)), partners)
+    right = left + 1 + numpy.arange(partners.sum()) - numpy.repeat(numpy.cumsum(partners) - partners, partners)
+    a = box_ids[left]
+    b = box_ids[right]
+
+    # Vectorized overlap test of the candidate pairs
+    dx = numpy.minimum(boxes[a, 2], boxes[b, 2]) - numpy.maximum(boxes[a, 0], boxes[b, 0])
+    dy = numpy.minimum(boxes[a, 3], boxes[b, 3]) - numpy.maximum(boxes[a, 1], boxes[b, 1])
+    overlap = (dx > 0) & (dy > 0)
+    return numpy.stack([a[overlap], b[overlap]], axis=1)
+
+
+def suppress_overlaps(boxes: numpy.ndarray, areas: numpy.ndarray, threshold: float) -> numpy.ndarray:
+    """Non-maximum suppression that keeps the largest of overlapping boxes, resolving overlaps in queue order.
+
+    The boxes form a queue. The first box is compared against every other box in the queue: the boxes whose
+    intersection with it, relative to the area of the first box, is above the threshold are merged with it. The largest
+    of them (the earliest in the queue on ties, and the first box if none is larger) goes to the end of the queue and
+    the others are suppressed. If no box overlaps the first box, it is kept.
+
+    This replays the queue of the previous KerasOCR implementation step by step, so that the same boxes are kept: the
+    boxes are not visited from largest to smallest, and a box that survives a merge is compared again. There is one
+    python iteration per queue step and only the overlap test of each step is one numpy operation, so the cost is
+    still quadratic in the number of boxes; the gain is the constant (no BoundingBox objects or list copies per step).
+
+    :param boxes: An (n x 4) array of (xmin, ymin, xmax, ymax) coordinates, in queue order.
+    :param areas: The area of each box.
+    :param threshold: Minimum fraction of the first box that must be covered by another box to merge them.
+    :return: The indices of the kept boxes, in increasing order.
+    """
+    boxes = numpy.asarray(boxes, dtype=numpy.float64).reshape(-1, 4)
+    areas = numpy.asarray(areas, dtype=numpy.float64)
+    n = len(boxes)
+
+    # Positions in the queue break ties; a box put back at the end gets a new position and its old entry is skipped
+    position = numpy.arange(n)
+    in_queue = numpy.ones(n, dtype=bool)
+    queue = collections.deque(enumerate(range(n)))
+    next_position = n
+    keep = []
+    while queue:
+        entry_position, i = queue.popleft()
+        if not in_queue[i] or position[i] != entry_position:
+            continue
+        in_queue[i] = False
+        rest = numpy.flatnonzero(in_queue)
+        dx = numpy.minimum(boxes[i, 2], boxes[rest, 2]) - numpy.maximum(boxes[i, 0], boxes[rest, 0])
+        dy = numpy.minimum(boxes[i, 3], boxes[rest, 3]) - numpy.maximum(boxes[i, 1], boxes[rest, 1])
+        intersection = numpy.where((dx > 0) & (dy > 0), dx * dy, 0)
+        overlap = rest[intersection / areas[i] > threshold]
+        if len(overlap) == 0:
+            keep.append(i)
+            continue
+
+        in_queue[overlap] = False
+        largest = i
+        larger = overlap[areas[overlap] > areas[i]]
+        if len(larger):
+            candidates = larger[areas[larger] == areas[larger].max()]
+            largest = candidates[numpy.argmin(position[candidates])]
+        in_queue[largest] = True
+        position[largest] = next_position
+        queue.append((next_position, largest))
+        next_position += 1
+    return numpy.sort(numpy.array(keep, dtype=numpy.int64))
@@ -18,7 +18,7 @@ import sys
 import time
 
 from collections import OrderedDict
-from typing import Dict
+from typing import Dict, Optional
 
 import numpy as np
 import yaml
@@ -26,8 +26,11 @@ import yaml
 from cyoa_archives.grist.api import GristAPIWrapper
 from cyoa_archives.grist.routine import grist_update_item
 from cyoa_archives.scrapers.download import CyoaDownload
-from cyoa_archives.predictor.image import CyoaImage
+from cyoa_archives.predictor.cache import PageCache, PageRegistry, DEFAULT_MAX_SIZE
+from cyoa_archives.predictor.image import CyoaImage, dd_to_arrays, dd_from_arrays
 from cyoa_archives.predictor.deepdanbooru import DeepDanbooru
+from cyoa_archives.predictor.embedding import EmbeddingStore
+from cyoa_archives.predictor.results import ResultsStore
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -35,11 +38,18 @@ logger = logging.getLogger(__name__)
 # Keybert gives warnings unless parallelism is disabled
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
-def main(config: Dict, temporary_folder: pathlib.Path, database_folder: pathlib.Path) -> None:
+def main(
+        config: Dict,
+        temporary_folder: pathlib.Path,
+        database_folder: pathlib.Path,
+        cache_folder: Optional[pathlib.Path] = None
+) -> None:
     """Main method for script.
 
     :param config: A configuration object.
     :param temporary_folder: Path to the temporary folder to use (warning: will be frequently deleted and replaced).
+    :param database_folder: Path to the folder to write deepdanbooru results to.
+    :param cache_folder: Path to a folder to cache page analysis results in (optional).
     """
     # TODO: Assert that configuration file is appropriately formatted
 
@@ -54,14 +64,40 @@ def main(config: Dict, temporary_folder: pathlib.Path, database_folder: pathlib.
     DD_TAGS = predictor_config.get('dd_tags')
     DD_THRESHOLD = predictor_config.get('dd_threshold')
     DD_COVERAGE = predictor_config.get('coverage')
+    DD_BATCH_SIZE = predictor_config.get('dd_batch_size', 1)
+    DD_THREADS = predictor_config.get('dd_threads', 0)
+    DD_BACKEND = predictor_config.get('dd_backend', 'keras')
+    DD_QUANTIZATION = predictor_config.get('dd_quantization', 'dynamic')
+    DD_EMBEDDINGS = predictor_config.get('dd_embeddings', False)
+    DD_SAMPLING = predictor_config.get('dd_sampling', 'random')
+    DD_EMBEDDING_LAYER = predictor_config.get('dd_embedding_layer')
     MAX_TALL_WIDTH = predictor_config.get('max_width')
     MAX_WIDE_WIDTH = predictor_config.get('max_wide_width')
     DD_MIN_PIXELS = 4194304
+    CACHE_MAX_SIZE = predictor_config.get('cache_max_size', DEFAULT_MAX_SIZE)
+    DD_PARAMS = {
+        'analysis': 'dd',
+        'model_path': MODEL_PATH,
+        'backend': DD_BACKEND if DD_BACKEND == 'keras' else f'{DD_BACKEND}-{DD_QUANTIZATION}',
+        'dd_tags': DD_TAGS,
+        'threshold': DD_THRESHOLD,
+        'coverage': DD_COVERAGE
+    }
+    if DD_SAMPLING != 'random':
+        DD_PARAMS['sampling'] = DD_SAMPLING
+    if DD_EMBEDDINGS:
+        DD_PARAMS['embedding_layer'] = DD_EMBEDDING_LAYER or 'default'
 
     # Initialize deepdanbooru
     predictor_config = config.get('predictor')
-    dd = DeepDanbooru(MODEL_PATH, special_tags=DD_TAGS, threshold=DD_THRESHOLD)
+    dd = DeepDanbooru(MODEL_PATH, special_tags=DD_TAGS, threshold=DD_THRESHOLD, batch_size=DD_BATCH_SIZE,
+                      intra_op_threads=DD_THREADS, backend=DD_BACKEND, quantization=DD_QUANTIZATION,
+                      embeddings=DD_EMBEDDINGS, embedding_layer=DD_EMBEDDING_LAYER)
+    results_store = ResultsStore(pathlib.Path(database_folder, 'dd_results'))
+    embedding_store = EmbeddingStore(pathlib.Path(database_folder, 'embeddings')) if DD_EMBEDDINGS else None
     downloader = CyoaDownload(tempdir=temporary_folder)
+    page_cache = PageCache(cache_folder, max_size=CACHE_MAX_SIZE) if cache_folder else None
+    page_registry = PageRegistry(pathlib.Path(cache_folder, 'pages.jsonl'), page_cache) if cache_folder else None
 
     # Fetch CYOAs from Grist
     api = GristAPIWrapper(server_url=SERVER_URL, document_id=DOCUMENT_ID, api_key=API_KEY)
@@ -100,13 +136,33 @@ def main(config: Dict, temporary_folder: pathlib.Path, database_folder: pathlib.
 
         # Run the main processor loop
         all_data = OrderedDict()
+        all_embeddings = []
         total_pixels = 0
         page_count = 0
         for i, image_path in enumerate(image_paths):
             logger.info(f'Processing image {i + 1}/{len(image_paths)} in {official_title}...')
             cyoa_image = CyoaImage(image_path)
             #cyoa_image.make_chunks()
-            this_dd_data = cyoa_image.run_deepdanbooru_random(dd, coverage=DD_COVERAGE)
+
+            # Reuse the sampled scores if this page has been analysed before
+            # Pages already seen in other CYOAs (e.g. reposts and updates) are resolved to the same key
+            page_hash = page_registry.resolve(image_path) if page_cache else None
+            cache_key = page_cache.make_key(page_hash, DD_PARAMS) if page_cache else None
+            cached = page_cache.load(cache_key) if page_cache else None
+            if cached is not None:
+                this_dd_data = dd_from_arrays(cached)
+                cyoa_image.dd_embeddings = cached.get('dd_embeddings')
+            else:
+                if DD_SAMPLING == 'regions':
+                    # Only sample windows inside image regions (text and backgrounds are skipped)
+                    this_dd_data = cyoa_image.run_deepdanbooru_regions(dd, coverage=DD_COVERAGE)
+                else:
+                    this_dd_data = cyoa_image.run_deepdanbooru_random(dd, coverage=DD_COVERAGE)
+                if page_cache:
+                    page_cache.save(cache_key, dd_to_arrays(this_dd_data, cyoa_image.dd_embeddings))
+                    page_registry.register(page_hash)
+            if cyoa_image.dd_embeddings is not None and len(cyoa_image.dd_embeddings):
+                all_embeddings.append(cyoa_image.dd_embeddings)
             page_count = page_count + 1
             total_pixels = total_pixels + cyoa_image.normalized_area(
                 max_tall_image=MAX_TALL_WIDTH,
@@ -155,22 +211,18 @@ def main(config: Dict, temporary_folder: pathlib.Path, database_folder: pathlib.
         }
         grist_update_item(config, 'CYOAs', result)
 
-        # Write results to db folder
-        outdir = pathlib.Path.joinpath(database_folder, uuid)
-        if not outdir.exists():
-            os.makedirs(outdir)
+        # The embedding of a CYOA is the mean embedding of all sampled windows
+        if embedding_store and all_embeddings:
+            embedding_store.append(uuid, np.concatenate(all_embeddings).mean(axis=0))
 
-        data_file = pathlib.Path.joinpath(outdir, 'dd.txt')
-        info_file = pathlib.Path.joinpath(outdir, 'info.txt')
-        with open(data_file, 'w') as f:
-            for tag in all_data:
-                f.write(f'{tag}\t{np.average(all_data[tag])}\n')
-        with open(info_file, 'w') as f:
-            f.write(f'Pages: {page_count}\n')
-            f.write(f'Pixels: {total_pixels}\n')
-            f.write(f'Coverage: {predictor_config.get("coverage")}\n')
-            f.write(f'Threshold: {predictor_config.get("coverage")}\n')
-            f.write(f'Timestamp: {timestamp}\n')
+        # Append results to the results store in the db folder
+        results_store.append(uuid, {tag: np.average(all_data[tag]) for tag in all_data}, {
+            'pages': page_count,
+            'pixels': total_pixels,
+            'coverage': DD_COVERAGE,
+            'threshold': DD_THRESHOLD,
+            'timestamp': timestamp
+        })
 
 
 if __name__ == "__main__":
@@ -180,6 +232,7 @@ if __name__ == "__main__":
     parser.add_argument("-c", "--config_file", help="Configuration file to use")
     parser.add_argument("-t", "--temporary_folder", help="Folder to use to temporarily keep files")
     parser.add_argument("-d", "--database_folder", help="Folder to use to store deepdanbooru results")
+    parser.add_argument("-k", "--cache_folder", help="Folder to use to cache page analysis results (optional)")
 
     # Parse arguments
     args = parser.parse_args()
@@ -198,5 +251,6 @@ if __name__ == "__main__":
     main(
         config,
         pathlib.Path(args.temporary_folder),
-        pathlib.Path(args.database_folder)
+        pathlib.Path(args.database_folder),
+        pathlib.Path(args.cache_folder) if args.cache_folder else None
     )
@@ -19,7 +19,7 @@ import pathlib
 import sys
 import time
 
-from typing import Dict
+from typing import Dict, Optional
 
 from keybert import KeyBERT
 import yaml
@@ -27,7 +27,8 @@ import yaml
 from cyoa_archives.grist.api import GristAPIWrapper
 from cyoa_archives.grist.routine import grist_update_item
 from cyoa_archives.scrapers.download import CyoaDownload
-from cyoa_archives.predictor.image import CyoaImage
+from cyoa_archives.predictor.cache import PageCache, PageRegistry, DEFAULT_MAX_SIZE
+from cyoa_archives.predictor.image import CyoaImage, TEXT_THRESHOLD
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -35,11 +36,12 @@ logger = logging.getLogger(__name__)
 # Keybert gives warnings unless parallelism is disabled
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
-def main(config: Dict, temporary_folder: pathlib.Path) -> None:
+def main(config: Dict, temporary_folder: pathlib.Path, cache_folder: Optional[pathlib.Path] = None) -> None:
     """Main method for script.
 
     :param config: A configuration object.
     :param temporary_folder: Path to the temporary folder to use (warning: will be frequently deleted and replaced).
+    :param cache_folder: Path to a folder to cache page analysis results in (optional).
     """
     # TODO: Assert that configuration file is appropriately formatted
 
@@ -55,10 +57,14 @@ def main(config: Dict, temporary_folder: pathlib.Path) -> None:
     MAX_WIDE_WIDTH = predictor_config.get('max_wide_width')
     KEYBERT_MIN_CHARS = predictor_config.get('keybert_min_chars')
     KEYBERT_THRESHOLD = predictor_config.get('keybert_threshold')
+    CACHE_MAX_SIZE = predictor_config.get('cache_max_size', DEFAULT_MAX_SIZE)
+    OCR_PARAMS = {'analysis': 'ocr', 'text_threshold': TEXT_THRESHOLD}
 
     # Initialize keybert
     kw_model = KeyBERT(KEYBERT_MODEL)
     downloader = CyoaDownload(tempdir=temporary_folder)
+    page_cache = PageCache(cache_folder, max_size=CACHE_MAX_SIZE) if cache_folder else None
+    page_registry = PageRegistry(pathlib.Path(cache_folder, 'pages.jsonl'), page_cache) if cache_folder else None
 
     # Fetch CYOAs from Grist
     api = GristAPIWrapper(server_url=SERVER_URL, document_id=DOCUMENT_ID, api_key=API_KEY)
@@ -101,8 +107,23 @@ def main(config: Dict, temporary_folder: pathlib.Path) -> None:
         for i, image_path in enumerate(image_paths):
             logger.info(f'Processing image {i + 1}/{len(image_paths)} in {official_title}...')
             cyoa_image = CyoaImage(image_path)
-            cyoa_image.make_chunks()
+
+            # Reuse the layout and OCR results if this page has been analysed before
+            # Pages already seen in other CYOAs (e.g. reposts and updates) are resolved to the same key
+            page_hash = page_registry.resolve(image_path) if page_cache else None
+            cache_key = page_cache.make_key(page_hash, OCR_PARAMS) if page_cache else None
+            cached = page_cache.load(cache_key) if page_cache else None
+            if cached is not None:
+                cyoa_image.ocr_from_arrays(cached)
+            else:
+                cyoa_image.make_chunks()
             all_text = all_text + " " + cyoa_image.get_text()
+            if page_cache and cached is None:
+                page_cache.save(cache_key, cyoa_image.ocr_to_arrays())
+                page_registry.register(page_hash)
+            for level, stats in cyoa_image.ocr_stats.items():
+                logger.info(f'Skipped {stats["skipped"]}/{stats["chunks"]} {level} chunks without text '
+                            f'({stats["skipped_pixels"]}/{stats["pixels"]} px).')
             page_count = page_count + 1
             total_pixels = total_pixels + cyoa_image.normalized_area(
                 max_tall_image=MAX_TALL_WIDTH,
@@ -145,6 +166,7 @@ if __name__ == "__main__":
     )
     parser.add_argument("-c", "--config_file", help="Configuration file to use")
     parser.add_argument("-t", "--temporary_folder", help="Folder to use to temporarily keep files")
+    parser.add_argument("-k", "--cache_folder", help="Folder to use to cache page analysis results (optional)")
 
     # Parse arguments
     args = parser.parse_args()
@@ -162,5 +184,6 @@ if __name__ == "__main__":
     # Pass to main function
     main(
         config,
-        pathlib.Path(args.temporary_folder)
+        pathlib.Path(args.temporary_folder),
+        pathlib.Path(args.cache_folder) if args.cache_folder else None
     )
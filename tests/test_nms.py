@@ -0,0 +1,52 @@
+"""Check KerasOCR.nonmaxima_suppression against the queue-based implementation it replaced."""
+import numpy as np
+import pytest
+
+from cyoa_archives.predictor.ocr import KerasOCR
+from cyoa_archives.predictor.roi import BoundingBox, ImageContext
+
+
+def queue_nms(rois, threshold):
+    """The previous implementation of KerasOCR.nonmaxima_suppression."""
+    keep_list = []
+    queue = rois
+    while len(queue) > 0:
+        this_item = queue[0]
+        queue_end = queue[1:]
+        intersect_set = BoundingBox.intersect_set(this_item, queue_end, threshold)
+        overlap_list = [queue_end[i] for i in np.where(intersect_set)[0]]
+        if overlap_list:
+            keep = BoundingBox.get_max_area_bbox(this_item, overlap_list)
+            queue = [queue_end[i] for i in np.where(~intersect_set)[0]] + [keep]
+        else:
+            keep_list.append(this_item)
+            queue = queue_end
+    return keep_list
+
+
+def make_page(n_words, rng, width=1200):
+    """Dense lines of word boxes, each detected two or three times with jittered coordinates."""
+    context = ImageContext(width, n_words * 10)
+    boxes = []
+    x, y = 0, 0
+    for i in range(n_words):
+        length = int(rng.integers(2, 10))
+        if x + length * 12 > width:
+            x, y = 0, y + 30
+        for copy in range(int(rng.integers(2, 4))):
+            dx, dy = rng.integers(-3, 4, size=2)
+            boxes.append(BoundingBox('x' * length, 0, 0, x + dx, x + dx + length * 12, y + dy, y + dy,
+                                     context=context))
+        x += length * 12 + 10
+    rng.shuffle(boxes)
+    return boxes
+
+
+@pytest.mark.parametrize('threshold', [0.5, 0.7])
+def test_same_as_queue_nms(threshold):
+    rng = np.random.default_rng(5)
+    for n_words in [200, 500]:
+        boxes = make_page(n_words, rng)
+        old = queue_nms(boxes, threshold)
+        new = KerasOCR.nonmaxima_suppression(boxes, threshold)
+        assert [id(box) for box in new] == [id(box) for box in boxes if any(box is kept for kept in old)]
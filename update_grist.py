@@ -4,6 +4,7 @@ Scrapes reddit for recent posts and updates the Grist Records table.
 
 Typical usage:
     python3 update_grist.py -c config.yaml -p [reddit password]
+    python3 update_grist.py -c config.yaml -p [reddit password] -r
 
 """
 __version__ = 0.3
@@ -16,17 +17,18 @@ from typing import Dict
 
 import yaml
 
-from cyoa_archives.grist.routine import praw_fetch_add_update
+from cyoa_archives.grist.routine import praw_fetch_add_update, praw_refresh_metrics
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def main(config: Dict, password: str) -> None:
+def main(config: Dict, password: str, refresh_metrics: bool = False) -> None:
     """Main method for the script.
 
     :param config: Dictionary of configuration values.
     :param password: Reddit password
+    :param refresh_metrics: Also refresh the metrics of every record (not only the latest posts).
     :return:
     """
 
@@ -36,6 +38,8 @@ def main(config: Dict, password: str) -> None:
 
     # Run loop
     praw_fetch_add_update(new_config)
+    if refresh_metrics:
+        praw_refresh_metrics(new_config)
 
 
 if __name__ == "__main__":
@@ -44,6 +48,8 @@ if __name__ == "__main__":
     )
     parser.add_argument("-c", "--config_file", help="Configuration file to use")
     parser.add_argument("-p", "--password", help="Reddit API account password")
+    parser.add_argument("-r", "--refresh_metrics", help="Refresh score and comments of all records",
+                        action='store_true')
 
     # Parse arguments
     args = parser.parse_args()
@@ -63,4 +69,5 @@ if __name__ == "__main__":
     main(
         config,
         args.password,
+        args.refresh_metrics,
     )